@@ -0,0 +1,169 @@
+"""
+Startup time and import count of the `auto-stash` CLI, per subcommand.
+
+    python benchmarks/bench_startup.py --runs 20 --check -o startup.json
+
+Each command runs in a fresh interpreter (HOME points at a temp dir, so nothing real
+is read or written): empty, and for the commands in SEEDED also once holding a
+tracking list and a roots file with a few repos under it. Reported: wall time over a bare interpreter
+running `pass`, and the modules the command loaded on top of it. With --check the
+exit status is 1 when a command goes over its budget in BUDGETS or loads a module
+it must not, so CI catches an eager import creeping back into the CLI.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Set, Tuple
+
+SRC = Path(__file__).resolve().parent.parent / "src"
+
+# Never loaded by the quick commands: YAML only once a config file exists, git and
+# the watcher only for commands that touch repos.
+HEAVY = ("yaml", "subprocess", "auto_stash.stash_watcher", "sqlite3", "json")
+
+# command -> (ms over a bare interpreter, modules over a bare interpreter, forbidden modules)
+# The times leave room for a slow CI machine; the module counts are the tight part.
+BUDGETS = {
+    "version": (80, 55, HEAVY),
+    "--help": (80, 55, HEAVY),
+    "list": (80, 55, HEAVY),
+    "rm /nonexistent": (80, 55, HEAVY),
+    "status": (120, 75, ("yaml", "subprocess", "auto_stash.stash_watcher", "sqlite3")),
+    "history -n 1": (150, 110, ("yaml", "subprocess", "auto_stash.stash_watcher")),
+}
+
+# Also timed against a seeded HOME, under the same budget: what they read grows
+# with the user's files, and an empty HOME would hide that.
+SEEDED = ("list",)
+
+# Runs the CLI in-process, then reports what got imported to the file named in argv[1].
+PROBE = """
+import sys
+report, argv = sys.argv[1], sys.argv[2:]
+sys.path.insert(0, {src!r})
+before = set(sys.modules)
+if argv:
+    from auto_stash.cli import main
+    sys.argv = ["auto-stash", *argv]
+    try:
+        main()
+    except SystemExit:
+        pass
+with open(report, "w") as f:
+    f.write("\\n".join(sorted(set(sys.modules) - before)))
+"""
+
+
+def run_once(argv: List[str], report: Path, env: dict) -> Tuple[float, Set[str]]:
+    code = PROBE.format(src=str(SRC))
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code, str(report), *argv], env=env,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+    elapsed = time.perf_counter() - start
+    modules = set(filter(None, report.read_text(encoding="utf-8").split("\n")))
+    return elapsed, modules
+
+
+def measure(argv: List[str], runs: int, report: Path, env: dict) -> dict:
+    times, modules = [], set()
+    for _ in range(runs):
+        t, modules = run_once(argv, report, env)
+        times.append(t)
+    return {"median_ms": statistics.median(times) * 1000, "min_ms": min(times) * 1000,
+            "modules": modules}
+
+
+def seed_home(home: Path):
+    """
+    A tracking list and a roots file, as `add` and `add -r` leave them, with a few
+    repos (bare .git directories are enough to be found) under the root.
+    """
+    conf = home / ".config" / "git-auto-stash"
+    conf.mkdir(parents=True)
+    root = home / "src"
+    for i in range(20):
+        (root / f"repo{i}" / ".git").mkdir(parents=True)
+    (conf / "tracklist.txt").write_text(f"{root / 'repo0'}\n", encoding="utf-8")
+    (conf / "roots.txt").write_text(f"{root}\n", encoding="utf-8")
+    # APPDATA is HOME in main(), so the same files serve Windows
+    (home / "GitAutoStash").mkdir()
+    for name in ("tracklist.txt", "roots.txt"):
+        (home / "GitAutoStash" / name).write_text((conf / name).read_text(encoding="utf-8"),
+                                                  encoding="utf-8")
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    p.add_argument("--runs", "-n", type=int, default=10, help="Interpreter launches per command.")
+    p.add_argument("--command", "-c", action="append", metavar="ARGS",
+                   help="Only these commands (repeatable), e.g. -c version -c list.")
+    p.add_argument("--check", action="store_true", help="Exit 1 when a budget is exceeded.")
+    p.add_argument("--output", "-o", type=Path, help="Write the JSON report here (default stdout).")
+    args = p.parse_args()
+
+    commands = args.command or list(BUDGETS)
+    failures = []
+    rows = []
+    with tempfile.TemporaryDirectory(prefix="auto-stash-startup-") as tmp:
+        empty, seeded = Path(tmp) / "empty", Path(tmp) / "seeded"
+        empty.mkdir()
+        seed_home(seeded)
+        env = dict(os.environ, HOME=str(empty), APPDATA=str(empty), PYTHONDONTWRITEBYTECODE="1")
+        report = Path(tmp) / "modules.txt"
+        # warm the bytecode cache, then the baseline every command is compared to
+        run_once(["version"], report, dict(env, PYTHONDONTWRITEBYTECODE=""))
+        base = measure([], args.runs, report, env)
+
+        runs = [(cmd, cmd, env) for cmd in commands]
+        runs += [(f"{cmd} (roots file)", cmd, dict(env, HOME=str(seeded), APPDATA=str(seeded)))
+                 for cmd in commands if cmd in SEEDED]
+        for label, cmd, cmd_env in runs:
+            res = measure(cmd.split(), args.runs, report, cmd_env)
+            over_ms = res["median_ms"] - base["median_ms"]
+            extra = sorted(res["modules"] - base["modules"])
+            row = {"command": label, "median_ms": round(res["median_ms"], 2),
+                   "min_ms": round(res["min_ms"], 2), "over_bare_ms": round(over_ms, 2),
+                   "modules": len(extra)}
+
+            budget = BUDGETS.get(cmd)
+            if budget is not None:
+                max_ms, max_modules, forbidden = budget
+                loaded = [m for m in forbidden if m in res["modules"]]
+                row.update({"budget_ms": max_ms, "budget_modules": max_modules, "forbidden_loaded": loaded})
+                if over_ms > max_ms:
+                    failures.append(f"{label}: {over_ms:.1f} ms over a bare interpreter (budget {max_ms})")
+                if len(extra) > max_modules:
+                    failures.append(f"{label}: {len(extra)} modules imported (budget {max_modules})")
+                if loaded:
+                    failures.append(f"{label}: imports {', '.join(loaded)}")
+            rows.append(row)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "runs": args.runs,
+        "bare_interpreter_ms": round(base["median_ms"], 2),
+        "commands": rows,
+        "failures": failures,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+    if args.check and failures:
+        for f in failures:
+            print(f"over budget: {f}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Benchmark watcher cycles against a generated repo farm, in-process.
+
+    python benchmarks/bench_watcher.py --repos 200 --cycles 5 --mutate-ratio 0.1 -o run.json
+
+Reports per-cycle wall time, git processes spawned per repo, stashes and loose
+objects written, and peak RSS (this process and its git children) as JSON, so two
+versions can be compared run against run.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from repo_farm import add_farm_arguments, make_farm, mutate_repo  # noqa: E402
+
+from auto_stash import stash_watcher as sw  # noqa: E402
+from auto_stash.cli import VERSION  # noqa: E402
+from auto_stash.metrics import GIT_COMMANDS, SNAPSHOT_BYTES, STASHES  # noqa: E402
+
+
+def count_loose_objects(repo: Path) -> int:
+    objects = repo / ".git" / "objects"
+    n = 0
+    try:
+        with os.scandir(objects) as it:
+            for d in it:
+                if len(d.name) == 2 and d.is_dir():
+                    n += len(os.listdir(d.path))
+    except OSError:
+        pass
+    return n
+
+
+def run_bench(paths, cycles: int, jobs: int, include_untracked: bool, fast_path: bool,
+              mutate_ratio: float, files: int, seed: int, state_file: Path,
+              backend: str = "stash", busy_quiet: float = 0.0) -> dict:
+    rng = random.Random(seed + 1)
+    # busy_quiet defaults to 0: the farm's indexes were all just written, and the
+    # watcher's default would defer every repo of the first cycles.
+    opts = sw.JobOptions(include_untracked, fast_path=fast_path, state_file=state_file,
+                         backend=backend, busy_quiet=busy_quiet)
+    stash_state = sw.build_stash_state(paths)
+    loose_before = sum(count_loose_objects(p) for p in paths)
+
+    rows = []
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for i in range(cycles):
+            if i and mutate_ratio:
+                for p in paths:
+                    if rng.random() < mutate_ratio:
+                        mutate_repo(p, rng, files)
+
+            spawns0, stashes0, bytes0 = GIT_COMMANDS.total(), STASHES.total(), SNAPSHOT_BYTES.total()
+            start = time.perf_counter()
+            results = sw.run_cycle(executor, paths, opts, stash_state)
+            elapsed = time.perf_counter() - start
+
+            statuses = {}
+            for r in results:
+                statuses[r.status] = statuses.get(r.status, 0) + 1
+            spawns = GIT_COMMANDS.total() - spawns0
+            rows.append({
+                "cycle": i + 1,
+                "seconds": round(elapsed, 4),
+                "git_spawns": int(spawns),
+                "spawns_per_repo": round(spawns / max(1, len(paths)), 3),
+                "stashes": int(STASHES.total() - stashes0),
+                "snapshot_bytes": int(SNAPSHOT_BYTES.total() - bytes0),
+                "statuses": statuses,
+            })
+
+    loose_after = sum(count_loose_objects(p) for p in paths)
+    secs = [r["seconds"] for r in rows]
+    return {
+        "cycles": rows,
+        "summary": {
+            "total_seconds": round(sum(secs), 4),
+            "mean_cycle_seconds": round(sum(secs) / len(secs), 4),
+            "max_cycle_seconds": max(secs),
+            "steady_cycle_seconds": round(sum(secs[1:]) / max(1, len(secs) - 1), 4) if len(secs) > 1 else secs[0],
+            "git_spawns": sum(r["git_spawns"] for r in rows),
+            "stashes": sum(r["stashes"] for r in rows),
+            "loose_objects_written": loose_after - loose_before,
+        },
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    add_farm_arguments(p)
+    p.add_argument("--farm", type=Path, help="Reuse/create the farm here instead of a temp dir\n"
+                                             "(reused only if made with the same farm arguments).")
+    p.add_argument("--cycles", type=int, default=5)
+    p.add_argument("--jobs", "-j", type=int, default=sw.DEFAULT_JOBS)
+    p.add_argument("--mutate-ratio", type=float, default=0.1,
+                   help="Share of repos edited between cycles.")
+    p.add_argument("--include-untracked", "-u", action="store_true")
+    p.add_argument("--no-fast-path", action="store_true")
+    p.add_argument("--backend", choices=["stash", "refs"], default="stash")
+    p.add_argument("--busy-quiet", type=float, default=0.0,
+                   help="Defer repos whose index is younger than this (seconds). The watcher\n"
+                        f"uses {sw.DEFAULT_BUSY_QUIET:g}; 0 here, since the farm was just written.")
+    p.add_argument("--output", "-o", type=Path, help="Write the JSON report here (default stdout).")
+    args = p.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="auto-stash-bench-") as tmp:
+        root = args.farm or Path(tmp) / "farm"
+        t0 = time.perf_counter()
+        try:
+            paths = make_farm(root, args.repos, args.files, args.tracked_size,
+                              args.untracked_size, args.dirty_ratio, args.seed)
+        except FileExistsError as e:
+            p.error(str(e))
+        setup = time.perf_counter() - t0
+
+        report = run_bench(paths, args.cycles, args.jobs, args.include_untracked,
+                           not args.no_fast_path, args.mutate_ratio, args.files, args.seed,
+                           Path(tmp) / "state.json", args.backend, args.busy_quiet)
+
+    report.update({
+        "version": VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {k: (str(v) if isinstance(v, Path) else v) for k, v in vars(args).items()},
+        "farm_setup_seconds": round(setup, 2),
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "children_peak_rss_kb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    })
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
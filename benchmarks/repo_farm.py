@@ -0,0 +1,122 @@
+"""
+Generate a reproducible farm of local git repos for benchmarking the watcher.
+
+    python benchmarks/repo_farm.py /tmp/farm --repos 200 --files 50 --dirty-ratio 0.2
+
+The same arguments (and --seed) always produce the same files and commits; running
+again with them reuses the farm already there.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+from pathlib import Path
+from typing import List
+
+# Fixed identity and dates so commit ids are reproducible.
+GIT_ENV = {
+    "GIT_AUTHOR_NAME": "bench",
+    "GIT_AUTHOR_EMAIL": "bench@example.invalid",
+    "GIT_COMMITTER_NAME": "bench",
+    "GIT_COMMITTER_EMAIL": "bench@example.invalid",
+    "GIT_AUTHOR_DATE": "2020-01-01T00:00:00 +0000",
+    "GIT_COMMITTER_DATE": "2020-01-01T00:00:00 +0000",
+}
+
+
+def _git(repo: Path, *args: str):
+    env = dict(os.environ, **GIT_ENV)
+    subprocess.run(["git", *args], cwd=str(repo), env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def _write(path: Path, size: int, rng: random.Random):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    line = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz0123456789 ") for _ in range(63)) + "\n"
+    reps, rest = divmod(size, len(line))
+    with open(path, "w", encoding="ascii") as f:
+        f.write(line * reps + line[:rest])
+
+
+def make_repo(repo: Path, rng: random.Random, files: int, tracked_size: int,
+              untracked_size: int, dirty: bool):
+    repo.mkdir(parents=True, exist_ok=True)
+    _git(repo, "init", "-q")
+
+    per_file = max(1, tracked_size // max(1, files))
+    for i in range(files):
+        _write(repo / f"dir{i % 8}" / f"file{i}.txt", per_file, rng)
+    _git(repo, "add", "-A")
+    _git(repo, "commit", "-q", "-m", "initial")
+
+    if untracked_size:
+        _write(repo / "untracked" / "blob.bin", untracked_size, rng)
+    if dirty:
+        mutate_repo(repo, rng, files)
+
+
+def mutate_repo(repo: Path, rng: random.Random, files: int):
+    """
+    Append a line to one tracked file, as a user edit would.
+    """
+    target = repo / f"dir{(rng.randrange(files)) % 8}"
+    candidates = sorted(target.glob("file*.txt")) or sorted(repo.glob("dir*/file*.txt"))
+    with open(rng.choice(candidates), "a", encoding="ascii") as f:
+        f.write(f"edit {rng.random()}\n")
+
+
+def make_farm(root: Path, repos: int, files: int = 50, tracked_size: int = 64 * 1024,
+              untracked_size: int = 0, dirty_ratio: float = 0.2, seed: int = 0) -> List[Path]:
+    """
+    Create the farm under `root`, or reuse the one already there if its farm.json
+    records the same parameters. Raises FileExistsError for any other existing farm
+    (including one whose generation was interrupted: farm.json is written last).
+    """
+    params = {"repos": repos, "files": files, "tracked_size": tracked_size,
+              "untracked_size": untracked_size, "dirty_ratio": dirty_ratio, "seed": seed}
+    paths = [root / f"repo{i:05d}" for i in range(repos)]
+    try:
+        with open(root / "farm.json", "r", encoding="utf-8") as f:
+            existing = json.load(f)
+    except FileNotFoundError:
+        existing = None
+    if existing == params:
+        return paths
+    if existing is not None or any(root.glob("repo*")):
+        raise FileExistsError(f"{root} holds a different or incomplete farm; remove it or pick another dir")
+
+    rng = random.Random(seed)
+    root.mkdir(parents=True, exist_ok=True)
+    dirty = set(rng.sample(range(repos), round(repos * dirty_ratio)))
+
+    for i, repo in enumerate(paths):
+        make_repo(repo, rng, files, tracked_size, untracked_size, i in dirty)
+
+    with open(root / "farm.json", "w", encoding="utf-8") as f:
+        json.dump(params, f)
+    return paths
+
+
+def add_farm_arguments(p: argparse.ArgumentParser):
+    p.add_argument("--repos", type=int, default=50, help="Number of repos.")
+    p.add_argument("--files", type=int, default=50, help="Tracked files per repo.")
+    p.add_argument("--tracked-size", type=int, default=64 * 1024, help="Tracked bytes per repo.")
+    p.add_argument("--untracked-size", type=int, default=0, help="Untracked bytes per repo.")
+    p.add_argument("--dirty-ratio", type=float, default=0.2, help="Share of repos left modified.")
+    p.add_argument("--seed", type=int, default=0)
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    p.add_argument("root", type=Path)
+    add_farm_arguments(p)
+    args = p.parse_args()
+
+    paths = make_farm(args.root, args.repos, args.files, args.tracked_size,
+                      args.untracked_size, args.dirty_ratio, args.seed)
+    print(f"{len(paths)} repos in {args.root}")
+
+
+if __name__ == "__main__":
+    main()
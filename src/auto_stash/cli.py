@@ -1,22 +1,38 @@
+"""
+Command line entry point.
+
+Shell prompts and editor integrations call `version`, `list` and friends many times
+a second, so only what every command needs is imported here: each command imports
+the rest itself, and YAML, git helpers and the watcher are only loaded by the
+commands that use them (see benchmarks/bench_startup.py).
+"""
 import argparse
-import yaml
-import pprint
 from pathlib import Path
-from .stash_watcher import (
+
+from .tracklist import (
+    _normalize_path,
+    default_config,
+    default_control_socket,
+    default_history_file,
+    default_rootsfile,
     default_trackfile,
+    load_config,
     load_tracklist,
-    add_to_tracklist,
     remove_from_tracklist,
-    run_watcher,
-    stash_clear,
-    load_config,
-    default_config,
-    init_config
+    remove_root,
 )
 
 APP_PROG = "auto-stash"
 VERSION = "0.1.0"
 
+def _shard_spec(value: str) -> str:
+    from .sharding import parse_shard
+    try:
+        parse_shard(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
+
 def build_parser():
     p = argparse.ArgumentParser(prog=APP_PROG,
                                 description=(
@@ -32,30 +48,85 @@ def build_parser():
                                 formatter_class=argparse.RawTextHelpFormatter
                                 )
     sub = p.add_subparsers(dest="cmd") #, required=True)
+    trackfile = str(default_trackfile())
 
     p_list = sub.add_parser("list", help="List all tracked folders.")
-    p_list.add_argument("--file", dest="trackfile", default=str(default_trackfile()))
+    p_list.add_argument("--file", dest="trackfile", default=trackfile)
+    p_list.add_argument("--scan", action="store_true",
+                        help="Also search each watch root and list the repos found under it.")
 
     p_add = sub.add_parser("add", help="Add a folder to tracked list.")
     p_add.add_argument("path")
-    p_add.add_argument("--file", dest="trackfile", default=str(default_trackfile()))
+    p_add.add_argument("--recursive", "-r", action="store_true",
+                       help="Add as a watch root: every git repo found under it is watched,\n"
+                            "including ones created or cloned there later.")
+    p_add.add_argument("--file", dest="trackfile", default=trackfile)
 
     p_rm = sub.add_parser("rm", aliases=["remove"], help="Remove a folder from tracked list.")
     p_rm.add_argument("path")
-    p_rm.add_argument("--file", dest="trackfile", default=str(default_trackfile()))
+    p_rm.add_argument("--recursive", "-r", action="store_true", help="Remove a watch root.")
+    p_rm.add_argument("--file", dest="trackfile", default=trackfile)
     
     p_watch = sub.add_parser("watch",
                              help="Watch tracked folders and automatically stash changes.\n"
                                   "If --cwd is provided, only that repository is watched\n"
                                   "and the tracking list is ignored.")
-    p_watch.add_argument("--fmt", choices=["pretty", "line"], help="Set output format: pretty or line.")
+    p_watch.add_argument("--fmt", choices=["pretty", "line", "delta", "jsonl"],
+                         help="Set output format: pretty, line, delta (only repos whose status changed),\n"
+                              "or jsonl (one JSON record per repo job and per cycle).")
+    p_watch.add_argument("--trace", metavar="FILE",
+                         help="Write a Chrome trace (chrome://tracing, Perfetto) of every cycle, job and git command.")
+    p_watch.add_argument("--quiet", "-q", action="store_true",
+                         help="Like --fmt delta, without the per-cycle summary line.")
     p_watch.add_argument("--cwd", help="Watch only the specified Git repo.")
-    p_watch.add_argument("--file", dest="trackfile", default=str(default_trackfile()))
-    p_watch.add_argument("--interval", "-i", metavar="", type=int, default=300, help="Set polling interval in secounds.")
+    p_watch.add_argument("--file", dest="trackfile", default=trackfile)
+    p_watch.add_argument("--interval", "-i", metavar="", type=int, help="Set base polling interval in secounds (default 300).")
     p_watch.add_argument("--include-untracked", "-u", action="store_true", help="Include untracked files when detecting changes.")
+    p_watch.add_argument("--mode", choices=["poll", "events"],
+                         help="poll: scan every interval. events: scan repos on filesystem changes (Linux inotify).")
+    p_watch.add_argument("--jobs", "-j", metavar="", type=int, help="Number of repositories processed in parallel.")
+    p_watch.add_argument("--root", action="append", default=[], metavar="DIR",
+                         help="Also watch every git repo under DIR (repeatable), on top of the saved roots.")
+    p_watch.add_argument("--shard", metavar="I/N", type=_shard_spec,
+                         help="Run as worker I of N: only stash this worker's share of the repos.\n"
+                              "Workers share heartbeats (sharding.dir) and take over the repos\n"
+                              "of a worker that stops.")
+
+    p_status = sub.add_parser("status", help="Show what the running watcher is doing, per repo.")
+    p_status.add_argument("repo", nargs="?", help="Only this repo.")
+    p_status.add_argument("--json", action="store_true", help="Print the raw reply.")
+    p_status.add_argument("--shard", metavar="I/N", type=_shard_spec, help="Talk to this worker.")
+
+    for name, text in (("trigger", "Run the stash job of a repo (default: all) now."),
+                       ("pause", "Stop running jobs for a repo (default: all)."),
+                       ("resume", "Resume jobs for a repo (default: all) and run them now.")):
+        p_ctl = sub.add_parser(name, help=f"{text}\nTalks to the running watcher.")
+        p_ctl.add_argument("repo", nargs="?")
+        p_ctl.add_argument("--shard", metavar="I/N", type=_shard_spec, help="Talk to this worker.")
+
+    p_snap = sub.add_parser("snapshots", help="List auto-stash snapshots of tracked folders (both backends).")
+    p_snap.add_argument("--cwd", help="Only list the specified Git repo.")
+    p_snap.add_argument("--file", dest="trackfile", default=trackfile)
+
+    p_hist = sub.add_parser("history", help="Search the snapshot history of every repo (from the local index).")
+    p_hist.add_argument("--repo", help="Only this repo.")
+    p_hist.add_argument("--since", metavar="TIME", help='e.g. "yesterday 14:00", "2024-05-02", "3h".')
+    p_hist.add_argument("--until", metavar="TIME")
+    p_hist.add_argument("--path", metavar="GLOB", help="Only snapshots that changed a matching path.")
+    p_hist.add_argument("--paths", action="store_true", help="List the changed paths of each snapshot.")
+    p_hist.add_argument("--limit", "-n", type=int, default=20)
+    p_hist.add_argument("--import", dest="import_", action="store_true",
+                        help="First index the snapshots already in the tracked repos.")
+    p_hist.add_argument("--file", dest="trackfile", default=trackfile)
+
+    p_restore = sub.add_parser("restore", help="Write a repo's files back as they were at a point in time.\n"
+                                               "Uncommitted changes are auto-stashed first.")
+    p_restore.add_argument("--at", required=True, metavar="TIME", help="Nearest snapshot at or before TIME.")
+    p_restore.add_argument("--repo", help="Repo to restore (default: the one containing the current dir).")
+    p_restore.add_argument("--yes", "-y", action="store_true", help="Don't ask for confirmation.")
 
     p_clear = sub.add_parser("clear", help="Clear all stashes in tracked folders.")
-    p_clear.add_argument("--file", dest="trackfile", default=str(default_trackfile()))
+    p_clear.add_argument("--file", dest="trackfile", default=trackfile)
 
     p_config = sub.add_parser("config", help="Show configutation.")
     sub_config = p_config.add_subparsers(dest="config_cmd")
@@ -74,6 +145,195 @@ def build_parser():
 
     return p
 
+def _when(ts):
+    import datetime
+    if ts is None:
+        return "-"
+    return datetime.datetime.fromtimestamp(ts).strftime("%H:%M:%S")
+
+def _print_status(reply: dict):
+    state = "paused" if reply.get("paused") else "running"
+    print(f"Watcher pid {reply.get('pid')} {state}, started {_when(reply.get('started'))}")
+    rows = [("REPO", "STATUS", "LAST RUN", "NEXT DUE", "STASH")]
+    for r in reply.get("repos", []):
+        status = r.get("status") or "-"
+        if r.get("paused"):
+            status += " (paused)"
+        rows.append((r["repo"], status, _when(r.get("last_run")), _when(r.get("next_due")),
+                     (r.get("stash_id") or "-")[:8]))
+    widths = [max(len(row[i]) for row in rows) for i in range(4)]
+    for row in rows:
+        print("  ".join(c.ljust(w) for c, w in zip(row, widths)) + "  " + row[4])
+
+def control(cmd: str, repo=None, as_json: bool = False, shard=None) -> int:
+    import json
+    from .control import ControlUnavailable, request
+
+    sock = default_control_socket(load_config(), shard)
+    if sock is None:
+        print("Control socket is disabled (global.control_socket)")
+        return 1
+    req = {"cmd": cmd}
+    if repo:
+        req["repo"] = _normalize_path(repo)
+    try:
+        reply = request(sock, req)
+    except ControlUnavailable as e:
+        print(f"Not running: {e}")
+        return 1
+    except (OSError, ValueError) as e:
+        print(f"Failed to reach the watcher on {sock}: {e}")
+        return 1
+
+    if not reply.get("ok"):
+        print(reply.get("error", "failed"))
+        return 1
+    if as_json:
+        print(json.dumps(reply, indent=1))
+    elif cmd == "status":
+        _print_status(reply)
+    elif cmd == "trigger":
+        print(f"Triggered {reply['triggered']} repo(s)")
+    else:
+        paused = reply.get("paused_repos") or []
+        print(("All repos paused" if reply.get("paused") else "Running")
+              + (f"; paused: {', '.join(paused)}" if paused else ""))
+    return 0
+
+def _stamp(ts) -> str:
+    import datetime
+    return datetime.datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S")
+
+def _open_history(data: dict):
+    from .history import History
+
+    hf = default_history_file(data)
+    if hf is None:
+        print("History is disabled (history.enabled)")
+        return None
+    return History(hf)
+
+def history_cmd(args) -> int:
+    import fnmatch
+    import sqlite3
+    from .history import parse_when
+
+    data = load_config()
+    history = _open_history(data)
+    if history is None:
+        return 1
+    try:
+        if args.import_:
+            from .stash_watcher import build_discovery, configure_git_timeouts, import_history
+            configure_git_timeouts(data.get("timeouts"))
+            tf = Path(args.trackfile)
+            paths = load_tracklist(tf)
+            roots = load_tracklist(default_rootsfile(tf))
+            if roots:
+                paths += [p for p in build_discovery(data).scan(roots) if p not in paths]
+            print(f"Indexed {import_history(history, paths)} snapshot(s) from {len(paths)} repo(s)")
+
+        rows = history.query(
+            repo=_normalize_path(args.repo) if args.repo else None,
+            since=parse_when(args.since) if args.since else None,
+            until=parse_when(args.until) if args.until else None,
+            path_glob=args.path,
+            limit=args.limit,
+        )
+        for r in rows:
+            print(f"{_stamp(r['ts'])}  {r['stash'][:8]}  {r['repo']}" + (f"  {r['ref']}" if r["ref"] else ""))
+            if args.paths or args.path:
+                for p in history.paths(r["id"]):
+                    if not args.path or fnmatch.fnmatchcase(p, args.path):
+                        print(f"    {p}")
+        if not rows:
+            print("No snapshots found")
+    except ValueError as e:
+        print(e)
+        return 1
+    except sqlite3.Error as e:
+        print(f"History unavailable ({history.file}): {e}")
+        return 1
+    finally:
+        history.close()
+    return 0
+
+def restore_cmd(args) -> int:
+    import datetime
+    import sqlite3
+    import subprocess
+    from .history import parse_when
+    from .stash_watcher import (
+        JobOptions,
+        RepoState,
+        _record_history,
+        configure_git_timeouts,
+        do_stash_job,
+        has_changes,
+        restore_snapshot,
+        snapshot_commit_exists,
+    )
+
+    data = load_config()
+    history = _open_history(data)
+    if history is None:
+        return 1
+    configure_git_timeouts(data.get("timeouts"))
+    try:
+        when = parse_when(args.at)
+        repo = _normalize_path(args.repo) if args.repo else history.repo_of(Path.cwd().resolve())
+        if repo is None:
+            print(f"No snapshots indexed for {Path.cwd()} (try --repo, or history --import)")
+            return 1
+
+        snap = None
+        candidates = history.at(repo, when)
+        for cand in candidates:
+            # The index may outlive a snapshot (retention, `clear`): take the nearest one left.
+            if snapshot_commit_exists(Path(repo), cand["stash"]):
+                snap = cand
+                break
+        if snap is None:
+            print(f"No snapshot of {repo} at or before {_stamp(when)}"
+                  + (" still exists" if candidates else ""))
+            return 1
+
+        n = len(history.paths(snap["id"]))
+        print(f"{repo}: snapshot {snap['stash'][:8]} from {_stamp(snap['ts'])} ({n} changed path(s))")
+        path = Path(repo)
+        dirty = has_changes(path, include_untracked=True)
+        if dirty:
+            print("Uncommitted changes will be auto-stashed first.")
+        if not args.yes and input("Write its files into the work tree? [y/N] ").strip().lower() not in ("y", "yes"):
+            print("Aborted")
+            return 1
+
+        if dirty:
+            opts = JobOptions.from_config(data, True)
+            res = do_stash_job(path, True, RepoState(), fast_path=False, backend=opts.backend_for(path),
+                               untracked=opts.untracked)
+            if res.status == "STASHED":
+                _record_history(history, [res], datetime.datetime.now().timestamp())
+                print(f"Current changes saved as {(res.stash_id or '?')[:8]}")
+            elif res.status != "NO_CHANGES":
+                print(f"Not restoring, current changes could not be saved: {res.status} {res.detail or ''}")
+                return 1
+
+        restore_snapshot(path, snap["stash"])
+        print(f"Restored {repo} to {_stamp(snap['ts'])} (nothing staged; newer files left in place)")
+    except subprocess.CalledProcessError as e:
+        print(f"Restore failed: {(e.stderr or '').strip() or e}")
+        return 1
+    except ValueError as e:
+        print(e)
+        return 1
+    except sqlite3.Error as e:
+        print(f"History unavailable ({history.file}): {e}")
+        return 1
+    finally:
+        history.close()
+    return 0
+
 def main():
     parser = build_parser()
     # parser.add_argument("--log-file", default=None, help="Log file path")  # 若不給就用標準輸出/系統日誌
@@ -92,33 +352,93 @@ def main():
             for p in items:
                 print(p)
 
+        roots = load_tracklist(default_rootsfile(tf))
+        if roots:
+            print(f"\nRoots: {default_rootsfile(tf)}\n---")
+            if not args.scan:
+                # searching the roots needs the watcher and a directory walk: opt-in only
+                for root in roots:
+                    print(root)
+            else:
+                from .stash_watcher import build_discovery
+                discovery = build_discovery(load_config())
+                for root in roots:
+                    repos = discovery.scan([root])
+                    print(f"{root} ({len(repos)} repos)")
+                    for p in repos:
+                        print(f"  {p}")
+
     elif args.cmd == "add":
+        from .stash_watcher import add_root, add_to_tracklist
         tf = Path(args.trackfile)
-        ok, msg = add_to_tracklist(tf, args.path)
-        print(msg)
+        if args.recursive:
+            ok, msg, repos = add_root(default_rootsfile(tf), args.path)
+            print(msg)
+            for p in repos:
+                print(f"  {p}")
+        else:
+            ok, msg = add_to_tracklist(tf, args.path)
+            print(msg)
         
     elif args.cmd == "rm":
         tf = Path(args.trackfile)
-        ok, msg = remove_from_tracklist(tf, args.path)
+        if args.recursive:
+            ok, msg = remove_root(default_rootsfile(tf), args.path)
+        else:
+            ok, msg = remove_from_tracklist(tf, args.path)
         print(msg)
 
     elif args.cmd == "watch":
+        from .stash_watcher import run_watcher
 
+        tf = rf = None
+        roots = []
         if args.cwd:
-            print("cwd", args.cwd)
             paths = [Path(args.cwd)]
         else:
             tf = Path(args.trackfile)
+            rf = default_rootsfile(tf)
             paths = load_tracklist(tf)
+            roots = [Path(r).resolve() for r in args.root]
 
         run_watcher(
             paths = paths,
             interval=args.interval,
             include_untracked=args.include_untracked,
-            fmt=args.fmt
+            fmt="quiet" if args.quiet else args.fmt,
+            jobs=args.jobs,
+            mode=args.mode,
+            roots=roots,
+            trackfile=tf,
+            rootsfile=rf,
+            shard=args.shard,
+            trace=Path(args.trace).expanduser() if args.trace else None,
         )
         
+    elif args.cmd in ("status", "trigger", "pause", "resume"):
+        return control(args.cmd, args.repo, getattr(args, "json", False), args.shard)
+
+    elif args.cmd == "snapshots":
+        from .stash_watcher import list_snapshots
+        paths = [Path(args.cwd).resolve()] if args.cwd else load_tracklist(Path(args.trackfile))
+        for p in paths:
+            try:
+                snaps = list_snapshots(p)
+            except Exception as e:
+                print(f"{p}\n  error: {e}")
+                continue
+            print(f"{p} ({len(snaps)})")
+            for s in snaps:
+                print(f"  {s['id'][:8]}  {s['ref']:<36}  {s['message']}")
+
+    elif args.cmd == "history":
+        return history_cmd(args)
+
+    elif args.cmd == "restore":
+        return restore_cmd(args)
+
     elif args.cmd == "clear":
+        from .stash_watcher import stash_clear
         tf = Path(args.trackfile)
         paths = load_tracklist(tf)
         stash_clear(paths)
@@ -129,6 +449,9 @@ def main():
             parser._subparsers._group_actions[0].choices["config"].print_help()
             return 0
         
+        import yaml
+        from .stash_watcher import init_config
+
         cf = Path(default_config())
         data = load_config(cf)
         if not data:
@@ -0,0 +1,272 @@
+"""
+Local control socket of a running watcher.
+
+The watcher keeps a small in-memory view of every repo (last result, last stash,
+next due time) in a `Control`; a Unix-domain socket server answers from it, one JSON
+object per line each way, without touching git or the disk:
+
+  {"cmd": "status"}                       -> {"ok": true, "paused": false, "repos": [...]}
+  {"cmd": "trigger", "repo": "/path"}     -> run that repo (or every repo) now
+  {"cmd": "pause" | "resume", "repo": ...} -> stop / restart jobs for one repo or all
+
+Commands are only queued here; the watcher loop applies them between cycles.
+"""
+import json
+import os
+import select
+import socket
+import socketserver
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+MAX_REQUEST = 64 * 1024
+
+
+class ControlUnavailable(OSError):
+    pass
+
+
+class Control:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.paused = False
+        self._paused_repos: Set[str] = set()
+        self._triggers: Dict[str, None] = {}
+        self._repos: Dict[str, dict] = {}
+        # self-pipe: lets a command wake the watcher out of its sleep / select. A socket
+        # pair rather than os.pipe(), since select() only takes sockets on Windows.
+        self._rsock, self._wsock = socket.socketpair()
+        self._rsock.setblocking(False)
+        self._wsock.setblocking(False)
+
+    # ---- watcher side ----
+    @property
+    def wake_fd(self) -> int:
+        return self._rsock.fileno()
+
+    def drain(self):
+        try:
+            while self._rsock.recv(512):
+                pass
+        except BlockingIOError:
+            pass
+
+    def wait(self, timeout: float):
+        """
+        Sleep up to `timeout` seconds, or until a command arrives.
+        """
+        select.select([self._rsock], [], [], max(0.0, timeout))
+        self.drain()
+
+    def _wake(self):
+        try:
+            self._wsock.send(b"x")
+        except BlockingIOError:
+            pass   # already pending
+
+    def set_repos(self, paths: Iterable[Path], stash_state: Optional[dict] = None):
+        """
+        Make the view match the watched repos; repos that stay keep their entry.
+        """
+        stash_state = stash_state or {}
+        with self._lock:
+            keep = {}
+            for p in paths:
+                key = str(p)
+                rec = self._repos.get(key)
+                if rec is None:
+                    st = stash_state.get(p)
+                    rec = {"repo": key, "status": None, "detail": None, "last_run": None,
+                           "next_due": None, "stash_id": getattr(st, "stash_id", None),
+                           "message": None}
+                keep[key] = rec
+            self._repos = keep
+            self._paused_repos &= set(keep)
+
+    def record(self, results: list, at: float):
+        # `results`: the cycle's JobResults (repo, status, detail, stash_id, message)
+        with self._lock:
+            for r in results:
+                rec = self._repos.get(r.repo)
+                if rec is None:
+                    continue
+                rec["status"] = r.status
+                rec["detail"] = r.detail
+                rec["last_run"] = at
+                if r.stash_id:
+                    rec["stash_id"] = r.stash_id
+                    rec["message"] = r.message
+
+    def set_due(self, path: Path, due: Optional[float]):
+        with self._lock:
+            rec = self._repos.get(str(path))
+            if rec is not None:
+                rec["next_due"] = due
+
+    def take_triggers(self) -> List[Path]:
+        with self._lock:
+            out = [Path(k) for k in self._triggers]
+            self._triggers.clear()
+        return out
+
+    def is_paused(self, path: Path) -> bool:
+        return self.paused or str(path) in self._paused_repos
+
+    # ---- socket side ----
+    def _targets(self, repo: Optional[str]) -> List[str]:
+        if repo is None:
+            return list(self._repos)
+        if repo not in self._repos:
+            raise KeyError(repo)
+        return [repo]
+
+    def handle(self, req: dict) -> dict:
+        cmd = req.get("cmd")
+        repo = req.get("repo")
+        with self._lock:
+            try:
+                if cmd == "status":
+                    repos = [dict(r, paused=r["repo"] in self._paused_repos)
+                             for r in (self._repos.values() if repo is None
+                                       else [self._repos[k] for k in self._targets(repo)])]
+                    return {"ok": True, "pid": os.getpid(), "started": self.started,
+                            "paused": self.paused, "repos": repos}
+
+                if cmd == "trigger":
+                    targets = self._targets(repo)
+                    for k in targets:
+                        self._triggers[k] = None
+                    self._wake()
+                    return {"ok": True, "triggered": len(targets)}
+
+                if cmd in ("pause", "resume"):
+                    pause = cmd == "pause"
+                    if repo is None:
+                        self.paused = pause
+                        if not pause:
+                            self._paused_repos.clear()
+                    else:
+                        (self._paused_repos.add if pause else self._paused_repos.discard)(
+                            self._targets(repo)[0])
+                    if not pause:
+                        # catch up on whatever was skipped while paused
+                        for k in self._targets(repo):
+                            self._triggers[k] = None
+                    self._wake()
+                    return {"ok": True, "paused": self.paused, "paused_repos": sorted(self._paused_repos)}
+
+            except KeyError:
+                return {"ok": False, "error": f"not watched: {repo}"}
+        return {"ok": False, "error": f"unknown command: {cmd}"}
+
+    def close(self):
+        self._rsock.close()
+        self._wsock.close()
+
+
+# -------------- server / client --------------
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            self._serve()
+        except ConnectionError:
+            pass   # the client went away
+
+    def _serve(self):
+        while True:
+            # bounded: a client that never sends a newline can't make us buffer it all
+            line = self.rfile.readline(MAX_REQUEST + 1)
+            if not line:
+                return
+            if len(line) > MAX_REQUEST:
+                self._reply({"ok": False, "error": "request too large"})
+                return
+            try:
+                req = json.loads(line)
+                resp = self.server.control.handle(req if isinstance(req, dict) else {})
+            except ValueError as e:
+                resp = {"ok": False, "error": f"bad request: {e}"}
+            self._reply(resp)
+
+    def _reply(self, resp: dict):
+        self.wfile.write(json.dumps(resp).encode("utf-8") + b"\n")
+
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+    class _Server(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+        def __init__(self, path: str, control: Control):
+            self.control = control
+            super().__init__(path, _Handler)
+
+
+def _is_live(path: Path) -> bool:
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.settimeout(1.0)
+        s.connect(str(path))
+        return True
+    except OSError:
+        return False
+    finally:
+        s.close()
+
+def serve(path: Path, control: Control):
+    """
+    Serve `control` on `path` from a daemon thread. The socket is only accessible to
+    the current user. Raises OSError when another watcher already answers there.
+    """
+    if not hasattr(socket, "AF_UNIX") or not hasattr(socketserver, "ThreadingUnixStreamServer"):
+        raise ControlUnavailable("Unix-domain sockets are not supported here")
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.exists() or path.is_symlink():
+        if _is_live(path):
+            raise ControlUnavailable(f"another watcher is listening on {path}")
+        path.unlink()   # left behind by a watcher that died
+
+    old = os.umask(0o077)
+    try:
+        server = _Server(str(path), control)
+    finally:
+        os.umask(old)
+    t = threading.Thread(target=server.serve_forever, name="auto-stash-control", daemon=True)
+    t.start()
+    return server
+
+def shutdown(server, path: Path):
+    server.shutdown()
+    server.server_close()
+    try:
+        path.unlink()
+    except OSError:
+        pass
+
+def request(path: Path, req: dict, timeout: float = 5.0) -> dict:
+    """
+    Send one command to the watcher listening on `path`.
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        raise ControlUnavailable("Unix-domain sockets are not supported here")
+
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(timeout)
+    try:
+        try:
+            s.connect(str(path))
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            raise ControlUnavailable(f"no watcher is running ({path})") from e
+        s.sendall(json.dumps(req).encode("utf-8") + b"\n")
+        buf = b""
+        while not buf.endswith(b"\n"):
+            chunk = s.recv(1 << 16)
+            if not chunk:
+                break
+            buf += chunk
+    finally:
+        s.close()
+    return json.loads(buf)
@@ -0,0 +1,121 @@
+"""
+Find git repos under workspace roots.
+
+The walk uses `os.scandir`, never follows symlinks, stops descending at a directory
+holding `.git` and skips well-known heavy directories. Every visited directory is
+cached with its mtime: a directory's mtime only moves when entries are added to or
+removed from it (a checkout appearing or vanishing, `git init`), so a rescan only
+lists directories whose mtime changed and reuses the cached listing for the rest.
+"""
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_SKIP = frozenset({
+    "node_modules", ".venv", "venv", "__pycache__", ".tox", ".nox", ".mypy_cache",
+    ".pytest_cache", ".cache", ".gradle", ".terraform", "target",
+})
+DEFAULT_MAX_DEPTH = 8
+# A directory changed this close to the scan may change again within the same mtime tick.
+RACY_NS = 2 * 1_000_000_000
+
+DirRecord = Tuple[int, bool, List[str]]   # (mtime ns, holds .git, subdirectory names)
+
+
+class RepoDiscovery:
+    def __init__(self, cache_file: Optional[Path] = None, skip: Iterable[str] = DEFAULT_SKIP,
+                 max_depth: int = DEFAULT_MAX_DEPTH):
+        self.cache_file = cache_file
+        self.skip = frozenset(skip)
+        self.max_depth = max_depth
+        self._dirs: Dict[str, DirRecord] = self._load()
+        self.listed = 0   # directories actually listed by the last scan
+
+    def _load(self) -> Dict[str, DirRecord]:
+        if self.cache_file is None or not self.cache_file.exists():
+            return {}
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return {d: (int(m), bool(r), list(c)) for d, (m, r, c) in data.get("dirs", {}).items()}
+        except (OSError, ValueError, TypeError, AttributeError):
+            return {}
+
+    def _save(self):
+        if self.cache_file is None:
+            return
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.cache_file.with_suffix(self.cache_file.suffix + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "dirs": self._dirs}, f, separators=(",", ":"))
+        tmp.replace(self.cache_file)
+
+    def _list(self, d: str) -> Optional[Tuple[bool, List[str]]]:
+        self.listed += 1
+        children = []
+        try:
+            with os.scandir(d) as it:
+                for e in it:
+                    if e.name == ".git":
+                        return True, []
+                    if e.name not in self.skip and e.is_dir(follow_symlinks=False):
+                        children.append(e.name)
+        except OSError:
+            return None
+        children.sort()
+        return False, children
+
+    def scan(self, roots: Iterable[Path]) -> List[Path]:
+        """
+        Repos under `roots` (a root that is itself a repo counts), in walk order.
+        """
+        roots = list(roots)
+        started = time.time_ns()
+        old = self._dirs
+        new: Dict[str, DirRecord] = {}
+        repos: List[Path] = []
+        self.listed = 0
+
+        for root in roots:
+            stack = [(str(root), 0)]
+            while stack:
+                d, depth = stack.pop()
+                if d in new:
+                    continue   # overlapping roots
+                try:
+                    mtime = os.stat(d).st_mtime_ns
+                except OSError:
+                    continue
+
+                rec = old.get(d)
+                if rec is not None and rec[0] == mtime:
+                    is_repo, children = rec[1], rec[2]
+                else:
+                    listed = self._list(d)
+                    if listed is None:
+                        continue
+                    is_repo, children = listed
+                # -1 never matches, so a directory touched during the scan is listed again.
+                new[d] = (mtime if mtime < started - RACY_NS else -1, is_repo, children)
+
+                if is_repo:
+                    repos.append(Path(d))
+                elif depth < self.max_depth:
+                    stack.extend((os.path.join(d, c), depth + 1) for c in reversed(children))
+
+        # Keep what other roots cached, so scanning one root doesn't evict the rest.
+        prefixes = tuple(os.path.join(str(r), "") for r in roots)
+        for d, rec in old.items():
+            if d not in new and not (d + os.sep).startswith(prefixes):
+                new[d] = rec
+
+        changed = new != old
+        self._dirs = new
+        if changed:
+            try:
+                self._save()
+            except OSError:
+                pass
+        return repos
@@ -0,0 +1,325 @@
+"""
+Pure-Python reader for `.git/index` (versions 2-4) and a stat-based "nothing moved"
+check used to skip `git status` for repos untouched since the previous cycle.
+
+The check never says "changed"; it says either "provably unchanged" or "don't know",
+and the caller falls back to git for the latter.
+"""
+import os
+import struct
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+_HEADER = struct.Struct(">4sII")
+_ENTRY = struct.Struct(">10I")          # ctime s/ns, mtime s/ns, dev, ino, mode, uid, gid, size
+_FLAGS = struct.Struct(">H")
+
+_FLAG_ASSUME_VALID = 0x8000
+_FLAG_EXTENDED = 0x4000
+_FLAG_STAGE = 0x3000
+_XFLAG_SKIP_WORKTREE = 0x4000
+_XFLAG_INTENT_TO_ADD = 0x2000
+
+_MODE_TYPE = 0o170000
+_MODE_GITLINK = 0o160000
+_MODE_DIR = 0o040000
+
+# Files modified this close to the snapshot may share an mtime with a later edit.
+RACY_NS = 2 * 1_000_000_000
+
+StatKey = Tuple[int, int, int, int]   # (mtime s, mtime ns, size, ino), truncated like git does
+
+
+class UnsupportedIndex(Exception):
+    pass
+
+
+# -------------- git dir layout --------------
+def resolve_git_dir(worktree: Path) -> Optional[Path]:
+    """
+    `.git` directory of `worktree`, following the `gitdir:` file used by linked
+    worktrees and submodules. Only looks at `worktree` itself, not its parents.
+    """
+    dot_git = worktree / ".git"
+    if dot_git.is_dir():
+        return dot_git
+    if dot_git.is_file():
+        try:
+            line = dot_git.read_text(encoding="utf-8").strip()
+        except OSError:
+            return None
+        if line.startswith("gitdir:"):
+            target = Path(line[len("gitdir:"):].strip())
+            if not target.is_absolute():
+                target = worktree / target
+            return Path(os.path.normpath(target))
+    return None
+
+def common_dir(git_dir: Path) -> Path:
+    try:
+        rel = (git_dir / "commondir").read_text(encoding="utf-8").strip()
+    except OSError:
+        return git_dir
+    p = Path(rel)
+    return Path(os.path.normpath(p if p.is_absolute() else git_dir / p))
+
+def worktree_id(git_dir: Path) -> Optional[str]:
+    """
+    Name of a linked worktree's admin dir (`<common dir>/worktrees/<id>`); None for a
+    main worktree or a submodule, whose refs are their own.
+    """
+    cdir = common_dir(git_dir)
+    if cdir == git_dir or git_dir.parent != cdir / "worktrees":
+        return None
+    return git_dir.name
+
+def _oid_len(git_dir: Path) -> int:
+    try:
+        cfg = (common_dir(git_dir) / "config").read_text(encoding="utf-8", errors="replace").lower()
+    except OSError:
+        return 20
+    return 32 if "objectformat = sha256" in cfg else 20
+
+def _stat_key_of(st: os.stat_result) -> StatKey:
+    return (
+        (st.st_mtime_ns // 1_000_000_000) & 0xffffffff,
+        st.st_mtime_ns % 1_000_000_000,
+        st.st_size & 0xffffffff,
+        st.st_ino & 0xffffffff,
+    )
+
+def _file_key(path: Path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+def head_key(git_dir: Path):
+    """
+    Cheap identity of HEAD: its content plus the stat of the ref it points to.
+    refs/stash is included too, since the watcher compares against the last stash.
+    """
+    try:
+        head = (git_dir / "HEAD").read_text(encoding="utf-8").strip()
+    except OSError:
+        return None
+
+    cdir = common_dir(git_dir)
+    ref_key = None
+    if head.startswith("ref:"):
+        ref_key = _file_key(cdir / head[4:].strip())
+    return (head, ref_key, _file_key(cdir / "packed-refs"), _file_key(cdir / "refs" / "stash"))
+
+# Entries of the (per-worktree) git dir that mean the user's own git is mid-operation.
+BUSY_MARKERS = (
+    ("index.lock", "index locked by another git process"),
+    ("rebase-merge", "rebase in progress"),
+    ("rebase-apply", "rebase or am in progress"),
+    ("MERGE_HEAD", "merge in progress"),
+    ("CHERRY_PICK_HEAD", "cherry-pick in progress"),
+    ("REVERT_HEAD", "revert in progress"),
+    ("BISECT_LOG", "bisect in progress"),
+)
+STALE_LOCK = 600.0  # second; an older index.lock was left behind by a git that died
+
+def busy_reason(git_dir: Path, quiet: float = 0.0, own_index_ns: Optional[int] = None) -> Optional[str]:
+    """
+    Why the user's git is probably busy in `git_dir`, or None. One directory listing,
+    plus a stat of the index when `quiet` asks to also wait for an index written less
+    than `quiet` seconds ago (other than by us: `own_index_ns` is the mtime we left).
+    """
+    try:
+        names = set(os.listdir(git_dir))
+    except OSError:
+        return None
+
+    now_ns = time.time_ns()
+    for name, reason in BUSY_MARKERS:
+        if name not in names:
+            continue
+        if name == "index.lock":
+            key = _file_key(git_dir / name)
+            if key is None or now_ns - key[2] > STALE_LOCK * 1e9:
+                continue
+        return reason
+
+    if quiet > 0:
+        key = _file_key(git_dir / "index")
+        if key is not None and key[2] != own_index_ns and now_ns - key[2] < quiet * 1e9:
+            return f"index written {(now_ns - key[2]) / 1e9:.1f}s ago"
+    return None
+
+
+# -------------- index parsing --------------
+def _read_varint(buf: bytes, p: int) -> Tuple[int, int]:
+    c = buf[p]
+    p += 1
+    val = c & 0x7f
+    while c & 0x80:
+        val += 1
+        c = buf[p]
+        p += 1
+        val = (val << 7) + (c & 0x7f)
+    return val, p
+
+def read_index(index_file: Path, oid_len: int = 20) -> List[Tuple[str, StatKey, int]]:
+    """
+    Parse the index into [(path, stat key, mode), ...].
+    Raises UnsupportedIndex for anything the fast path must not reason about:
+    unknown versions, split or sparse indexes, conflicts, intent-to-add entries.
+    Skip-worktree / assume-valid entries are left out, as git does not stat them.
+    """
+    with open(index_file, "rb") as f:
+        buf = f.read()
+
+    if len(buf) < _HEADER.size:
+        raise UnsupportedIndex("truncated index")
+    sig, version, count = _HEADER.unpack_from(buf, 0)
+    if sig != b"DIRC" or version not in (2, 3, 4):
+        raise UnsupportedIndex(f"index version {version}")
+
+    entries: List[Tuple[str, StatKey, int]] = []
+    p = _HEADER.size
+    prev_name = b""
+
+    for _ in range(count):
+        start = p
+        fields = _ENTRY.unpack_from(buf, p)
+        p += _ENTRY.size + oid_len
+        (flags,) = _FLAGS.unpack_from(buf, p)
+        p += 2
+
+        xflags = 0
+        if version >= 3 and flags & _FLAG_EXTENDED:
+            (xflags,) = _FLAGS.unpack_from(buf, p)
+            p += 2
+
+        if version == 4:
+            strip, p = _read_varint(buf, p)
+            end = buf.index(b"\0", p)
+            name = prev_name[:len(prev_name) - strip] + buf[p:end]
+            p = end + 1
+        else:
+            end = buf.index(b"\0", p)
+            name = buf[p:end]
+            # entries are NUL-padded to a multiple of 8 bytes
+            p = start + ((end - start + 8) // 8) * 8
+        prev_name = name
+
+        if flags & _FLAG_STAGE:
+            raise UnsupportedIndex("unmerged entries")
+        if xflags & _XFLAG_INTENT_TO_ADD:
+            raise UnsupportedIndex("intent-to-add entries")
+        if flags & _FLAG_ASSUME_VALID or xflags & _XFLAG_SKIP_WORKTREE:
+            continue
+
+        mode = fields[6]
+        if mode & _MODE_TYPE in (_MODE_GITLINK, _MODE_DIR):
+            raise UnsupportedIndex("submodule or sparse directory entries")
+
+        key = (fields[2], fields[3], fields[9], fields[5])
+        entries.append((os.fsdecode(name), key, mode))
+
+    # Required (lower-case) extensions change what the entries mean, e.g. `link`, `sdir`.
+    while p + 8 <= len(buf) - oid_len:
+        ext, size = struct.unpack_from(">4sI", buf, p)
+        if b"a"[0] <= ext[0] <= b"z"[0]:
+            raise UnsupportedIndex(f"index extension {ext.decode('ascii', 'replace')}")
+        p += 8 + size
+
+    return entries
+
+
+# -------------- snapshots --------------
+class IndexSnapshot:
+    """
+    Stat picture of a work tree taken just before git inspected it.
+
+    `entries` mirrors the index; `dirty` holds the current key (None = missing) of every
+    tracked file whose stat did not match its index entry at that time.
+    """
+    __slots__ = ("index_key", "head_key", "entries", "dirty")
+
+    def __init__(self, index_key, head_key, entries, dirty):
+        self.index_key = index_key
+        self.head_key = head_key
+        self.entries: List[Tuple[str, StatKey, int]] = entries
+        self.dirty: Dict[str, Optional[StatKey]] = dirty
+
+
+def _worktree_stat(worktree: Path, rel: str, mode: int) -> Tuple[Optional[StatKey], int]:
+    """
+    (stat key, full mtime in ns) of a tracked path; (None, 0) when it is missing.
+    """
+    try:
+        st = os.lstat(os.path.join(worktree, rel))
+    except OSError:
+        return None, 0
+    key = _stat_key_of(st)
+    # An exec-bit flip is a change git reports; fold it into the key.
+    if bool(st.st_mode & 0o100) != bool(mode & 0o100):
+        key = key[:3] + (-1,)
+    return key, st.st_mtime_ns
+
+def take_snapshot(worktree: Path, prev: Optional[IndexSnapshot] = None) -> Optional[IndexSnapshot]:
+    """
+    Record the stat picture of `worktree`, or None if the fast path cannot be used here.
+    `prev` lets an unchanged index be reused instead of parsed again.
+    """
+    git_dir = resolve_git_dir(worktree)
+    if git_dir is None:
+        return None
+
+    taken_ns = time.time_ns()
+    index_file = git_dir / "index"
+    index_key = _file_key(index_file)
+    hkey = head_key(git_dir)
+    if index_key is None or hkey is None:
+        return None
+
+    if prev is not None and prev.index_key == index_key:
+        entries = prev.entries
+    else:
+        try:
+            entries = read_index(index_file, _oid_len(git_dir))
+        except (OSError, ValueError, struct.error, UnsupportedIndex):
+            return None
+
+    # The index itself was just written: entries stamped in the same tick are racy.
+    if index_key[2] >= taken_ns - RACY_NS:
+        return None
+
+    dirty: Dict[str, Optional[StatKey]] = {}
+    racy_after = taken_ns - RACY_NS
+    for rel, key, mode in entries:
+        cur, mtime_ns = _worktree_stat(worktree, rel, mode)
+        if mtime_ns >= racy_after:
+            return None
+        if cur != key:
+            dirty[rel] = cur
+
+    if _file_key(index_file) != index_key:
+        return None
+
+    return IndexSnapshot(index_key, hkey, entries, dirty)
+
+def unchanged_since(worktree: Path, snap: IndexSnapshot) -> bool:
+    """
+    True when nothing git's tracked-file status depends on moved since `snap`.
+    """
+    git_dir = resolve_git_dir(worktree)
+    if git_dir is None:
+        return False
+    if _file_key(git_dir / "index") != snap.index_key:
+        return False
+    if head_key(git_dir) != snap.head_key:
+        return False
+
+    dirty = snap.dirty
+    for rel, key, mode in snap.entries:
+        expected = dirty[rel] if rel in dirty else key
+        if _worktree_stat(worktree, rel, mode)[0] != expected:
+            return False
+    return True
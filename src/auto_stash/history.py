@@ -0,0 +1,182 @@
+"""
+Local SQLite index of every snapshot the watchers store, across repos.
+
+The watcher appends one row per STASHED result (repo, commit, tree, ref, time,
+message) plus the paths that differed from HEAD, so "what did repo X look like
+around 14:30 yesterday" is answered without opening any repo.
+
+history:
+  file: ~/.config/git-auto-stash/history.sqlite3   # default: next to state.json
+  enabled: true
+"""
+import datetime
+import re
+import sqlite3
+import time
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id      INTEGER PRIMARY KEY,
+    repo    TEXT NOT NULL,
+    stash   TEXT NOT NULL,
+    tree    TEXT,
+    ref     TEXT,
+    ts      REAL NOT NULL,
+    message TEXT,
+    UNIQUE (repo, stash)
+);
+CREATE INDEX IF NOT EXISTS snapshots_repo_ts ON snapshots (repo, ts);
+CREATE INDEX IF NOT EXISTS snapshots_ts ON snapshots (ts);
+CREATE TABLE IF NOT EXISTS paths (
+    snapshot INTEGER NOT NULL REFERENCES snapshots (id) ON DELETE CASCADE,
+    path     TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS paths_snapshot ON paths (snapshot);
+"""
+COLUMNS = ("id", "repo", "stash", "tree", "ref", "ts", "message")
+
+# (repo, stash, tree, ref, ts, message, paths)
+Row = Tuple[str, str, Optional[str], Optional[str], float, Optional[str], Sequence[str]]
+
+
+class History:
+    def __init__(self, file: Path):
+        self.file = file
+        self._db: Optional[sqlite3.Connection] = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.file.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(str(self.file), timeout=10)
+            # WAL: the CLI reads while a watcher writes; several watchers may share the file.
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("PRAGMA foreign_keys=ON")
+            db.executescript(SCHEMA)
+            self._db = db
+        return self._db
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def record(self, rows: Iterable[Row]) -> int:
+        """
+        Add snapshots in one transaction; ones already indexed are left alone.
+        Returns how many were new.
+        """
+        added = 0
+        with self.db as db:
+            for repo, stash, tree, ref, ts, message, paths in rows:
+                cur = db.execute(
+                    "INSERT OR IGNORE INTO snapshots (repo, stash, tree, ref, ts, message) "
+                    "VALUES (?, ?, ?, ?, ?, ?)", (repo, stash, tree, ref, ts, message))
+                if cur.rowcount:
+                    added += 1
+                    db.executemany("INSERT INTO paths (snapshot, path) VALUES (?, ?)",
+                                   [(cur.lastrowid, p) for p in paths])
+        return added
+
+    def query(self, repo: Optional[str] = None, since: Optional[float] = None,
+              until: Optional[float] = None, path_glob: Optional[str] = None,
+              limit: Optional[int] = 50, newest_first: bool = True) -> List[dict]:
+        where: List[str] = []
+        args: List[object] = []
+        if repo is not None:
+            where.append("repo = ?")
+            args.append(repo)
+        if since is not None:
+            where.append("ts >= ?")
+            args.append(since)
+        if until is not None:
+            where.append("ts <= ?")
+            args.append(until)
+        if path_glob:
+            where.append("EXISTS (SELECT 1 FROM paths WHERE snapshot = id AND path GLOB ?)")
+            args.append(path_glob)
+
+        sql = f"SELECT {', '.join(COLUMNS)} FROM snapshots"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY ts {'DESC' if newest_first else 'ASC'}, id {'DESC' if newest_first else 'ASC'}"
+        if limit:
+            sql += " LIMIT ?"
+            args.append(limit)
+        return [dict(zip(COLUMNS, row)) for row in self.db.execute(sql, args)]
+
+    def paths(self, snapshot_id: int) -> List[str]:
+        return [p for (p,) in self.db.execute(
+            "SELECT path FROM paths WHERE snapshot = ? ORDER BY path", (snapshot_id,))]
+
+    def repos(self) -> List[str]:
+        return [r for (r,) in self.db.execute("SELECT DISTINCT repo FROM snapshots ORDER BY repo")]
+
+    def at(self, repo: str, when: float, limit: int = 20) -> List[dict]:
+        """
+        Snapshots of `repo` taken at or before `when`, nearest first.
+        """
+        return self.query(repo=repo, until=when, limit=limit)
+
+    def repo_of(self, path: Path) -> Optional[str]:
+        """
+        The indexed repo containing `path`, the innermost one if they nest.
+        """
+        known = set(self.repos())
+        for d in (path, *path.parents):
+            if str(d) in known:
+                return str(d)
+        return None
+
+
+# only these units: "2 months" must not quietly read as 2 minutes
+_RELATIVE = re.compile(
+    r"\s*(\d+(?:\.\d+)?)\s*(s|secs?|seconds?|m|mins?|minutes?|h|hrs?|hours?|d|days?|w|weeks?)"
+    r"(?:\s+ago)?\s*", re.IGNORECASE)
+_UNIT = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}   # by first letter
+
+def parse_when(text: str, now: Optional[float] = None) -> float:
+    """
+    "2024-05-02 14:30", "2024-05-02", "14:30" (today), "yesterday 14:30", "2h" / "2 hours ago"
+    (units s, min, h, d, w), "now" or an epoch number -> epoch seconds (local time).
+    """
+    now = time.time() if now is None else now
+    s = text.strip()
+    if s.lower() == "now":
+        return now
+
+    m = _RELATIVE.fullmatch(s)
+    if m:
+        return now - float(m.group(1)) * _UNIT[m.group(2)[0].lower()]
+    try:
+        value = float(s)
+        if value > 10 ** 8:
+            return value
+    except ValueError:
+        pass
+
+    today = datetime.datetime.fromtimestamp(now).date()
+    day = None
+    low = s.lower()
+    for word, offset in (("yesterday", 1), ("today", 0)):
+        if low.startswith(word):
+            day = today - datetime.timedelta(days=offset)
+            s = s[len(word):].strip() or "00:00"
+            break
+
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M",
+                "%Y-%m-%d"):
+        try:
+            return datetime.datetime.strptime(s, fmt).timestamp()
+        except ValueError:
+            pass
+    for fmt in ("%H:%M:%S", "%H:%M"):
+        try:
+            t = datetime.datetime.strptime(s, fmt).time()
+        except ValueError:
+            continue
+        return datetime.datetime.combine(day or today, t).timestamp()
+    raise ValueError(f"cannot read time {text!r}")
@@ -0,0 +1,246 @@
+"""
+Linux inotify backend for `auto-stash watch --mode events`.
+
+Only the stdlib is used (ctypes for the three inotify syscalls). Every directory of a
+tracked working tree gets a watch, except `.git/` internals and gitignored directories.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import subprocess
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from .stash_watcher import _git
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+              | IN_ONLYDIR | IN_DONT_FOLLOW)
+
+_EVENT = struct.Struct("iIII")
+_READ_SIZE = 64 * 1024
+
+
+class InotifyUnavailable(OSError):
+    pass
+
+
+def _load_libc():
+    if not hasattr(os, "uname") or os.uname().sysname != "Linux":
+        raise InotifyUnavailable("inotify is only available on Linux")
+
+    libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    for name in ("inotify_init1", "inotify_add_watch", "inotify_rm_watch"):
+        if not hasattr(libc, name):
+            raise InotifyUnavailable(f"libc has no {name}")
+
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return libc
+
+
+def ignored_dirs(repo: Path) -> Set[Path]:
+    """
+    Directories git ignores in `repo` (collapsed, e.g. `build/`, `node_modules/`).
+    """
+    try:
+        result = _git(["ls-files", "--others", "--ignored", "--exclude-standard", "--directory", "-z"],
+                      repo, check=True, text=False)
+    except (OSError, subprocess.CalledProcessError):
+        return set()
+
+    out = set()
+    for raw in result.stdout.split(b"\0"):
+        if raw.endswith(b"/"):
+            out.add(repo / os.fsdecode(raw.rstrip(b"/")))
+    return out
+
+
+def _is_ignored(repo: Path, path: Path) -> bool:
+    result = _git(["check-ignore", "-q", str(path)], repo)
+    return result.returncode == 0
+
+
+class RepoEventWatcher:
+    """
+    Watch the working trees of several repos and report which of them changed.
+
+    `wait()` blocks until something changes, then keeps collecting events until the
+    trees have been quiet for `debounce` seconds (or `max_delay` passed since the first
+    event), and returns the set of repo roots that saw any event.
+
+    Repos that cannot be watched (no inotify support on that filesystem, watch limit
+    reached, ...) are listed in `unwatched` so the caller can keep polling them.
+    """
+
+    def __init__(self, repos: List[Path], debounce: float = 2.0, max_delay: Optional[float] = None):
+        self._libc = _load_libc()
+        fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise InotifyUnavailable(err, os.strerror(err))
+
+        self.fd = fd
+        self.debounce = debounce
+        self.max_delay = max_delay if max_delay is not None else debounce * 10
+        self.unwatched: List[Path] = []
+        self.overflowed = False
+
+        self._wd: Dict[int, Tuple[Path, Path]] = {}    # wd -> (repo, dir)
+        self._by_dir: Dict[Path, int] = {}
+        self._ignored: Dict[Path, Set[Path]] = {}
+
+        for repo in repos:
+            self.add_repo(repo)
+
+    # ---- watch management ----
+    def _add_watch(self, repo: Path, d: Path) -> bool:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(str(d)), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                return True
+            return False
+
+        self._wd[wd] = (repo, d)
+        self._by_dir[d] = wd
+        return True
+
+    def _walk(self, repo: Path, top: Path) -> bool:
+        ignored = self._ignored.get(repo, set())
+        stack = [top]
+
+        while stack:
+            d = stack.pop()
+            if not self._add_watch(repo, d):
+                return False
+            try:
+                with os.scandir(d) as it:
+                    for entry in it:
+                        if not entry.is_dir(follow_symlinks=False) or entry.name == ".git":
+                            continue
+                        child = Path(entry.path)
+                        if child not in ignored:
+                            stack.append(child)
+            except OSError:
+                continue
+        return True
+
+    def add_repo(self, repo: Path) -> bool:
+        if not (repo / ".git").exists():
+            self.unwatched.append(repo)
+            return False
+
+        self._ignored[repo] = ignored_dirs(repo)
+        if not self._walk(repo, repo):
+            self.remove_repo(repo)
+            self.unwatched.append(repo)
+            return False
+        return True
+
+    def remove_repo(self, repo: Path):
+        for wd, (r, d) in list(self._wd.items()):
+            if r == repo:
+                self._libc.inotify_rm_watch(self.fd, wd)
+                self._wd.pop(wd, None)
+                self._by_dir.pop(d, None)
+        self._ignored.pop(repo, None)
+        if repo in self.unwatched:
+            self.unwatched.remove(repo)
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    # ---- event reading ----
+    def _read_events(self) -> Set[Path]:
+        changed: Set[Path] = set()
+
+        while True:
+            try:
+                buf = os.read(self.fd, _READ_SIZE)
+            except BlockingIOError:
+                break
+            if not buf:
+                break
+
+            off = 0
+            while off < len(buf):
+                wd, mask, _cookie, length = _EVENT.unpack_from(buf, off)
+                name = buf[off + _EVENT.size: off + _EVENT.size + length].rstrip(b"\0")
+                off += _EVENT.size + length
+
+                if mask & IN_Q_OVERFLOW:
+                    self.overflowed = True
+                    continue
+
+                owner = self._wd.get(wd)
+                if owner is None:
+                    continue
+                repo, d = owner
+
+                if mask & IN_IGNORED:
+                    self._wd.pop(wd, None)
+                    self._by_dir.pop(d, None)
+                    continue
+
+                if name == b".git":
+                    continue
+
+                changed.add(repo)
+
+                # New directories need their own watch, unless git ignores them.
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    child = d / os.fsdecode(name)
+                    if not _is_ignored(repo, child):
+                        self._walk(repo, child)
+
+        return changed
+
+    def wait(self, timeout: Optional[float] = None, wake_fds: Sequence[int] = ()) -> Set[Path]:
+        """
+        Return the repos changed within `timeout` seconds (None = forever), debounced.
+        Readiness of any of `wake_fds` ends the wait early (with whatever changed so far).
+        """
+        ready, _, _ = select.select([self.fd, *wake_fds], [], [], timeout)
+        if self.fd not in ready:
+            return set()
+
+        changed = self._read_events()
+        first = time.monotonic()
+
+        while time.monotonic() - first < self.max_delay:
+            ready, _, _ = select.select([self.fd], [], [], self.debounce)
+            if not ready:
+                break
+            changed |= self._read_events()
+
+        # The kernel dropped events: we no longer know what changed, so report everything.
+        if self.overflowed:
+            self.overflowed = False
+            changed |= set(self._ignored)
+
+        return changed
@@ -0,0 +1,168 @@
+"""
+Idle-time object maintenance for watched repos.
+
+Every snapshot leaves loose objects behind and `git stash create` never triggers
+`gc --auto`, so busy repos pile them up. Between cycles the watcher estimates the
+loose-object count of repos that produced snapshots (the way `gc --auto` does: one
+fan-out directory times 256) and repacks the ones over a threshold, within a time
+budget, so the stash jobs themselves are never delayed by it.
+"""
+import os
+import subprocess
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from .git_index import common_dir
+from .metrics import MAINTENANCE
+from .stash_watcher import GitTimeout, _git, _git_dir_of, log
+
+DEFAULT_LOOSE_OBJECTS = 2000
+DEFAULT_BUDGET = 30.0   # second, per idle period
+DEFAULT_MIN_GAP = 3600.0  # second between two repacks of one repo
+MARGIN = 1.0            # second kept free before the next due job
+
+
+def estimate_loose_objects(objects_dir: Path) -> int:
+    """
+    Loose objects are spread evenly over the 256 fan-out dirs by hash; count one.
+    """
+    try:
+        names = os.listdir(objects_dir / "17")
+    except OSError:
+        return 0
+    return sum(1 for n in names if len(n) >= 38) * 256
+
+
+class RepoMaint:
+    __slots__ = ("objects_dir", "estimate", "last_run", "last_seconds")
+
+    def __init__(self, objects_dir: Optional[Path]):
+        self.objects_dir = objects_dir
+        self.estimate = 0
+        self.last_run = 0.0
+        self.last_seconds = 1.0   # how long the previous repack took
+
+
+class Maintenance:
+    """
+    maintenance:
+      loose_objects: 2000     # repack above this estimated loose-object count, 0 = off
+      budget: 30              # seconds of maintenance per idle period
+      min_gap: 3600           # seconds between two repacks of one repo
+      prune: 2.weeks.ago      # also prune unreachable loose objects older than this
+    """
+
+    def __init__(self, loose_objects: int = DEFAULT_LOOSE_OBJECTS, budget: float = DEFAULT_BUDGET,
+                 min_gap: float = DEFAULT_MIN_GAP, prune: Optional[str] = None):
+        self.loose_objects = loose_objects
+        self.budget = budget
+        self.min_gap = min_gap
+        self.prune = prune
+        self._repos: Dict[Path, RepoMaint] = {}
+        self._suspects: Dict[Path, None] = {}   # repos to re-estimate, insertion-ordered
+
+    @classmethod
+    def from_config(cls, cfg: Optional[dict]) -> "Maintenance":
+        m = cls()
+        m.configure(cfg)
+        return m
+
+    def configure(self, cfg: Optional[dict]):
+        """
+        (Re)apply the `maintenance:` section; what is known about each repo is kept.
+        """
+        cfg = cfg or {}
+        prune = cfg.get("prune")
+        self.loose_objects = int(cfg.get("loose_objects", DEFAULT_LOOSE_OBJECTS))
+        self.budget = float(cfg.get("budget", DEFAULT_BUDGET))
+        self.min_gap = float(cfg.get("min_gap", DEFAULT_MIN_GAP))
+        self.prune = str(prune) if prune else None
+
+    def watch(self, paths: Iterable[Path]):
+        """
+        Register repos; each is estimated once, in case it already has a backlog.
+        """
+        for p in paths:
+            self._suspects[p] = None
+
+    def forget(self, path: Path):
+        self._repos.pop(path, None)
+        self._suspects.pop(path, None)
+
+    def note(self, results: list):
+        """
+        Feed a cycle's results: only repos that wrote a snapshot can have grown.
+        """
+        for r in results:
+            if r.status == "STASHED":
+                self._suspects[Path(r.repo)] = None
+
+    def _repo(self, path: Path) -> RepoMaint:
+        rm = self._repos.get(path)
+        if rm is None:
+            git_dir = _git_dir_of(path)
+            rm = self._repos[path] = RepoMaint(common_dir(git_dir) / "objects" if git_dir else None)
+        return rm
+
+    def _due(self, now: float) -> List[Path]:
+        for path in list(self._suspects):
+            rm = self._repo(path)
+            if rm.objects_dir is not None:
+                rm.estimate = estimate_loose_objects(rm.objects_dir)
+            if rm.estimate < self.loose_objects:
+                self._suspects.pop(path)
+        due = [p for p in self._suspects if now - self._repos[p].last_run >= self.min_gap]
+        due.sort(key=lambda p: -self._repos[p].estimate)
+        return due
+
+    def run(self, until: float) -> int:
+        """
+        Repack the repos most in need until `until` (capped by the budget); a repack
+        is only started when its previous duration fits the time left.
+        Returns how many repos were repacked.
+        """
+        if self.loose_objects <= 0:
+            return 0
+        now = time.time()
+        deadline = min(until, now + self.budget) - MARGIN
+        done = 0
+        for path in self._due(now):
+            rm = self._repos[path]
+            left = deadline - time.time()
+            if left < rm.last_seconds:
+                continue
+            if self._repack(path, rm, left):
+                done += 1
+                self._suspects.pop(path, None)
+        return done
+
+    def _repack(self, path: Path, rm: RepoMaint, left: float) -> bool:
+        started = time.time()
+        rm.last_run = started
+        try:
+            # --geometric (git >= 2.33) rolls loose objects and small packs into one pack
+            # without rewriting the big ones; older git gets a plain incremental repack.
+            res = _git(["repack", "-d", "-q", "--geometric=2"], path, timeout=left)
+            if res.returncode != 0 and "geometric" in res.stderr:
+                res = _git(["repack", "-d", "-q"], path, timeout=left)
+            if res.returncode != 0:
+                log(f"Repack failed in {path}: {res.stderr.strip()}")
+                return False
+            MAINTENANCE.inc(action="repack")
+
+            left = started + left - time.time()
+            if self.prune and left > 0:
+                _git(["prune", f"--expire={self.prune}"], path, check=True, timeout=left)
+                MAINTENANCE.inc(action="prune")
+
+        except (GitTimeout, subprocess.CalledProcessError, OSError) as e:
+            log(f"Maintenance stopped in {path}: {e}")
+            return False
+        finally:
+            # capped so a repack that once overran the budget still gets retried
+            rm.last_seconds = min(max(1.0, time.time() - started), self.budget / 2)
+
+        log(f"Repacked {path} (~{rm.estimate} loose objects) in {time.time() - started:.1f}s")
+        rm.estimate = 0
+        return True
@@ -0,0 +1,215 @@
+"""
+Minimal Prometheus-style metrics for the watcher (no client library needed).
+
+Metrics are plain in-process counters/histograms guarded by one lock each; they are
+exposed through a local HTTP `/metrics` endpoint and/or an atomically rewritten
+node-exporter textfile.
+"""
+import bisect
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple, TypeVar, Union
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+CYCLE_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _num(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) and not v.is_integer() else str(int(v))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def total(self) -> float:
+        with self._lock:
+            return sum(self._values.values())
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, k)} {_num(v)}" for k, v in items]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 2)
+            row[i] += 1
+            row[-1] += value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+
+        out = []
+        for key, row in items:
+            acc: float = 0
+            for bound, n in zip(self.buckets + (float("inf"),), row[:-1]):
+                acc += n
+                le = 'le="' + _num(bound) + '"'
+                out.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, key)} {row[-1]!r}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, key)} {acc}")
+        return out
+
+
+Metric = Union[Counter, Histogram]
+M = TypeVar("M", Counter, Histogram)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: M) -> M:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in self._metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            lines.extend(m.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+CYCLES = REGISTRY.register(Counter(
+    "auto_stash_cycles_total", "Watcher cycles run."))
+CYCLE_DURATION = REGISTRY.register(Histogram(
+    "auto_stash_cycle_duration_seconds", "Wall time of one watcher cycle.", buckets=CYCLE_BUCKETS))
+JOBS = REGISTRY.register(Counter(
+    "auto_stash_jobs_total", "Repo jobs by result status.", ["status"]))
+JOB_DURATION = REGISTRY.register(Histogram(
+    "auto_stash_job_duration_seconds", "Wall time of one repo job."))
+GIT_COMMANDS = REGISTRY.register(Counter(
+    "auto_stash_git_commands_total", "git processes spawned, by subcommand.", ["command"]))
+GIT_DURATION = REGISTRY.register(Histogram(
+    "auto_stash_git_command_duration_seconds", "Wall time of git processes, by subcommand.", ["command"]))
+STASHES = REGISTRY.register(Counter(
+    "auto_stash_stashes_total", "Snapshots stored."))
+STASHES_PRUNED = REGISTRY.register(Counter(
+    "auto_stash_stashes_pruned_total", "Old auto-stash entries dropped by the retention policy."))
+ERRORS = REGISTRY.register(Counter(
+    "auto_stash_errors_total", "Failed repo jobs, by repo.", ["repo"]))
+MAINTENANCE = REGISTRY.register(Counter(
+    "auto_stash_maintenance_total", "Idle-time repacks and prunes run.", ["action"]))
+SNAPSHOT_BYTES = REGISTRY.register(Counter(
+    "auto_stash_snapshot_bytes_total", "Bytes of loose objects written by snapshots."))
+
+
+# -------------- exporters --------------
+class _Handler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port: int, address: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Serve `/metrics` from a daemon thread.
+    """
+    server = ThreadingHTTPServer((address, port), _Handler)
+    server.daemon_threads = True
+    t = threading.Thread(target=server.serve_forever, name="auto-stash-metrics", daemon=True)
+    t.start()
+    return server
+
+
+def write_textfile(path: Path, registry: Registry = REGISTRY):
+    """
+    Write the node-exporter textfile atomically (tmp file + rename in the same dir).
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(registry.render())
+    tmp.replace(path)
+
+
+def new_object_bytes(objects_dir: Path, since_ns: int) -> int:
+    """
+    Size of loose objects written since `since_ns`. Only fan-out directories whose
+    mtime moved are listed, so this costs ~256 stats when little was written.
+    """
+    total = 0
+    try:
+        fanouts = list(os.scandir(objects_dir))
+    except OSError:
+        return 0
+
+    for d in fanouts:
+        if len(d.name) != 2 or not d.is_dir(follow_symlinks=False):
+            continue
+        try:
+            if d.stat().st_mtime_ns < since_ns:
+                continue
+            with os.scandir(d.path) as it:
+                for e in it:
+                    st = e.stat(follow_symlinks=False)
+                    if st.st_mtime_ns >= since_ns:
+                        total += st.st_size
+        except OSError:
+            continue
+    return total
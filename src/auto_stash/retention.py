@@ -0,0 +1,194 @@
+"""
+Retention for auto-stash snapshots: entries of `refs/stash` (stash backend) or refs
+under `refs/auto-stash/` (refs backend).
+
+Only reflog entries whose message is exactly an auto-stash message
+("auto-stash YYYY-MM-DD HH:MM:SS", see AUTO_FORMAT) are ever considered; stashes made
+with `git stash` (messages "WIP on ..." / "On <branch>: ...") are always kept,
+whatever their age.
+
+Policy (all optional, an entry survives if any rule keeps it):
+  keep_last: newest N auto-stashes
+  hourly:    newest auto-stash of each hour, for the last N hours
+  daily:     newest auto-stash of each day, for the last N days
+"""
+import datetime
+import os
+import re
+import time
+from pathlib import Path
+from typing import List, Optional, Set, Tuple
+
+from .git_index import common_dir, resolve_git_dir
+
+AUTO_FORMAT = "auto-stash %Y-%m-%d %H:%M:%S"   # strftime format of every snapshot message
+_AUTO_MESSAGE = re.compile(r"auto-stash \d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}")
+DEFAULT_KEEP_LAST = 50
+DEFAULT_HOURLY = 24
+DEFAULT_DAILY = 30
+
+
+class RetentionPolicy:
+    __slots__ = ("keep_last", "hourly", "daily")
+
+    def __init__(self, keep_last: int = DEFAULT_KEEP_LAST, hourly: int = DEFAULT_HOURLY,
+                 daily: int = DEFAULT_DAILY):
+        # The newest auto-stash is what restarts deduplicate against; never drop it.
+        self.keep_last = max(1, int(keep_last))
+        self.hourly = max(0, int(hourly))
+        self.daily = max(0, int(daily))
+
+    @classmethod
+    def from_config(cls, cfg: Optional[dict]) -> Optional["RetentionPolicy"]:
+        """
+        retention:
+          keep_last: 50
+          hourly: 24
+          daily: 30
+        No (or an empty) section means retention is off.
+        """
+        if not cfg:
+            return None
+        return cls(
+            cfg.get("keep_last", DEFAULT_KEEP_LAST),
+            cfg.get("hourly", DEFAULT_HOURLY),
+            cfg.get("daily", DEFAULT_DAILY),
+        )
+
+
+class ReflogEntry:
+    __slots__ = ("old", "new", "ident", "ts", "message", "line")
+
+    def __init__(self, line: str):
+        head, _, message = line.rstrip("\n").partition("\t")
+        fields = head.split(" ")
+        self.old = fields[0]
+        self.new = fields[1]
+        # "<name> <email> <epoch> <tz>"; the name may contain spaces
+        self.ident = " ".join(fields[2:])
+        try:
+            self.ts = int(fields[-2])
+        except (IndexError, ValueError):
+            self.ts = 0
+        self.message = message
+        self.line = line
+
+    @property
+    def is_auto(self) -> bool:
+        return _AUTO_MESSAGE.fullmatch(self.message) is not None
+
+    def render(self) -> str:
+        return f"{self.old} {self.new} {self.ident}\t{self.message}\n"
+
+
+def stash_reflog(path: Path) -> Optional[Path]:
+    git_dir = resolve_git_dir(path)
+    if git_dir is None:
+        return None
+    return common_dir(git_dir) / "logs" / "refs" / "stash"
+
+def read_reflog(reflog: Path) -> List[ReflogEntry]:
+    """
+    Entries oldest first, i.e. the last one is stash@{0}.
+    """
+    with open(reflog, "r", encoding="utf-8", errors="surrogateescape") as f:
+        return [ReflogEntry(line) for line in f if line.strip()]
+
+
+def _expired(stamps: List[Optional[int]], policy: RetentionPolicy, now: Optional[float]) -> Set[int]:
+    """
+    `stamps` holds the time of each snapshot, oldest first, None for entries that are
+    not ours. Returns the positions no rule of `policy` keeps.
+    """
+    now = time.time() if now is None else now
+    # (position, time) of our snapshots, newest first
+    auto = [(i, ts) for i, ts in reversed(list(enumerate(stamps))) if ts is not None]
+
+    keep = {i for i, _ in auto[:policy.keep_last]}
+    hours: Set[str] = set()
+    days: Set[str] = set()
+    for i, ts in auto:
+        age = now - ts
+        when = datetime.datetime.fromtimestamp(ts)
+        if age < policy.hourly * 3600:
+            bucket = when.strftime("%Y%m%d%H")
+            if bucket not in hours:
+                hours.add(bucket)
+                keep.add(i)
+        if age < policy.daily * 86400:
+            bucket = when.strftime("%Y%m%d")
+            if bucket not in days:
+                days.add(bucket)
+                keep.add(i)
+
+    return {i for i, _ in auto if i not in keep}
+
+def select_expired(entries: List[ReflogEntry], policy: RetentionPolicy,
+                   now: Optional[float] = None) -> Set[int]:
+    """
+    Positions (in `entries`) of the auto-stashes no rule of `policy` keeps.
+    """
+    return _expired([e.ts if e.is_auto else None for e in entries], policy, now)
+
+def expired_refs(refs: List[Tuple[str, int]], policy: RetentionPolicy,
+                 now: Optional[float] = None) -> List[str]:
+    """
+    Names of the snapshot refs, given as [(ref, commit time), ...], to delete.
+    """
+    refs = sorted(refs, key=lambda r: (r[1], r[0]))
+    return [refs[i][0] for i in sorted(_expired([ts for _, ts in refs], policy, now))]
+
+
+def _rewrite(entries: List[ReflogEntry], expired: Set[int]) -> List[str]:
+    """
+    Drop `expired` and re-chain the old-oid of each survivor to its new predecessor,
+    as `git reflog delete --rewrite` does.
+    """
+    out: List[str] = []
+    prev_new = None
+    for i, e in enumerate(entries):
+        if i in expired:
+            if prev_new is None:
+                prev_new = "0" * len(e.old)
+            continue
+        if prev_new is not None and e.old != prev_new:
+            e.old = prev_new
+            out.append(e.render())
+        else:
+            out.append(e.line if e.line.endswith("\n") else e.line + "\n")
+        prev_new = e.new
+    return out
+
+def compact_stashes(path: Path, policy: RetentionPolicy, now: Optional[float] = None) -> int:
+    """
+    Apply `policy` to the stash reflog of `path`; returns how many entries were dropped.
+
+    The reflog is rewritten under `refs/stash.lock`, the lock git itself takes to
+    change the stash, so a concurrent `git stash` fails cleanly instead of racing us.
+    The ref is never moved: the newest auto-stash is always kept, and an entry newer
+    than it is by definition not an auto-stash. Raises OSError when the lock is taken.
+    """
+    reflog = stash_reflog(path)
+    if reflog is None or not reflog.is_file():
+        return 0
+
+    ref_lock = reflog.parents[2] / "refs" / "stash.lock"
+    log_lock = reflog.with_name("stash.lock")
+    fd = os.open(ref_lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+    try:
+        os.close(fd)
+        entries = read_reflog(reflog)
+        expired = select_expired(entries, policy, now)
+        if not expired:
+            return 0
+
+        with open(log_lock, "w", encoding="utf-8", errors="surrogateescape") as f:
+            f.writelines(_rewrite(entries, expired))
+        os.replace(log_lock, reflog)
+        return len(expired)
+    finally:
+        try:
+            os.unlink(log_lock)
+        except FileNotFoundError:
+            pass
+        os.unlink(ref_lock)
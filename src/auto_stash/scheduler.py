@@ -0,0 +1,170 @@
+"""
+Per-repo adaptive scheduling for the polling watcher.
+
+Each repo has its own interval and next-due time, kept in a heap. Repos that keep
+producing stashes are checked more often, idle repos back off exponentially up to a
+cap, and every due time is jittered so repos sharing a disk don't all fire together.
+"""
+import heapq
+import itertools
+import random
+from pathlib import Path
+from typing import Dict, List, Optional
+
+DEFAULT_JITTER = 0.1
+SHRINK_FACTOR = 0.5
+BACKOFF_FACTOR = 2.0
+
+
+class RepoSchedule:
+    __slots__ = ("path", "base", "interval", "min_interval", "max_interval", "due", "version")
+
+    def __init__(self, path: Path, base: float, min_interval: float, max_interval: float):
+        self.path = path
+        self.base = base
+        self.interval = base
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.due = 0.0
+        self.version = 0
+
+
+class Scheduler:
+    """
+    Heap of (due, seq, version, path). Entries are invalidated lazily: rescheduling or
+    removing a repo bumps its version and stale heap entries are skipped when popped.
+
+    `overrides` maps normalized repo paths to {"interval", "min_interval", "max_interval"}.
+    """
+
+    def __init__(self, interval: float, min_interval: Optional[float] = None,
+                 max_interval: Optional[float] = None, jitter: float = DEFAULT_JITTER,
+                 overrides: Optional[Dict[str, dict]] = None, rng: Optional[random.Random] = None):
+        self.interval = float(interval)
+        self.min_interval = float(min_interval) if min_interval else self.interval / 4
+        self.max_interval = float(max_interval) if max_interval else self.interval * 8
+        self.jitter = max(0.0, float(jitter))
+        self.overrides = overrides or {}
+        self._rng = rng or random.Random()
+
+        self._heap: list = []
+        self._seq = itertools.count()
+        self._repos: Dict[Path, RepoSchedule] = {}
+
+    def __contains__(self, path: Path) -> bool:
+        return path in self._repos
+
+    def __len__(self) -> int:
+        return len(self._repos)
+
+    def _jittered(self, seconds: float) -> float:
+        if not self.jitter:
+            return seconds
+        return seconds * (1 + self._rng.uniform(-self.jitter, self.jitter))
+
+    def _push(self, rs: RepoSchedule, due: float):
+        rs.version += 1
+        rs.due = due
+        heapq.heappush(self._heap, (due, next(self._seq), rs.version, rs.path))
+
+    def _make(self, path: Path) -> RepoSchedule:
+        ov = self.overrides.get(str(path)) or {}
+        base = float(ov.get("interval", self.interval))
+        lo = float(ov.get("min_interval", min(self.min_interval, base)))
+        hi = float(ov.get("max_interval", max(self.max_interval, base)))
+        return RepoSchedule(path, base, lo, hi)
+
+    def add(self, path: Path, now: float):
+        """
+        Start scheduling `path`; the first run is spread over `jitter * interval`.
+        """
+        if path in self._repos:
+            return
+        rs = self._make(path)
+        self._repos[path] = rs
+        self._push(rs, now + self._rng.uniform(0, rs.base * self.jitter))
+
+    def retune(self, interval: float, min_interval: Optional[float] = None,
+               max_interval: Optional[float] = None, jitter: Optional[float] = None,
+               overrides: Optional[Dict[str, dict]] = None, now: float = 0.0):
+        """
+        Apply new settings to the repos already scheduled. A repo whose limits changed
+        restarts from its new base interval and is pulled in if it was due later than that;
+        untouched repos keep their adaptive interval and due time.
+        """
+        self.interval = float(interval)
+        self.min_interval = float(min_interval) if min_interval else self.interval / 4
+        self.max_interval = float(max_interval) if max_interval else self.interval * 8
+        if jitter is not None:
+            self.jitter = max(0.0, float(jitter))
+        self.overrides = overrides or {}
+
+        for rs in self._repos.values():
+            fresh = self._make(rs.path)
+            if (fresh.base, fresh.min_interval, fresh.max_interval) == (rs.base, rs.min_interval, rs.max_interval):
+                continue
+            rs.base, rs.min_interval, rs.max_interval = fresh.base, fresh.min_interval, fresh.max_interval
+            rs.interval = rs.base
+            if rs.due > now + rs.interval:
+                self._push(rs, now + self._jittered(rs.interval))
+
+    def remove(self, path: Path):
+        rs = self._repos.pop(path, None)
+        if rs is not None:
+            rs.version += 1
+
+    def due(self, path: Path) -> Optional[float]:
+        rs = self._repos.get(path)
+        return rs.due if rs is not None else None
+
+    def trigger(self, path: Path, now: float):
+        """
+        Make `path` due right away; its interval is left as it is.
+        """
+        rs = self._repos.get(path)
+        if rs is not None:
+            self._push(rs, now)
+
+    def next_due(self) -> Optional[float]:
+        while self._heap:
+            due, _, version, path = self._heap[0]
+            rs = self._repos.get(path)
+            if rs is not None and rs.version == version:
+                return due
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, now: float, window: float = 0.0) -> List[Path]:
+        """
+        Take every repo due by `now + window` off the heap. They stay registered and
+        must be put back with `reschedule()`.
+        """
+        out: List[Path] = []
+        while True:
+            due = self.next_due()
+            if due is None or due > now + window:
+                return out
+            _, _, _, path = heapq.heappop(self._heap)
+            self._repos[path].version += 1
+            out.append(path)
+
+    def reschedule(self, path: Path, status: str, now: float, delay: Optional[float] = None):
+        """
+        Put `path` back after a job: shrink the interval when it stashed, back off when
+        idle, reset to its base after errors. A repo that was not looked at (DEFERRED,
+        PAUSED) keeps its interval. `delay` forces the next run time.
+        """
+        rs = self._repos.get(path)
+        if rs is None:
+            return
+
+        if status == "STASHED":
+            rs.interval = max(rs.min_interval, rs.interval * SHRINK_FACTOR)
+        elif status == "NO_CHANGES":
+            rs.interval = min(rs.max_interval, rs.interval * BACKOFF_FACTOR)
+        elif status in ("DEFERRED", "PAUSED"):
+            pass
+        else:
+            rs.interval = rs.base
+
+        self._push(rs, now + (delay if delay is not None else self._jittered(rs.interval)))
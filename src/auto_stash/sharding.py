@@ -0,0 +1,267 @@
+"""
+Split the watched repos between several `auto-stash watch --shard i/n` workers.
+
+Each repo goes to one worker by rendezvous hashing of its normalized path over the
+live shards, so when a worker disappears only its repos move, and they come back
+when it returns. Workers announce themselves with a heartbeat file in a directory
+they all share (a network filesystem for several machines); a shard whose heartbeat
+is older than `timeout` is considered gone.
+
+Hashing alone can disagree for a moment while heartbeats propagate, so a worker
+also holds a lease on every repo it stashes: `<git dir>/auto-stash.lease`, naming
+the worker. A lease is only taken over once its holder's heartbeat is stale.
+
+Dedup state (state.json) is per host, not shared: a repo taken over from a worker on
+another machine starts with empty state, so its first snapshot may repeat the last one.
+
+sharding:
+  dir: /mnt/shared/auto-stash-shards   # default: shards/ next to state.json
+  heartbeat: 10                         # seconds between two heartbeats
+  timeout: 60                           # a worker silent this long is gone
+"""
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .git_index import resolve_git_dir
+
+DEFAULT_HEARTBEAT = 10.0  # second
+DEFAULT_TIMEOUT = 60.0    # second
+LEASE_NAME = "auto-stash.lease"
+
+
+class ShardBusy(RuntimeError):
+    pass
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """
+    "i/n" (1 <= i <= n) -> (i - 1, n).
+    """
+    try:
+        i, n = (int(x) for x in value.split("/"))
+    except ValueError:
+        raise ValueError(f"bad shard {value!r}, expected i/n such as 1/4") from None
+    if not 1 <= i <= n:
+        raise ValueError(f"bad shard {value!r}, i must be between 1 and n")
+    return i - 1, n
+
+def _weight(shard: int, key: str) -> int:
+    # Stable across processes and machines, unlike hash().
+    digest = hashlib.blake2b(f"{shard}\0{key}".encode("utf-8", "surrogateescape"), digest_size=8)
+    return int.from_bytes(digest.digest(), "big")
+
+def owner_of(key: str, shards: Iterable[int]) -> int:
+    return max(shards, key=lambda s: _weight(s, key))
+
+
+def _read_json(path: Path) -> Optional[dict]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return data if isinstance(data, dict) else None
+
+def _gone(token: str) -> bool:
+    """
+    True when `token` names a process of this host that no longer exists.
+    """
+    host, _, rest = str(token).partition(":")
+    if host != socket.gethostname():
+        return False
+    try:
+        os.kill(int(rest.split(":")[0]), 0)
+    except ProcessLookupError:
+        return True
+    except (ValueError, OSError):
+        return False
+    return False
+
+def _write_json(path: Path, data: dict):
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+class Shard:
+    def __init__(self, index: int, count: int, directory: Path,
+                 heartbeat: float = DEFAULT_HEARTBEAT, timeout: float = DEFAULT_TIMEOUT):
+        self.index = index
+        self.count = count
+        self.directory = directory
+        self.heartbeat = heartbeat
+        self.timeout = max(timeout, 2 * heartbeat)
+        self.token = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.started = time.time()
+        self.live: Set[int] = set(range(count))   # everyone gets `timeout` to show up
+        self.owned: Set[Path] = set()
+        self._beats: Dict[int, Tuple[str, float]] = {}   # shard -> (token, time)
+        self._last_beat = 0.0
+        self._held: Set[Path] = set()
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return f"{self.index + 1}/{self.count}"
+
+    @classmethod
+    def from_config(cls, spec: str, cfg: Optional[dict], default_dir: Path) -> "Shard":
+        cfg = cfg or {}
+        index, count = parse_shard(spec)
+        directory = Path(os.path.expanduser(cfg["dir"])) if cfg.get("dir") else default_dir
+        return cls(index, count, directory,
+                   heartbeat=float(cfg.get("heartbeat", DEFAULT_HEARTBEAT)),
+                   timeout=float(cfg.get("timeout", DEFAULT_TIMEOUT)))
+
+    def _beat_file(self, shard: int) -> Path:
+        return self.directory / f"shard-{shard + 1}-of-{self.count}.json"
+
+    # ---- heartbeats ----
+    def start(self):
+        """
+        Announce this worker. Raises ShardBusy when another live worker has the same shard.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        other = _read_json(self._beat_file(self.index))
+        if other and other.get("token") != self.token and not _gone(other.get("token")) and \
+                time.time() - float(other.get("time", 0)) < self.timeout:
+            raise ShardBusy(f"shard {self.name} is already run by {other.get('token')}")
+        self.beat(time.time())
+
+    def beat(self, now: float) -> bool:
+        """
+        Refresh our heartbeat and read the others' every `heartbeat` seconds.
+        Returns True when the set of live shards changed.
+        """
+        if now - self._last_beat < self.heartbeat:
+            return False
+        self._last_beat = now
+        try:
+            _write_json(self._beat_file(self.index),
+                        {"shard": self.name, "token": self.token, "time": now})
+        except OSError:
+            pass   # others will see us as gone; the leases still keep us apart
+
+        beats: Dict[int, Tuple[str, float]] = {}
+        for j in range(self.count):
+            data = _read_json(self._beat_file(j))
+            if data:
+                try:
+                    beats[j] = (str(data.get("token")), float(data.get("time", 0)))
+                except (TypeError, ValueError):
+                    pass
+        self._beats = beats
+
+        grace = now - self.started < self.timeout
+        live = {j for j in range(self.count)
+                if j == self.index or (j in beats and now - beats[j][1] < self.timeout)
+                or (grace and j not in beats)}
+        changed = live != self.live
+        self.live = live
+        return changed
+
+    @property
+    def next_beat(self) -> float:
+        return self._last_beat + self.heartbeat
+
+    # ---- assignment ----
+    def owns(self, path: Path) -> bool:
+        return path in self.owned
+
+    def assign(self, paths: List[Path]) -> Tuple[List[Path], List[Path]]:
+        """
+        Recompute which of `paths` this worker handles; returns (gained, lost).
+        Leases of lost repos are given up so their new owner takes them right away.
+        """
+        owned = {p for p in paths if owner_of(str(p), self.live) == self.index}
+        gained = [p for p in paths if p in owned and p not in self.owned]
+        lost = [p for p in self.owned if p not in owned]
+        self.owned = owned
+        for p in lost:
+            self.release(p)
+        return gained, lost
+
+    # ---- leases ----
+    def _lease_file(self, path: Path) -> Optional[Path]:
+        git_dir = resolve_git_dir(path)
+        return git_dir / LEASE_NAME if git_dir is not None else None
+
+    def _holder_alive(self, lease: dict) -> bool:
+        try:
+            j = int(str(lease.get("shard", "")).split("/")[0]) - 1
+        except ValueError:
+            return False
+        beat = self._beats.get(j)
+        return beat is not None and beat[0] == lease.get("token") and \
+            time.time() - beat[1] < self.timeout and not _gone(beat[0])
+
+    def acquire(self, path: Path) -> Optional[str]:
+        """
+        Take or renew the lease of `path`. Returns None when it is ours, else who holds it.
+        """
+        lease_file = self._lease_file(path)
+        if lease_file is None:
+            return None   # not a repo: the job reports it
+        mine = {"shard": self.name, "token": self.token}
+
+        for _ in range(2):
+            try:
+                fd = os.open(lease_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                lease = _read_json(lease_file) or {}
+                if lease.get("token") == self.token:
+                    break
+                if self._holder_alive(lease):
+                    return f"shard {lease.get('shard')} ({lease.get('token')})"
+                try:
+                    lease_file.unlink()   # holder is gone (or the file is garbage)
+                except FileNotFoundError:
+                    pass
+                continue
+            except OSError as e:
+                return f"lease unavailable: {e}"
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(mine, f)
+            # Two workers breaking the same stale lease: only the last writer keeps it.
+            if (_read_json(lease_file) or {}).get("token") != self.token:
+                return "another worker"
+            break
+        else:
+            return "another worker"
+
+        with self._lock:
+            self._held.add(path)
+        return None
+
+    def release(self, path: Path):
+        with self._lock:
+            if path not in self._held:
+                return
+            self._held.discard(path)
+        lease_file = self._lease_file(path)
+        if lease_file is not None and (_read_json(lease_file) or {}).get("token") == self.token:
+            try:
+                lease_file.unlink()
+            except OSError:
+                pass
+
+    def close(self):
+        """
+        Give up every lease and the heartbeat, so the others take over at once.
+        """
+        for p in list(self._held):
+            self.release(p)
+        beat = _read_json(self._beat_file(self.index))
+        if beat and beat.get("token") == self.token:
+            try:
+                self._beat_file(self.index).unlink()
+            except OSError:
+                pass
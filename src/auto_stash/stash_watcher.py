@@ -1,18 +1,82 @@
-import logging  ## 未來改 log -> logging
+import logging
+import logging.handlers
+import atexit
+import gzip
+import queue
+import shutil
+import signal
 import subprocess
 import datetime
 import time
 import os
+import hashlib
+import json
+import sqlite3
+import threading
+import contextlib
+import itertools
 from pathlib import Path
-from typing import List, Tuple, Optional
+from typing import Dict, List, Sequence, Tuple, Optional
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .scheduler import DEFAULT_JITTER, Scheduler
+from .metrics import (
+    CYCLES, CYCLE_DURATION, ERRORS, GIT_COMMANDS, GIT_DURATION, JOBS, JOB_DURATION,
+    SNAPSHOT_BYTES, STASHES, STASHES_PRUNED, new_object_bytes, start_http_server, write_textfile
+)
+from .retention import (
+    AUTO_FORMAT, DEFAULT_DAILY, DEFAULT_HOURLY, DEFAULT_KEEP_LAST, RetentionPolicy,
+    compact_stashes, expired_refs, read_reflog, stash_reflog
+)
+from .git_index import (
+    IndexSnapshot, busy_reason, common_dir, resolve_git_dir, take_snapshot, unchanged_since,
+    worktree_id
+)
+from .discovery import DEFAULT_MAX_DEPTH, DEFAULT_SKIP, RepoDiscovery
+from .control import Control, ControlUnavailable, serve, shutdown
+from .sharding import Shard, ShardBusy
+from .untracked import UntrackedFilter
+from .history import History
+from . import tracing
+from .tracklist import (
+    APP_NAME,
+    _normalize_path,
+    configured_statefile,
+    default_config,
+    default_control_socket,
+    default_history_file,
+    default_statefile,
+    load_config,
+    load_tracklist,
+    save_tracklist,
+)
+# the other tracklist helpers used to live here too; still importable from this module
+from .tracklist import (
+    default_rootsfile as default_rootsfile,
+    default_trackfile as default_trackfile,
+    remove_from_tracklist as remove_from_tracklist,
+    remove_root as remove_root,
+)
 
 import yaml
 
 
-APP_NAME = "GitAutoStash"
 DEFAULT_INTERVAL = 20 # second
+DEFAULT_JOBS = 8
+DEFAULT_DEBOUNCE = 2.0 # second
+BATCH_WINDOW = 2.0 # second; repos due this close together run in one batch
+DEFAULT_RESCAN = 60.0 # second between two discovery walks of the watch roots
 LOG_FILE = Path(__file__).resolve().parent.parent / "logs" / "auto_stash.log"
+DEFAULT_GIT_TIMEOUT = 60.0 # second, per git command
+SNAPSHOT_NS = "refs/auto-stash/"   # refs backend namespace
+BREAKER_THRESHOLD = 3   # consecutive failed/slow jobs before a repo is degraded
+BREAKER_BACKOFF = 600.0 # second, doubled per further failure
+BREAKER_MAX_BACKOFF = 6 * 3600.0
+DEFAULT_LOG_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_LOG_BACKUPS = 5
+DEFAULT_DEFER_DELAY = 5.0 # second before retrying a repo the user's git is busy in
+DEFAULT_BUSY_QUIET = 2.0  # second; an index written this recently is still being worked on
 
 # -------------- Format / Print utils -------------
 class Colors:
@@ -30,105 +94,767 @@ def _icon_status(status: str) -> str:
         "NO_CHANGES": "∅",
         "ERROR": "⚠",
         "SKIPPED": "⏭",
+        "DEFERRED": "⏳",
     }.get(status,  "•")
 
+def _clock(ts: Optional[float]) -> str:
+    return time.strftime('%H:%M:%S', time.localtime(ts)) if ts else "-"
+
 def _short(s: Optional[str], n: int = 8) -> Optional[str]:
     if not s:
         return None
     return s[:n]
 
-def log(msg: str, with_timestamp=True):
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+# -------------- Log utils ------------------
+# log() only formats and enqueues; one background thread owns the log file handle.
+_logger = logging.getLogger(APP_NAME)
+_log_listener: Optional[logging.handlers.QueueListener] = None
+# setup and shutdown may race with the lazy setup in log() on a worker thread
+_log_setup_lock = threading.RLock()
+# --fmt jsonl: stdout carries JSON records only (see JsonlRenderer); the log file keeps text
+_json_stdout = False
+
+def _emit_json(record: dict):
+    line = json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=str)
+    _logger.info(line)
+    print(line, flush=True)
+
+def _gzip_namer(name: str) -> str:
+    return name + ".gz"
+
+def _gzip_rotator(source: str, dest: str) -> None:
+    with open(source, "rb") as fin, gzip.open(dest, "wb") as fout:
+        shutil.copyfileobj(fin, fout)
+    os.remove(source)
+
+def setup_logging(log_file: Optional[Path] = None, max_bytes: int = DEFAULT_LOG_MAX_BYTES,
+                  backup_count: int = DEFAULT_LOG_BACKUPS, when: Optional[str] = None,
+                  compress: bool = True):
+    """
+    (Re)build the file logging pipeline.
+    `when` (e.g. "midnight", "H") rotates by time, otherwise the file rotates at `max_bytes`.
+    Rotated files are gzip-compressed unless `compress` is False.
+    """
+    global _log_listener
+    with _log_setup_lock:
+        shutdown_logging()
 
-    LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
+        log_file = Path(log_file) if log_file else LOG_FILE
+        log_file.parent.mkdir(parents=True, exist_ok=True)
 
-    with LOG_FILE.open("a", encoding="utf-8") as f:
-        f.write(f"[{timestamp}] {msg}\n")
+        handler: logging.handlers.BaseRotatingHandler
+        if when:
+            handler = logging.handlers.TimedRotatingFileHandler(
+                log_file, when=when, backupCount=backup_count, encoding="utf-8")
+        else:
+            handler = logging.handlers.RotatingFileHandler(
+                log_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+
+        if compress:
+            handler.namer = _gzip_namer
+            handler.rotator = _gzip_rotator
+
+        handler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s", "%Y-%m-%d %H:%M:%S"))
+
+        q: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+        _logger.handlers[:] = [logging.handlers.QueueHandler(q)]
+        _logger.setLevel(logging.INFO)
+        _logger.propagate = False
+
+        _log_listener = logging.handlers.QueueListener(q, handler)
+        _log_listener.start()
+
+def setup_logging_from_config(data: dict):
+    g = data.get("global") or {}
+    log_file = g.get("log_file")
+    setup_logging(
+        log_file=Path(os.path.expanduser(log_file)) if log_file else None,
+        max_bytes=int(g.get("log_max_bytes", DEFAULT_LOG_MAX_BYTES)),
+        backup_count=int(g.get("log_backup_count", DEFAULT_LOG_BACKUPS)),
+        when=g.get("log_rotate_when"),
+        compress=bool(g.get("log_compress", True)),
+    )
+
+def shutdown_logging():
+    """
+    Flush queued records and close the log file.
+    """
+    global _log_listener
+    with _log_setup_lock:
+        if _log_listener is not None:
+            _log_listener.stop()
+            for h in _log_listener.handlers:
+                h.close()
+            _log_listener = None
 
-    if with_timestamp:
+atexit.register(shutdown_logging)
+
+def log(msg: str, with_timestamp=True):
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    if _log_listener is None:
+        with _log_setup_lock:
+            # another thread may have set it up while this one waited
+            if _log_listener is None:
+                setup_logging_from_config(load_config())
+    _logger.info(msg)
+
+    if _json_stdout:
+        print(json.dumps({"type": "log", "ts": round(time.time(), 3), "msg": msg},
+                         ensure_ascii=False, separators=(",", ":")), flush=True)
+    elif with_timestamp:
         print(f"[{timestamp}] {msg}")
     else:
         print(f"{msg}")
 
 # -------------- Git utils ------------------
+# Seconds per git subcommand ("status", "stash", ...), "default" for the rest.
+_git_timeouts: Dict[str, float] = {"default": DEFAULT_GIT_TIMEOUT}
+
+class GitTimeout(subprocess.TimeoutExpired):
+    def __str__(self):
+        return f"git {self.cmd[1] if len(self.cmd) > 1 else ''} timed out after {self.timeout:g}s"
+
+def configure_git_timeouts(timeouts: Optional[dict]):
+    _git_timeouts.clear()
+    _git_timeouts["default"] = DEFAULT_GIT_TIMEOUT
+    for op, sec in (timeouts or {}).items():
+        _git_timeouts[str(op)] = float(sec)
+
+def _kill_tree(proc: subprocess.Popen):
+    """
+    Kill git and everything it spawned (hooks, helpers, ssh ...), not just the leader.
+    """
+    try:
+        if os.name == "nt":
+            proc.kill()
+        else:
+            os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+def _out_bytes(out) -> int:
+    if out is None:
+        return 0
+    return len(out.encode("utf-8", "surrogateescape")) if isinstance(out, str) else len(out)
+
+def _git(args: List[str], cwd, check: bool = False, text: bool = True,
+         timeout: Optional[float] = None, input=None, env=None) -> subprocess.CompletedProcess:
+    """
+    Every git invocation of the watcher goes through here.
+    Runs in its own process group with a per-subcommand timeout (see configure_git_timeouts);
+    on timeout the whole group is killed and GitTimeout is raised.
+    """
+    cmd = ["git", *args]
+    if timeout is None:
+        timeout = _git_timeouts.get(args[0], _git_timeouts["default"]) if args else None
+    if timeout is not None and timeout <= 0:
+        timeout = None
+
+    op = args[0] if args else ""
+    started = time.perf_counter()
+    GIT_COMMANDS.inc(command=op)
+    tracer = tracing.current
+    if tracer is not None:
+        span_start = time.perf_counter_ns()
+
+    proc = subprocess.Popen(
+        cmd,
+        cwd=str(cwd),
+        stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=text,
+        env=env,
+        start_new_session=(os.name != "nt"),
+    )
+    try:
+        stdout, stderr = proc.communicate(input, timeout=timeout)
+    except subprocess.TimeoutExpired as e:
+        _kill_tree(proc)
+        proc.communicate()
+        if tracer is not None:
+            tracer.complete(f"git {op}", "git", span_start, time.perf_counter_ns(),
+                            {"argv": cmd, "cwd": str(cwd), "timeout": e.timeout})
+        raise GitTimeout(cmd, e.timeout)
+    except BaseException:
+        _kill_tree(proc)
+        proc.wait()
+        raise
+    finally:
+        GIT_DURATION.observe(time.perf_counter() - started, command=op)
+
+    if tracer is not None:
+        tracer.complete(f"git {op}", "git", span_start, time.perf_counter_ns(),
+                        {"argv": cmd, "cwd": str(cwd), "exit": proc.returncode,
+                         "stdout_bytes": _out_bytes(stdout), "stderr_bytes": _out_bytes(stderr)})
+
+    if check and proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, stdout, stderr)
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+
+def _find_dot_git(path: Path) -> Optional[Path]:
+    for d in (path, *path.parents):
+        dot_git = d / ".git"
+        if dot_git.exists():
+            return dot_git
+    return None
+
+def _dot_git_key(path: Path):
+    dot_git = _find_dot_git(path)
+    if dot_git is None:
+        return None
+    try:
+        st = dot_git.stat()
+    except OSError:
+        return None
+    return (str(dot_git), st.st_ino, st.st_mtime_ns)
+
+# path -> (.git key, verdict). The verdict is only re-checked with git when .git changes.
+_repo_cache: Dict[Path, Tuple[object, bool]] = {}
+
+def _cached_is_repo(path: Path) -> Optional[bool]:
+    hit = _repo_cache.get(path)
+    if hit is not None and hit[0] == _dot_git_key(path):
+        return hit[1]
+    return None
+
+def _remember_is_repo(path: Path, verdict: bool):
+    _repo_cache[path] = (_dot_git_key(path), verdict)
+
 def is_git_repo(path: Path):
+    cached = _cached_is_repo(path)
+    if cached is not None:
+        return cached
+
     try:
-        result = subprocess.run(
-            ["git", "rev-parse", "--is-inside-work-tree"],
-            cwd=str(path),
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        return result.stdout.strip() == "true"
-    
-    except subprocess.CalledProcessError:
-        return False
+        result = _git(["rev-parse", "--is-inside-work-tree"], path, check=True)
+        verdict = result.stdout.strip() == "true"
+
+    except (subprocess.CalledProcessError, OSError):
+        verdict = False
+
+    _remember_is_repo(path, verdict)
+    return verdict
+
+def _parse_status_v2(raw: bytes) -> Tuple[Dict[str, str], List[Tuple[str, str]]]:
+    """
+    Parse `git status --porcelain=v2 -z --branch`.
+    Returns (branch headers, [(XY, path), ...]); untracked entries use XY "??".
+    """
+    branch: Dict[str, str] = {}
+    entries: List[Tuple[str, str]] = []
+
+    records = raw.split(b"\0")
+    i = 0
+    while i < len(records):
+        rec = os.fsdecode(records[i])
+        i += 1
+        if not rec:
+            continue
+
+        kind = rec[0]
+        if kind == "#":
+            key, _, value = rec[2:].partition(" ")
+            branch[key] = value
+        elif kind == "1":
+            fields = rec.split(" ", 8)
+            entries.append((fields[1], fields[8]))
+        elif kind == "2":
+            fields = rec.split(" ", 9)
+            entries.append((fields[1], fields[9]))
+            i += 1  # original path of the rename/copy
+        elif kind == "u":
+            fields = rec.split(" ", 10)
+            entries.append((fields[1], fields[10]))
+        elif kind == "?":
+            entries.append(("??", rec[2:]))
+
+    return branch, entries
+
+def _status_fingerprint(path: Path, raw: bytes, entries: List[Tuple[str, str]], since_ns: int) -> Optional[str]:
+    """
+    Digest of the status output plus the stat data of every listed path, so edits to an
+    already-dirty file change it too. None when a file was touched while we were looking
+    (mtime newer than `since_ns`), since its content may not match what git saw.
+    """
+    h = hashlib.sha1(raw)
+    for _, rel in entries:
+        try:
+            st = os.lstat(path / rel)
+        except OSError:
+            h.update(b"-")
+            continue
+        if st.st_mtime_ns >= since_ns:
+            return None
+        h.update(f"{st.st_mtime_ns}:{st.st_size}:{st.st_ino}".encode())
+    return h.hexdigest()
+
+def probe_repo(path: Path, include_untracked: bool = False, optional_locks: bool = True,
+               untracked: Optional[UntrackedFilter] = None) -> Optional[dict]:
+    """
+    One `git status` call giving repo validity, dirty state and a fingerprint of the
+    dirty state. Returns None when `path` is not inside a git work tree.
+    Without `optional_locks`, git does not write back its refreshed index.
+    Untracked files excluded by `untracked` are dropped before anything looks at them.
+    {
+      "head": Optional[str],
+      "branch": Optional[str],
+      "entries": [(XY, path), ...],
+      "excluded": int,
+      "dirty": bool,
+      "fingerprint": Optional[str],
+    }
+    """
+    if _cached_is_repo(path) is False:
+        return None
+
+    cmd = ["status", "--porcelain=v2", "-z", "--branch"]
+    cmd.append("--untracked-files=all" if include_untracked else "--untracked-files=no")
+
+    since_ns = time.time_ns()
+    try:
+        env = None if optional_locks else dict(os.environ, GIT_OPTIONAL_LOCKS="0")
+        result = _git(cmd, path, text=False, env=env)
+    except OSError:
+        _remember_is_repo(path, False)
+        return None
+
+    if result.returncode != 0:
+        if b"not a git repository" in result.stderr:
+            _remember_is_repo(path, False)
+            return None
+        raise RuntimeError(os.fsdecode(result.stderr).strip() or f"git status exited {result.returncode}")
+
+    _remember_is_repo(path, True)
+    branch, entries = _parse_status_v2(result.stdout)
+    head = branch.get("branch.oid")
+    excluded = 0
+    if untracked is not None and include_untracked:
+        listed = len(entries)
+        entries = [e for e in entries if e[0] != "??" or not untracked.excluded(e[1])]
+        excluded = listed - len(entries)
+
+    return {
+        "head": None if head == "(initial)" else head,
+        "branch": branch.get("branch.head"),
+        "entries": entries,
+        "excluded": excluded,
+        "dirty": bool(entries),
+        "fingerprint": _status_fingerprint(path, result.stdout, entries, since_ns) if entries else None,
+    }
 
 def has_changes(path, include_untracked=False) -> bool:
 
-    cmd = ["git", "status", "--porcelain"]
+    cmd = ["status", "--porcelain"]
 
     if not include_untracked:
         cmd.append("--untracked-files=no")
 
-    result = subprocess.run(
-        cmd,
-        capture_output=True,
-        text=True,
-        cwd=path
-    )
+    result = _git(cmd, path)
     return bool(result.stdout.strip())
 
 def has_stash_changes(path, include_untracked=False) -> bool:
 
-    cmd = ["git", "diff", "stash@{0}", "--name-only"]
+    cmd = ["diff", "stash@{0}", "--name-only"]
 
     if include_untracked:
         cmd.append("-u")
 
-    result = subprocess.run(
-        cmd,
-        capture_output=True,
-        text=True,
-        cwd=path
-    )
+    result = _git(cmd, path)
     return bool(result.stdout.strip())
 
-def stash_changes(path, include_untracked=False):
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+def create_stash(path) -> Optional[str]:
+    """
+    `git stash create`: write the snapshot commit without touching any ref.
+    None when there is nothing stash-able, e.g. only untracked files are dirty.
+    It takes no options (its arguments are the message): untracked files are
+    added by stash_untracked().
+    """
+    result = _git(["stash", "create"], path)
+    return result.stdout.strip() or None
+
+def stash_tree(path, commit: str) -> str:
+    return _git(["rev-parse", f"{commit}^{{tree}}"], path, check=True).stdout.strip()
 
-    create_cmd = ["git", "stash", "create"] 
+def _commit_tree(path: Path, args: List[str]) -> str:
+    """
+    `git commit-tree`; without a configured identity the commit is signed by the watcher.
+    """
+    cmd = ["commit-tree", *args]
+    result = _git(cmd, path)
+    if result.returncode != 0 and "tell me who you are" in result.stderr:
+        env = dict(os.environ, GIT_AUTHOR_NAME=APP_NAME, GIT_AUTHOR_EMAIL="auto-stash@localhost",
+                   GIT_COMMITTER_NAME=APP_NAME, GIT_COMMITTER_EMAIL="auto-stash@localhost")
+        result = _git(cmd, path, env=env)
+    if result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, result.args, result.stdout, result.stderr)
+    return result.stdout.strip()
+
+def _add_to_index(path: Path, files: List[str], env: dict):
+    """
+    Stage `files` (paths from the repo root, as git status lists them) literally;
+    one that vanished meanwhile is just left out.
+    """
+    data = b"".join(os.fsencode(f) + b"\0" for f in files)
+    _git(["update-index", "--add", "--remove", "-z", "--stdin"], path, check=True, text=False,
+         input=data, env=env)
 
+def stash_untracked(path: Path, commit: Optional[str], files: List[str], head: Optional[str],
+                    branch: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """
+    stash backend: what `git stash create` can't do: add `files` as the third parent
+    ("untracked files on ...") of the stash commit, the layout `git stash -u` writes and
+    `git stash apply` restores. `commit` is the tracked-only stash, None when only
+    untracked files are dirty. Returns (stash commit, tree of the untracked files);
+    `commit` unchanged on an unborn branch, which `git stash` refuses too.
+    """
+    if not files or head is None:
+        return commit, None
+
+    git_dir = _git_dir_of(path)
+    if git_dir is None:
+        raise RuntimeError(f"cannot locate the git directory of {path}")
+    tmp = git_dir / f"auto-stash-untracked.{os.getpid()}"
+    _unlink(tmp)
+    env = dict(os.environ, GIT_INDEX_FILE=str(tmp), GIT_OPTIONAL_LOCKS="0")
+    try:
+        _add_to_index(path, files, env)
+        utree = _git(["write-tree"], path, check=True, env=env).stdout.strip()
+    finally:
+        _unlink(tmp)
+        _unlink(tmp.with_name(tmp.name + ".lock"))
+
+    label = f"{branch if branch and branch != '(detached)' else '(no branch)'}: {head[:7]}"
+    untracked = _commit_tree(path, [utree, "-m", f"untracked files on {label}"])
+    if commit is None:
+        # Only untracked files: work tree and index are HEAD's.
+        wtree = stash_tree(path, head)
+        index = _commit_tree(path, [wtree, "-p", head, "-m", f"index on {label}"])
+        message = f"WIP on {label}"
+    else:
+        raw = _git(["cat-file", "commit", commit], path, check=True).stdout
+        header, _, message = raw.partition("\n\n")
+        fields = [line.split(" ", 1) for line in header.splitlines()]
+        wtree = next(v for k, v in fields if k == "tree")
+        index = [v for k, v in fields if k == "parent"][1]
+        message = message.strip()
+    stash = _commit_tree(path, [wtree, "-p", head, "-p", index, "-p", untracked, "-m", message])
+    return stash, utree
+
+def _auto_message(now: datetime.datetime) -> str:
+    return now.strftime(AUTO_FORMAT)
+
+def _reword(path: Path, commit: str, message: str) -> str:
+    """
+    A commit with the tree and parents of `commit` and `message` as its message.
+    """
+    raw = _git(["cat-file", "commit", commit], path, check=True).stdout
+    tree, parents = None, []
+    for line in raw.partition("\n\n")[0].splitlines():
+        key, _, value = line.partition(" ")
+        if key == "tree":
+            tree = value
+        elif key == "parent":
+            parents += ["-p", value]
+    if tree is None:
+        raise RuntimeError(f"{commit} is not a commit")
+    return _commit_tree(path, [tree, *parents, "-m", message])
+
+def store_stash(path, commit: str) -> str:
+    message = _auto_message(datetime.datetime.now())
+
+    store_cmd = ["stash", "store", commit, "-m", message]
+    
+    _git(store_cmd, path, check=True)
+    return message
+
+def stash_changes(path, include_untracked=False):
+    ref = create_stash(path)
     if include_untracked:
-        create_cmd.append("--include-untracked")
+        probe = probe_repo(Path(path), True)
+        if probe is not None:
+            files = [rel for xy, rel in probe["entries"] if xy == "??"]
+            ref, _ = stash_untracked(Path(path), ref, files, probe["head"], probe["branch"])
+    if ref is None:
+        return None
 
-    result = subprocess.run(
-        create_cmd,
-        capture_output=True,
-        text=True,
-        cwd=path
-    )
+    message = store_stash(path, ref)
+    return ref, message
 
-    ref = result.stdout.strip()
-    message = f"auto-stash {timestamp}"
+def _stash_exists(path: Path, stash_id: Optional[str]) -> bool:
+    """
+    Whether `stash_id` is still one of the entries of refs/stash, read from the reflog
+    file directly. False when it cannot be told, so callers err on storing a new stash.
+    """
+    if not stash_id:
+        return False
+    git_dir = resolve_git_dir(path)
+    if git_dir is None:
+        return False
 
-    store_cmd = ["git", "stash", "store", ref, "-m", message]
-    
-    subprocess.run(
-        store_cmd,
-        check=True,
-        cwd=path
-    )
+    reflog = common_dir(git_dir) / "logs" / "refs" / "stash"
+    try:
+        with open(reflog, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                fields = line.split(" ", 2)
+                if len(fields) >= 2 and fields[1] == stash_id:
+                    return True
+    except OSError:
+        pass
+    return False
+
+def _git_dir_of(path: Path) -> Optional[Path]:
+    for d in (path, *path.parents):
+        git_dir = resolve_git_dir(d)
+        if git_dir is not None:
+            return git_dir
+    return None
+
+def object_store(path: Path) -> Optional[Path]:
+    """
+    Common git dir of `path`. Linked worktrees of one repo share it, and with it the
+    object database, refs/stash and packed-refs; a submodule has its own.
+    """
+    git_dir = _git_dir_of(path)
+    return common_dir(git_dir) if git_dir is not None else None
 
-    return ref, message
+# common git dir -> lock held while a job writes into it
+_store_locks: Dict[Path, threading.Lock] = {}
+_store_locks_guard = threading.Lock()
+
+def store_lock(path: Path):
+    """
+    Serializes the snapshot writes (objects, refs, the stash reflog) of jobs sharing
+    the object store of `path`. Probing never takes it, so worktrees of one repo
+    are still checked in parallel.
+    """
+    store = object_store(path)
+    if store is None:
+        return contextlib.nullcontext()
+    with _store_locks_guard:
+        lock = _store_locks.get(store)
+        if lock is None:
+            lock = _store_locks[store] = threading.Lock()
+    return lock
+
+def snapshot_ns(path: Path) -> str:
+    """
+    Ref namespace of the snapshots of `path`: a linked worktree gets
+    `refs/auto-stash/worktrees/<id>/`, so worktrees sharing refs keep separate histories.
+    """
+    git_dir = _git_dir_of(path)
+    wt = worktree_id(git_dir) if git_dir is not None else None
+    return f"{SNAPSHOT_NS}worktrees/{wt}/" if wt else SNAPSHOT_NS
+
+def _spread_by_store(paths: List[Path]) -> List[Path]:
+    """
+    `paths` taken round-robin over their object stores, so the worktrees of one repo,
+    whose writes take turns, don't occupy the whole pool while other repos wait.
+    """
+    groups: Dict[Path, List[Path]] = {}
+    for p in paths:
+        groups.setdefault(object_store(p) or p, []).append(p)
+    if len(groups) == len(paths):
+        return paths
+    return [p for batch in itertools.zip_longest(*groups.values()) for p in batch if p is not None]
+
+def _unlink(path: Path):
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+def snapshot_tree(path: Path, untracked: Sequence[str] = ()) -> Tuple[str, Optional[str], Optional[str]]:
+    """
+    refs backend: tree of the work tree as `git add -u` would stage it, plus the
+    `untracked` files (already pre-scanned), built in a private copy of the index, so
+    the user's index and `index.lock` are never touched. Returns (tree, HEAD, tree of
+    HEAD); the last two are None on an unborn branch.
+    """
+    git_dir = _git_dir_of(path)
+    if git_dir is None:
+        raise RuntimeError(f"cannot locate the git directory of {path}")
+
+    tmp = git_dir / f"auto-stash-index.{os.getpid()}"
+    _unlink(tmp)
+    try:
+        # A copy keeps the stat cache, so git only rehashes files that really changed.
+        shutil.copyfile(git_dir / "index", tmp)
+    except FileNotFoundError:
+        pass
+
+    env = dict(os.environ, GIT_INDEX_FILE=str(tmp), GIT_OPTIONAL_LOCKS="0")
+    try:
+        _git(["add", "-u"], path, check=True, env=env)
+        if untracked:
+            _add_to_index(path, list(untracked), env)
+        tree = _git(["write-tree"], path, check=True, env=env).stdout.strip()
+    finally:
+        _unlink(tmp)
+        _unlink(tmp.with_name(tmp.name + ".lock"))
+
+    result = _git(["rev-parse", "HEAD", "HEAD^{tree}"], path)
+    if result.returncode != 0:
+        return tree, None, None
+    head, head_tree = result.stdout.split()[:2]
+    return tree, head, head_tree
+
+def store_snapshot(path: Path, tree: str, head: Optional[str]) -> Tuple[str, str, str]:
+    """
+    refs backend: commit `tree` on top of `head` and point a new
+    `refs/auto-stash/<%Y%m%d-%H%M%S>` (see snapshot_ns) at it. Returns (commit, ref, message).
+    """
+    now = datetime.datetime.now()
+    message = _auto_message(now)
+
+    args = [tree, "-m", message]
+    if head:
+        args += ["-p", head]
+    commit = _commit_tree(path, args)
+    return commit, _new_snapshot_ref(path, commit, now), message
+
+def _new_snapshot_ref(path: Path, commit: str, now: datetime.datetime) -> str:
+    base = snapshot_ns(path) + now.strftime("%Y%m%d-%H%M%S")
+    ref = base
+    for n in range(1, 10):
+        # An empty old value makes update-ref refuse to overwrite an existing ref.
+        if _git(["update-ref", ref, commit, ""], path).returncode == 0:
+            return ref
+        ref = f"{base}.{n}"
+    raise RuntimeError(f"cannot create {base}: ref exists")
+
+def list_snapshot_refs(path: Path) -> List[Tuple[str, str, int, str]]:
+    """
+    [(ref, commit, commit time, message), ...] of `path` (its snapshot_ns), oldest first.
+    """
+    ns = snapshot_ns(path)
+    fmt = "%(refname)%00%(objectname)%00%(committerdate:unix)%00%(subject)"
+    out = _git(["for-each-ref", f"--format={fmt}", ns], path, check=True).stdout
+    refs = []
+    for line in out.splitlines():
+        ref, commit, ts, subject = line.split("\0", 3)
+        if ns == SNAPSHOT_NS and ref.startswith(SNAPSHOT_NS + "worktrees/"):
+            continue   # the linked worktrees' own
+        refs.append((ref, commit, int(ts or 0), subject))
+    refs.sort(key=lambda r: (r[2], r[0]))
+    return refs
+
+def delete_snapshot_refs(path: Path, refs: List[str]):
+    if refs:
+        stdin = "".join(f"delete {r}\n" for r in refs)
+        _git(["update-ref", "--stdin"], path, check=True, input=stdin)
+
+def _snapshot_exists(path: Path, ref: Optional[str], commit: Optional[str]) -> bool:
+    """
+    Whether `ref` still points at `commit`, read from the loose ref or packed-refs.
+    """
+    if not ref or not commit:
+        return False
+    git_dir = _git_dir_of(path)
+    if git_dir is None:
+        return False
+
+    cdir = common_dir(git_dir)
+    try:
+        return (cdir / ref).read_text(encoding="utf-8").strip() == commit
+    except OSError:
+        pass
+    try:
+        with open(cdir / "packed-refs", "r", encoding="utf-8", errors="replace") as f:
+            return any(line.rstrip("\n") == f"{commit} {ref}" for line in f)
+    except OSError:
+        return False
+
+def list_snapshots(path: Path) -> List[dict]:
+    """
+    Auto-stash snapshots of `path` from both backends, newest first:
+    [{"id": commit, "ref": "stash@{n}" | "refs/auto-stash/...", "time": epoch, "message": str}]
+    """
+    snaps: List[dict] = [{"id": c, "ref": r, "time": ts, "message": m}
+                         for r, c, ts, m in reversed(list_snapshot_refs(path))]
+
+    # refs/stash is shared by all worktrees: it belongs to the main one
+    reflog = stash_reflog(path) if snapshot_ns(path) == SNAPSHOT_NS else None
+    if reflog is not None and reflog.is_file():
+        entries = read_reflog(reflog)
+        for i, e in enumerate(reversed(entries)):
+            if e.is_auto:
+                snaps.append({"id": e.new, "ref": f"stash@{{{i}}}", "time": e.ts, "message": e.message})
+        snaps.sort(key=lambda d: -d["time"])
+    return snaps
+
+def import_history(history: History, paths: List[Path]) -> int:
+    """
+    Index the snapshots already in `paths` (both backends), e.g. ones stored before the
+    history existed. Returns how many were new.
+    """
+    added = 0
+    for path in paths:
+        snaps = list_snapshots(path)
+        if not snaps:
+            continue
+        known = {r["stash"] for r in history.query(repo=str(path), limit=None)}
+        snaps = [s for s in snaps if s["id"] not in known]
+        if not snaps:
+            continue
+        batch = "".join(f"{s['id']}^{{tree}}\n" for s in snaps)
+        trees = _git(["cat-file", "--batch-check=%(objectname)"], path, check=True,
+                     input=batch).stdout.split()
+        rows = []
+        for s, tree in zip(snaps, trees):
+            diff = _git(["diff-tree", "-r", "--name-only", "-z", f"{s['id']}^1", s["id"]], path)
+            changed = [p for p in diff.stdout.split("\0") if p] if diff.returncode == 0 else []
+            ref = s["ref"] if s["ref"].startswith("refs/") else None
+            rows.append((str(path), s["id"], None if tree == "missing" else tree, ref,
+                         float(s["time"]), s["message"], changed))
+        added += history.record(rows)
+    return added
+
+def snapshot_commit_exists(path: Path, commit: str) -> bool:
+    return _git(["cat-file", "-e", f"{commit}^{{commit}}"], path).returncode == 0
+
+def restore_snapshot(path: Path, commit: str) -> List[str]:
+    """
+    Write the files of snapshot `commit` (either backend; for the stash backend its
+    untracked files too) into the work tree of `path`. Nothing is staged and the
+    user's index is not touched; files created after the snapshot are left as they are.
+    Returns the commits checked out.
+    """
+    parents = _git(["rev-list", "--parents", "-n", "1", commit], path, check=True).stdout.split()[1:]
+    sources = [commit]
+    if len(parents) >= 3 and parents[2] != parents[0]:
+        sources.append(parents[2])   # "untracked files on ..." of a stash
+
+    git_dir = _git_dir_of(path)
+    if git_dir is None:
+        raise RuntimeError(f"cannot locate the git directory of {path}")
+    tmp = git_dir / f"auto-stash-restore.{os.getpid()}"
+    env = dict(os.environ, GIT_INDEX_FILE=str(tmp))
+    try:
+        for src in sources:
+            _unlink(tmp)
+            _git(["checkout", src, "--", ":/"], path, check=True, env=env)
+    finally:
+        _unlink(tmp)
+        _unlink(tmp.with_name(tmp.name + ".lock"))
+    return sources
 
 def stash_clear(paths: List[Path]):
+    """
+    Drop every auto-stash snapshot: the whole stash for repos on the stash backend,
+    and all refs under refs/auto-stash/ whatever the backend.
+    """
+    data = load_config()
+    opts = JobOptions.from_config(data, False)
+    state_file = configured_statefile(data)
+    configure_git_timeouts(data.get("timeouts"))
+
     print(_colorize("WARNING: This operation will permanently clear all stashes.", Colors.YELLOW, True))
 
     print("The following repositories will be affected:")
     for path in paths:
-        print(f"  - {path}")
+        print(f"  - {path} ({opts.backend_for(path)} backend)")
 
     confirm = input("Are you sure you want to continue? (yes/[no])").strip().lower()
 
@@ -141,179 +867,1016 @@ def stash_clear(paths: List[Path]):
             log(f"Skip non-git repo: {path}")
             continue
         
-        cmd = ["git", "stash", "clear"]
+        cmd = ["stash", "clear"]
 
         try:
-            subprocess.run(cmd, cwd=path, check=True)
+            delete_snapshot_refs(path, [r for r, _, _, _ in list_snapshot_refs(path)])
+            if opts.backend_for(path) == "stash" and snapshot_ns(path) == SNAPSHOT_NS:
+                _git(cmd, path, check=True)
+            forget_stash_state(state_file, [path])
             log(f"Stash cleared in {path}")
 
-        except subprocess.CalledProcessError as e:
+        except (subprocess.CalledProcessError, GitTimeout) as e:
             log(f"Failed to clear stash in {path}: {e}")
 
 # -------------- Core Job --------------------
-def apply_config(data, interval, include_untracked, fmt):
+def apply_config(data, interval, include_untracked, fmt, jobs=None):
+    g = data.get("global") or {}
+
     if not interval:
-        interval = data['global'].get("interval", 300)
+        interval = g.get("interval", 300)
     if not include_untracked:
-        include_untracked = data['global'].get("include_untracked", False)
+        include_untracked = g.get("include_untracked", False)
     if not fmt:
-        fmt = data['global'].get("format", "line")
+        fmt = g.get("format", "line")
+    if not jobs:
+        jobs = g.get("jobs", DEFAULT_JOBS)
 
-    return interval, include_untracked, fmt
+    return interval, include_untracked, fmt, max(1, int(jobs))
     
-def build_stash_state(paths: List[Path]):
-    return {p: False for p in paths}
+class RepoState:
+    """
+    What the watcher remembers about one repo between cycles.
+    Only the job running on that repo touches it.
+    """
+    __slots__ = ("stashed", "fingerprint", "index_snapshot", "stash_id", "tree", "ref",
+                 "failures", "retry_at", "compacted", "index_ns")
+
+    def __init__(self, stash_id: Optional[str] = None, tree: Optional[str] = None,
+                 ref: Optional[str] = None):
+        self.stashed = tree is not None
+        self.fingerprint: Optional[str] = None
+        self.index_snapshot: Optional[IndexSnapshot] = None
+        # last auto-stash, its tree and (refs backend) its ref, persisted in the state file
+        self.stash_id = stash_id
+        self.tree = tree
+        self.ref = ref
+        # circuit breaker
+        self.failures = 0
+        self.retry_at: Optional[float] = None
+        # retention applied since start-up (it is re-applied after every new stash)
+        self.compacted = False
+        # index mtime our own job left, so it doesn't count as the user's activity
+        self.index_ns: Optional[int] = None
+
+class JobResult:
+    """
+    Outcome of one repo job. `status` is one of STASHED, NO_CHANGES, SKIPPED,
+    DEFERRED or ERROR; the snapshot fields are only set for STASHED.
+    """
+    __slots__ = ("repo", "status", "detail", "stash_id", "message", "tree", "ref", "paths",
+                 "started", "duration")
+
+    def __init__(self, repo: str, status: str, detail: Optional[str] = None,
+                 stash_id: Optional[str] = None, message: Optional[str] = None,
+                 tree: Optional[str] = None, ref: Optional[str] = None,
+                 paths: Sequence[str] = ()):
+        self.repo = repo
+        self.status = status
+        self.detail = detail
+        self.stash_id = stash_id
+        self.message = message
+        # for the history index
+        self.tree = tree
+        self.ref = ref
+        self.paths = paths
+        # set by run_cycle
+        self.started: Optional[float] = None
+        self.duration: Optional[float] = None
+
+    def __repr__(self):
+        return f"JobResult({self.repo!r}, {self.status!r}, detail={self.detail!r})"
+
+    def record(self, run_id: Optional[int] = None) -> dict:
+        """
+        Flat form for `--fmt jsonl`: unset fields are left out.
+        """
+        rec = {"type": "job", "ts": _round(self.started, 3), "run": run_id, "repo": self.repo,
+               "status": self.status, "duration": _round(self.duration, 4), "stash": self.stash_id,
+               "tree": self.tree, "ref": self.ref, "message": self.message, "detail": self.detail}
+        if self.paths:
+            rec["changed"] = len(self.paths)
+        return {k: v for k, v in rec.items() if v is not None}
+
+def _round(value: Optional[float], digits: int) -> Optional[float]:
+    return None if value is None else round(value, digits)
+
+class JobOptions:
+    """
+    Settings shared by every stash job of a watcher.
+    """
+    __slots__ = ("include_untracked", "fast_path", "state_file",
+                 "breaker_threshold", "breaker_backoff", "breaker_max_backoff", "slow_job",
+                 "metrics_textfile", "retention", "backend", "repo_backends", "untracked", "defer_delay", "busy_quiet", "history", "shard")
+
+    def __init__(self, include_untracked: bool = False, fast_path: bool = True,
+                 state_file: Optional[Path] = None, breaker_threshold: int = BREAKER_THRESHOLD,
+                 breaker_backoff: float = BREAKER_BACKOFF,
+                 breaker_max_backoff: float = BREAKER_MAX_BACKOFF, slow_job: Optional[float] = None,
+                 retention: Optional[RetentionPolicy] = None, backend: str = "stash",
+                 repo_backends: Optional[Dict[str, str]] = None,
+                 untracked: Optional[UntrackedFilter] = None, defer_delay: float = DEFAULT_DEFER_DELAY,
+                 busy_quiet: float = DEFAULT_BUSY_QUIET):
+        self.include_untracked = include_untracked
+        self.fast_path = fast_path
+        self.state_file = state_file
+        self.breaker_threshold = breaker_threshold
+        self.breaker_backoff = breaker_backoff
+        self.breaker_max_backoff = breaker_max_backoff
+        self.slow_job = slow_job   # a job slower than this counts as a failure
+        self.metrics_textfile: Optional[Path] = None
+        self.retention = retention
+        # "stash": git stash create/store. "refs": private index + refs/auto-stash/<ts>.
+        self.backend = backend
+        self.repo_backends = repo_backends or {}
+        # pre-scan of untracked files (include_untracked); None snapshots all of them
+        self.untracked = untracked
+        # DEFERRED: the user's git is mid-operation; try again after `defer_delay`
+        self.defer_delay = defer_delay
+        self.busy_quiet = busy_quiet
+        self.history: Optional[History] = None   # index of every STASHED result
+        self.shard: Optional[Shard] = None   # set by `watch --shard`
+
+    def backend_for(self, path: Path) -> str:
+        backend = self.repo_backends.get(str(path), self.backend)
+        return "refs" if backend == "refs" else "stash"
+
+    @classmethod
+    def from_config(cls, data: dict, include_untracked: bool, state_file: Optional[Path] = None):
+        g = data.get("global") or {}
+        return cls(
+            include_untracked,
+            fast_path=bool(g.get("fast_path", True)),
+            state_file=state_file,
+            breaker_threshold=int(g.get("breaker_threshold", BREAKER_THRESHOLD)),
+            breaker_backoff=float(g.get("breaker_backoff", BREAKER_BACKOFF)),
+            breaker_max_backoff=float(g.get("breaker_max_backoff", BREAKER_MAX_BACKOFF)),
+            slow_job=float(g["slow_job"]) if g.get("slow_job") else None,
+            retention=RetentionPolicy.from_config(data.get("retention")),
+            backend=g.get("backend", "stash"),
+            repo_backends={_normalize_path(str(k)): v["backend"]
+                           for k, v in (data.get("repos") or {}).items()
+                           if isinstance(v, dict) and v.get("backend")},
+            untracked=UntrackedFilter.from_config(data.get("untracked")),
+            defer_delay=float(g.get("defer_delay", DEFAULT_DEFER_DELAY)),
+            busy_quiet=float(g.get("busy_quiet", DEFAULT_BUSY_QUIET)),
+        )
 
-def do_stash_job(path: Path, include_untracked: bool, stashed: bool):
+def build_stash_state(paths: List[Path], saved: Optional[dict] = None):
+    saved = saved or {}
+    state = {}
+    for p in paths:
+        rec = saved.get(str(p)) or {}
+        state[p] = RepoState(rec.get("stash"), rec.get("tree"), rec.get("ref"))
+    return state
+
+def do_stash_job(path: Path, include_untracked: bool, state: RepoState, fast_path: bool = True,
+                 backend: str = "stash", untracked: Optional[UntrackedFilter] = None,
+                 busy_quiet: float = 0.0) -> JobResult:
     """
-    回傳統一結構
-    {
-      "repo": str,
-      "status": "STASHED" | "NO_CHANGES" | "ERROR",
-      "stash_id": Optional[str],
-      "message": Optional[str],
-      "detail": Optional[str],
-    }
+    With `fast_path`, a repo whose index, HEAD and tracked files have the same stat data as
+    when the previous cycle verified it is answered from `.git/index` without running git.
+    Untracked files are invisible to the index, so `include_untracked` disables it.
+
+    Before running git, a repo where the user's own git is mid-operation (rebase, merge,
+    a held index.lock, an index written in the last `busy_quiet` seconds) is DEFERRED.
+
+    Returns a JobResult: STASHED, NO_CHANGES, SKIPPED, DEFERRED or ERROR.
     """
     try:
-        if not is_git_repo(path):
-            return {"repo": str(path), "status": "SKIPPED", "detail": "not a git repository"}
-
-        if has_changes(path, include_untracked):
-
-            if stashed:
-                if not has_stash_changes(path, include_untracked):
-                    return {"repo": str(path), "status": "NO_CHANGES"}
-                
-            ret = stash_changes(path)
-            stash_id: Optional[str] = None
-            message: Optional[str] = None
-
-            if isinstance(ret, tuple):
-                if len(ret) >= 1:
-                    stash_id = ret[0]
-                if len(ret) >= 2:
-                    message = ret[1]
-                
-            return {
-                "repo": str(path),
-                "status": "STASHED",
-                "stash_id": stash_id,
-                "message": message,
-            }
-        
-        else:
-            return {"repo": str(path), "status": "NO_CHANGES"}
+        snap = None
+        if fast_path and not include_untracked:
+            with tracing.span("fast path", "job") as span:
+                if state.index_snapshot is not None and unchanged_since(path, state.index_snapshot):
+                    span["hit"] = True
+                    return JobResult(str(path), "NO_CHANGES")
+                # Taken before git looks, so anything that moves meanwhile shows up next time.
+                snap = take_snapshot(path, state.index_snapshot)
+
+        git_dir = resolve_git_dir(path)
+        if git_dir is not None:
+            reason = busy_reason(git_dir, busy_quiet, state.index_ns)
+            if reason is not None:
+                return JobResult(str(path), "DEFERRED", reason)
+
+        state.index_snapshot = None
+        res = _stash_job(path, include_untracked, state, backend, untracked)
+        if res.status in ("NO_CHANGES", "STASHED"):
+            state.index_snapshot = snap
+        if git_dir is not None:
+            try:
+                state.index_ns = os.stat(git_dir / "index").st_mtime_ns
+            except OSError:
+                state.index_ns = None
+        return res
 
     except Exception as e:
-        return {
-            "repo": str(path),
-            "status": "ERROR",
-            "detail": str(e)
-        }
+        return JobResult(str(path), "ERROR", str(e))
 
-def run_watcher(paths: List[Path], interval, include_untracked, fmt, color: bool=True):
-    log("=== Git Auto Stash Watcher Started ===")
-    next_run = time.time()
-    run_id = 0
+def _degraded(path: Path, state: RepoState, now: float) -> Optional[JobResult]:
+    if state.retry_at is None or now >= state.retry_at:
+        return None
+    return JobResult(str(path), "SKIPPED",
+                     f"degraded after {state.failures} failures, retry at {_clock(state.retry_at)}")
 
-    data = load_config()
-    interval, include_untracked, fmt = apply_config(data, interval, include_untracked, fmt)
+def _record_outcome(state: RepoState, res: JobResult, elapsed: float, opts: JobOptions, now: float):
+    """
+    Circuit breaker: `breaker_threshold` consecutive errors or slow jobs open it for
+    `breaker_backoff` seconds, doubling per further failure up to `breaker_max_backoff`.
+    """
+    if res.status == "DEFERRED":
+        return   # nothing was tried
+    slow = opts.slow_job is not None and elapsed > opts.slow_job
+    if res.status != "ERROR" and not slow:
+        state.failures = 0
+        state.retry_at = None
+        return
 
-    stash_state = build_stash_state(paths)
+    state.failures += 1
+    over = state.failures - opts.breaker_threshold
+    if over >= 0:
+        backoff = min(opts.breaker_backoff * (2 ** over), opts.breaker_max_backoff)
+        state.retry_at = now + backoff
+        if slow and not res.detail:
+            res.detail = f"slow ({elapsed:.1f}s)"
 
+def _apply_retention(path: Path, state: RepoState, res: JobResult, policy: RetentionPolicy, backend: str):
+    """
+    Thin out old auto-stashes once per repo at start-up and then after each new one,
+    so the history only ever grows by one snapshot between two passes.
+    """
+    if res.status != "STASHED" and (state.compacted or res.status != "NO_CHANGES"):
+        return
+    state.compacted = True
     try:
-        while True:
-            now = time.time()
-            if now >= next_run:
-                run_id += 1
-                start = time.time()
+        with store_lock(path):
+            if backend == "refs" or snapshot_ns(path) != SNAPSHOT_NS:
+                expired = expired_refs([(r, ts) for r, _, ts, _ in list_snapshot_refs(path)], policy)
+                delete_snapshot_refs(path, expired)
+                pruned = len(expired)
+            else:
+                pruned = compact_stashes(path, policy)
+    except (OSError, subprocess.CalledProcessError, GitTimeout) as e:
+        log(f"Retention skipped in {path}: {e}")
+        return
+    if pruned:
+        STASHES_PRUNED.inc(pruned)
+        log(f"Pruned {pruned} old auto-stash(es) in {path}")
 
-                results: List[dict] = []
-                try:
-                    for path in paths:
-                        res = do_stash_job(path, include_untracked, stash_state[path])
+def _untracked_files(path: Path, probe: dict, untracked: Optional[UntrackedFilter]) -> Tuple[List[str], Optional[str]]:
+    """
+    Untracked files of `probe` worth snapshotting, and a note on what was left out.
+    """
+    files = [rel for xy, rel in probe["entries"] if xy == "??"]
+    if untracked is None:
+        return files, None
+    files, skip = untracked.select(path, files)
+    skip.excluded += probe["excluded"]
+    return files, (skip.describe(untracked) if skip else None)
+
+def _stash_job(path: Path, include_untracked: bool, state: RepoState, backend: str = "stash",
+               untracked: Optional[UntrackedFilter] = None) -> JobResult:
+    # The refs backend never writes the user's index, not even git status' stat refresh.
+    probe = probe_repo(path, include_untracked, optional_locks=(backend != "refs"), untracked=untracked)
+    if probe is None:
+        return JobResult(str(path), "SKIPPED", "not a git repository")
+
+    if probe["dirty"]:
+        fingerprint = probe["fingerprint"]
+
+        # Same dirty state as the last snapshot: nothing to compare.
+        if state.stashed and fingerprint is not None and fingerprint == state.fingerprint:
+            return JobResult(str(path), "NO_CHANGES")
+
+        files, detail = _untracked_files(path, probe, untracked) if include_untracked else ([], None)
+        unchanged = JobResult(str(path), "NO_CHANGES", detail)
+        # A linked worktree shares refs/stash with its repo: its stashes go under its own refs.
+        linked = snapshot_ns(path) != SNAPSHOT_NS
+
+        with store_lock(path):
+            since_ns = time.time_ns()
+            ref = None
+            if backend == "refs":
+                tree, head, head_tree = snapshot_tree(path, files)
+                if tree == head_tree:
+                    return unchanged
+                exists = _snapshot_exists(path, state.ref, state.stash_id)
+            else:
+                created, utree = stash_untracked(path, create_stash(path), files,
+                                                 probe["head"], probe["branch"])
+                if created is None:
+                    return unchanged
+                stash_id = created
+                tree = stash_tree(path, stash_id)
+                if utree:
+                    tree += "+" + utree   # the untracked files are part of what we deduplicate on
+                exists = _snapshot_exists(path, state.ref, state.stash_id) if linked else \
+                    _stash_exists(path, state.stash_id)
+
+            # Identical tree to the last auto-stash, which still exists: don't store a duplicate.
+            if tree == state.tree and exists:
+                state.fingerprint = fingerprint
+                return unchanged
+
+            if backend == "refs":
+                stash_id, ref, message = store_snapshot(path, tree, head)
+            elif linked:
+                # No reflog to carry the message here: the commit itself must say auto-stash,
+                # as those of the refs backend do, for `snapshots`, history and retention.
+                now = datetime.datetime.now()
+                message = _auto_message(now)
+                stash_id = _reword(path, stash_id, message)
+                ref = _new_snapshot_ref(path, stash_id, now)
+            else:
+                message = store_stash(path, stash_id)
+
+            STASHES.inc()
+            store = object_store(path)
+            if store is not None:
+                # under the lock, so no other job's objects are counted
+                SNAPSHOT_BYTES.inc(new_object_bytes(store / "objects", since_ns))
+
+        state.stashed = True
+        state.fingerprint = fingerprint
+        state.stash_id = stash_id
+        state.tree = tree
+        state.ref = ref
+            
+        return JobResult(str(path), "STASHED", detail, stash_id=stash_id, message=message,
+                         tree=tree.partition("+")[0], ref=ref,
+                         paths=[rel for xy, rel in probe["entries"] if xy != "??"] + files)
+    
+    else:
+        return JobResult(str(path), "NO_CHANGES")
 
-                        if res['status'] == "STASHED":
-                            stash_state[path] = True
+def run_cycle(executor: ThreadPoolExecutor, paths: List[Path], opts: JobOptions,
+              stash_state: dict, on_result=None) -> List[JobResult]:
+    """
+    Run one stash job per repo on the worker pool.
+    Results come back in the same order as `paths`, whatever order the jobs finish in;
+    `on_result`, if given, is also called with each one as soon as its job is done.
+    A repo is only ever handled by one job per cycle, so jobs on the same repo never overlap;
+    jobs on worktrees of one repo probe in parallel and take turns writing (store_lock).
+    """
+    def job(path: Path) -> JobResult:
+        started = time.time()
+        with tracing.span("job", "job", repo=str(path)) as span:
+            res = _job(path)
+            span["status"] = res.status
+            if res.detail:
+                span["detail"] = res.detail
+        res.started = started
+        res.duration = time.time() - started
+        return res
+
+    def _job(path: Path) -> JobResult:
+        state = stash_state[path]
+        start = time.time()
+
+        skipped = _degraded(path, state, start)
+        if skipped is not None:
+            return skipped
+        if opts.shard is not None:
+            holder = opts.shard.acquire(path)
+            if holder is not None:
+                return JobResult(str(path), "SKIPPED", f"leased by {holder}")
+
+        backend = opts.backend_for(path)
+        res = do_stash_job(path, opts.include_untracked, state, fast_path=opts.fast_path,
+                           backend=backend, untracked=opts.untracked, busy_quiet=opts.busy_quiet)
+        if opts.retention is not None:
+            with tracing.span("retention", "job", repo=str(path)):
+                _apply_retention(path, state, res, opts.retention, backend)
+        done = time.time()
+        _record_outcome(state, res, done - start, opts, done)
+
+        JOB_DURATION.observe(done - start)
+        JOBS.inc(status=res.status)
+        if res.status == "ERROR":
+            ERRORS.inc(repo=str(path))
+        return res
+
+    order = _spread_by_store(paths)
+    if on_result is None:
+        if order is paths:
+            return list(executor.map(job, paths))
+        done = dict(zip(order, executor.map(job, order)))
+        return [done[p] for p in paths]
+
+    index = {p: i for i, p in enumerate(paths)}
+    results: List[Optional[JobResult]] = [None] * len(paths)
+    futures = {executor.submit(job, p): index[p] for p in order}
+    for fut in as_completed(futures):
+        res = results[futures[fut]] = fut.result()
+        on_result(res)
+    # every slot is filled by now (a failed job raised above); this only drops the Optional
+    return [r for r in results if r is not None]
+
+def _guarded_cycle(executor: ThreadPoolExecutor, paths: List[Path], opts: JobOptions,
+                   stash_state: dict, on_result=None) -> Tuple[float, float, List[JobResult]]:
+    start = time.time()
+    results: List[JobResult] = []
+    cycle = tracing.span("cycle", "cycle", repos=len(paths))
+    try:
+        with cycle:
+            results = run_cycle(executor, paths, opts, stash_state, on_result=on_result)
 
-                        results.append(res)
+            if opts.state_file and any(r.status == "STASHED" for r in results):
+                # Only this batch: other workers (--shard) save the repos they handle.
+                with tracing.span("save state", "cycle"):
+                    save_stash_state(opts.state_file, {p: stash_state[p] for p in paths})
+            if opts.history is not None:
+                with tracing.span("history", "cycle"):
+                    _record_history(opts.history, results, start)
 
-                    next_run += interval
-                    while next_run < now:
-                        next_run += interval
-
-                except Exception as e:
-                    results.append({
-                        "repo": "<run-level>",
-                        "status": "ERROR",
-                        "detail": str(e)
-                    })
-                elapsed = time.time() - start
-
-                if fmt == "pretty":
-                    _render_pretty(run_id, start, elapsed, next_run, results, color)
-                else:
-                    _render_line(start, elapsed, next_run, results, color)
+    except Exception as e:
+        results.append(JobResult("<run-level>", "ERROR", str(e)))
+        if on_result is not None:
+            on_result(results[-1])
+    elapsed = time.time() - start
+    if tracing.current is not None:
+        tracing.current.flush()
+    CYCLES.inc()
+    CYCLE_DURATION.observe(elapsed)
+    if opts.metrics_textfile:
+        try:
+            write_textfile(opts.metrics_textfile)
+        except OSError as e:
+            log(f"Failed to write metrics textfile {opts.metrics_textfile}: {e}")
+
+    return start, elapsed, results
+
+def _record_history(history: History, results: List[JobResult], at: float):
+    # each snapshot at its own job's start; `at` only for results run_cycle didn't time
+    rows = [(r.repo, r.stash_id, r.tree, r.ref, r.started if r.started is not None else at,
+             r.message, r.paths)
+            for r in results if r.status == "STASHED" and r.stash_id is not None]
+    if not rows:
+        return
+    try:
+        history.record(rows)
+    except sqlite3.Error as e:
+        log(f"History not updated: {e}")
 
-            else:
-                sleep_time = next_run - now
-                if sleep_time > 0:
-                    time.sleep(sleep_time)
-    except KeyboardInterrupt:
-        log("=== Git Auto Stash Watcher Stopped by user ===")
+def build_scheduler(data: dict, interval) -> Scheduler:
+    """
+    Per-repo overrides come from the `repos:` section of config.yaml:
+      repos:
+        ~/work/busy-repo: {interval: 60, min_interval: 15}
+        ~/archive/old-repo: {interval: 3600}
+    """
+    return Scheduler(interval, **_scheduler_settings(data))
 
-# -------------- Tracking list Management -------
+def _scheduler_settings(data: dict) -> dict:
+    g = data.get("global") or {}
+    overrides = {_normalize_path(str(k)): v for k, v in (data.get("repos") or {}).items()
+                 if isinstance(v, dict)}
+    return {
+        "min_interval": g.get("min_interval"),
+        "max_interval": g.get("max_interval"),
+        "jitter": g.get("jitter", DEFAULT_JITTER),
+        "overrides": overrides,
+    }
 
-def default_trackfile():
+def _mtime(path: Optional[Path]):
+    try:
+        return path.stat().st_mtime_ns if path is not None else None
+    except OSError:
+        return None
+
+class WatchTargets:
     """
-    Default list location:
-      - Windows: %APPDATA%/GitAutoStash/tracklist.txt
-      - Others: ~/.config/git-auto-stash/tracklist.txt
+    The repo set of a running watcher: the fixed `paths` plus the repos discovered
+    under `roots`, re-walked every `rescan` seconds. With `trackfile` / `rootsfile`,
+    edits of those files (e.g. `auto-stash add`) are picked up too: `paths` is
+    replaced by the tracklist and `roots` extended by the roots file.
+    `poll()` reports what changed.
     """
-    if os.name == "nt":
-        base = Path(os.environ.get("APPDATA", Path.home() / "AppData" / "Roaming"))
-        return base / APP_NAME / "tracklist.txt"
-    
-    else:
-        return Path.home() / ".config" / "git-auto-stash" / "tracklist.txt"
+    def __init__(self, paths: List[Path], roots: Optional[List[Path]] = None,
+                 discovery: Optional[RepoDiscovery] = None, rescan: float = DEFAULT_RESCAN,
+                 trackfile: Optional[Path] = None, rootsfile: Optional[Path] = None):
+        self.fixed = list(dict.fromkeys(paths))
+        self.extra_roots = list(roots or [])
+        self.roots = list(self.extra_roots)
+        self.discovery = discovery if discovery is not None else RepoDiscovery()
+        self.rescan = rescan
+        self.trackfile = trackfile
+        self.rootsfile = rootsfile
+        self._stamps = (_mtime(trackfile), _mtime(rootsfile))
+        self._forced = False
+        self.current: List[Path] = []
+        self.next_check: Optional[float] = None
+
+    def _load_files(self):
+        if self.trackfile is not None:
+            self.fixed = load_tracklist(self.trackfile)
+        if self.rootsfile is not None:
+            self.roots = list(dict.fromkeys(load_tracklist(self.rootsfile) + self.extra_roots))
+
+    def _collect(self) -> List[Path]:
+        found = self.discovery.scan(self.roots) if self.roots else []
+        return list(dict.fromkeys(self.fixed + found))
+
+    def force(self):
+        """
+        Re-read the files and re-walk the roots at the next `poll()`.
+        """
+        self._forced = True
+
+    def initial(self) -> List[Path]:
+        self._load_files()
+        self.current = self._collect()
+        self.next_check = time.time() + self.rescan if self.roots else None
+        return list(self.current)
+
+    def poll(self, now: float) -> Tuple[List[Path], List[Path]]:
+        """
+        (added, removed) since the previous call. Costs two stats unless a file
+        changed or a rescan of the roots is due.
+        """
+        stamps = (_mtime(self.trackfile), _mtime(self.rootsfile))
+        files_changed = stamps != self._stamps
+        rescan_due = self.next_check is not None and now >= self.next_check
+        if not (files_changed or rescan_due or self._forced):
+            return [], []
+
+        if files_changed or self._forced:
+            self._stamps = stamps
+            self._load_files()
+        self._forced = False
+        self.next_check = now + self.rescan if self.roots else None
+
+        new = self._collect()
+        old = set(self.current)
+        added = [p for p in new if p not in old]
+        kept = set(new)
+        removed = [p for p in self.current if p not in kept]
+        self.current = new
+        return added, removed
+
+def _retarget(paths: List[Path], added: List[Path], removed: List[Path], opts: JobOptions,
+              stash_state: dict, sched: Optional[Scheduler] = None, events=None, maint=None,
+              ctl: Optional[Control] = None):
+    """
+    Apply a change of the repo set between two cycles, when no job is in flight.
+    Repos that stay keep their state; new ones start from the state file.
+    """
+    now = time.time()
+    saved = load_stash_state(opts.state_file) if opts.state_file and added else {}
+    for p in removed:
+        paths.remove(p)
+        stash_state.pop(p, None)
+        if sched is not None:
+            sched.remove(p)
+        if events is not None:
+            events.remove_repo(p)
+        if maint is not None:
+            maint.forget(p)
+    for p in added:
+        paths.append(p)
+        stash_state.update(build_stash_state([p], saved))
+        if sched is not None:
+            sched.add(p, now)
+        if events is not None:
+            events.add_repo(p)
+        if maint is not None:
+            maint.watch([p])
+    if ctl is not None:
+        ctl.set_repos(paths, stash_state)
+
+    if added:
+        log(f"Watching {len(added)} new repo(s): {', '.join(map(str, added))}")
+    if removed:
+        log(f"Stopped watching {len(removed)} repo(s): {', '.join(map(str, removed))}")
+
+def _rebalance(shard: Shard, paths: List[Path], opts: JobOptions, stash_state: dict,
+               maint=None) -> List[Path]:
+    """
+    Recompute this worker's share of `paths`. Repos taken over start from the state
+    file, which their previous owner kept up to date if it ran on this host (state.json
+    is per host; from another machine they start empty). Returns them.
+    """
+    gained, lost = shard.assign(paths)
+    if gained and opts.state_file:
+        stash_state.update(build_stash_state(gained, load_stash_state(opts.state_file)))
+    if maint is not None:
+        maint.watch(gained)
+        for p in lost:
+            maint.forget(p)
+    if gained or lost:
+        log(f"Shard {shard.name}: {len(shard.owned)} of {len(paths)} repo(s) "
+            f"(+{len(gained)} -{len(lost)}, live shards: {len(shard.live)})")
+    return gained
+
+RELOAD_CHECK = 5.0 # second; longest a loop sleeps before looking at config / SIGHUP again
+# global keys that only take effect at start-up
+RESTART_KEYS = ("format", "jobs", "mode", "debounce", "state_file", "log_file", "log_max_bytes",
+                "log_backup_count", "log_rotate_when", "log_compress", "control_socket")
+
+class Reloader:
+    """
+    Re-reads config.yaml when its mtime moves or on SIGHUP and applies it to the running
+    watcher between two cycles, so per-repo state and queued work are kept. Command-line
+    options keep precedence over the file, as at start-up.
+    """
+    def __init__(self, config_file: Path, data: dict, cli: dict, opts: JobOptions,
+                 targets: Optional[WatchTargets] = None, maint=None):
+        self.config_file = config_file
+        self.data = data
+        self.cli = cli   # interval, include_untracked, fmt, jobs as given on the command line
+        self.opts = opts
+        self.targets = targets
+        self.maint = maint
+        self._stamp = _mtime(config_file)
+        self._hup = False
+
+    def request(self, *_):
+        """
+        Signal handler: only flags the reload, which happens at the next loop turn.
+        """
+        self._hup = True
+
+    def install(self):
+        if hasattr(signal, "SIGHUP"):
+            try:
+                signal.signal(signal.SIGHUP, self.request)
+            except ValueError:
+                pass   # not the main thread
+
+    def poll(self, now: float, sched: Optional[Scheduler] = None) -> bool:
+        stamp = _mtime(self.config_file)
+        hup, self._hup = self._hup, False
+        if stamp == self._stamp and not hup:
+            return False
+        self._stamp = stamp
+        if hup and self.targets is not None:
+            self.targets.force()
 
-def _normalize_path(p: str) -> str:
+        try:
+            data = load_config(self.config_file)
+        except (OSError, yaml.YAMLError) as e:
+            log(f"Config not reloaded, keeping the previous one: {e}")
+            return False
+        self.apply(data, now, sched)
+        return True
+
+    def apply(self, data: dict, now: float, sched: Optional[Scheduler] = None):
+        old_g, g = self.data.get("global") or {}, data.get("global") or {}
+        stale = [k for k in RESTART_KEYS if old_g.get(k) != g.get(k)]
+        if (self.data.get("metrics") or {}) != (data.get("metrics") or {}):
+            stale.append("metrics")
+        self.data = data
+
+        interval, include_untracked, _, _ = apply_config(
+            data, self.cli.get("interval"), self.cli.get("include_untracked"), "line", 1)
+        fresh = JobOptions.from_config(data, include_untracked, self.opts.state_file)
+        for name in JobOptions.__slots__:
+            if name not in ("state_file", "metrics_textfile", "history", "shard"):
+                setattr(self.opts, name, getattr(fresh, name))
+        configure_git_timeouts(data.get("timeouts"))
+
+        if sched is not None:
+            sched.retune(interval, now=now, **_scheduler_settings(data))
+        if self.maint is not None:
+            self.maint.configure(data.get("maintenance"))
+        if self.targets is not None:
+            cfg = data.get("discovery") or {}
+            self.targets.discovery = build_discovery(data)
+            self.targets.rescan = float(cfg.get("interval", DEFAULT_RESCAN))
+
+        log("Config reloaded" + (f"; restart to apply: {', '.join(stale)}" if stale else ""))
+
+def _watch_poll(executor, paths, sched: Scheduler, opts, stash_state, fmt, color, maint=None,
+                targets: Optional[WatchTargets] = None, reloader: Optional[Reloader] = None,
+                ctl: Optional[Control] = None):
+    shard = opts.shard
+    order = {p: i for i, p in enumerate(paths)}
+    now = time.time()
+    for p in paths:
+        sched.add(p, now)
+        if ctl is not None:
+            ctl.set_due(p, sched.due(p))
+
+    renderer = make_renderer(fmt, color)
+    run_id = 0
 
-    return str(Path(os.path.expandvars(os.path.expanduser(p))).resolve())
+    while True:
+        now = time.time()
+        if reloader is not None:
+            reloader.poll(now, sched)
+        if targets is not None:
+            added, removed = targets.poll(now)
+            if added or removed:
+                _retarget(paths, added, removed, opts, stash_state, sched=sched, maint=maint, ctl=ctl)
+                order = {p: i for i, p in enumerate(paths)}
+                if shard is not None:
+                    _rebalance(shard, paths, opts, stash_state, maint)
+        if shard is not None and shard.beat(now):
+            for p in _rebalance(shard, paths, opts, stash_state, maint):
+                sched.trigger(p, now)
+        if ctl is not None:
+            for p in ctl.take_triggers():
+                sched.trigger(p, now)
+
+        next_due = sched.next_due()
+        if next_due is not None and next_due <= now:
+            # Also take repos due within the next moment, so jitter doesn't fragment batches.
+            batch = sched.pop_due(now, window=BATCH_WINDOW)
+            batch.sort(key=order.__getitem__)
+            held = [p for p in batch if (ctl is not None and ctl.is_paused(p))
+                    or (shard is not None and not shard.owns(p))]
+            if held:
+                for p in held:
+                    sched.reschedule(p, "PAUSED", now)
+                    if ctl is not None:
+                        ctl.set_due(p, sched.due(p))
+                batch = [p for p in batch if p not in held]
+                if not batch:
+                    continue
+
+            run_id += 1
+            renderer.begin(run_id, time.time(), batch)
+            start, elapsed, results = _guarded_cycle(executor, batch, opts, stash_state,
+                                                     on_result=renderer.result)
+
+            done = time.time()
+            if len(results) == len(batch):
+                statuses = [r.status for r in results]
+            else:
+                statuses = ["ERROR"] * len(batch)   # run-level failure
+            for path, status in zip(batch, statuses):
+                retry_at = stash_state[path].retry_at
+                delay = max(0.0, retry_at - done) if retry_at else None
+                if status == "DEFERRED":
+                    delay = opts.defer_delay
+                sched.reschedule(path, status, done, delay=delay)
+                if ctl is not None:
+                    ctl.set_due(path, sched.due(path))
+
+            renderer.end(elapsed, sched.next_due())
+            if ctl is not None:
+                ctl.record(results, start)
+            if maint is not None:
+                maint.note(results)
 
-def load_tracklist(trackfile: Path) -> List[Path]:
-    if not trackfile.exists():
-        return []
-    
-    items = []
-    seen = set()
+        else:
+            wake = next_due if next_due is not None else now + DEFAULT_INTERVAL
+            if targets is not None and targets.next_check is not None:
+                wake = min(wake, targets.next_check)
+            if reloader is not None:
+                wake = min(wake, now + RELOAD_CHECK)
+            if shard is not None:
+                wake = min(wake, shard.next_beat)
+            if maint is not None:
+                # Idle until the next repo is due: spend (part of) it on repacks.
+                maint.run(until=wake)
+                now = time.time()
+            sleep_time = wake - now
+            if ctl is not None:
+                ctl.wait(sleep_time)   # a control command cuts the sleep short
+            elif sleep_time > 0:
+                time.sleep(sleep_time)
+
+def _watch_events(executor, paths, interval, opts, stash_state, fmt, color, debounce, maint=None,
+                  targets: Optional[WatchTargets] = None, reloader: Optional[Reloader] = None,
+                  ctl: Optional[Control] = None):
+    """
+    Event-driven loop: a full pass at start-up, then only repos whose working tree
+    reported filesystem events. Repos inotify cannot watch are still polled every `interval`.
+    Maintenance runs when no event is pending, so an event arriving meanwhile waits
+    for at most one repack. DEFERRED repos are retried after `opts.defer_delay`.
+    """
+    from .inotify import RepoEventWatcher
 
-    with open(trackfile, "r", encoding="utf-8") as f:
-        for raw in f:
-            line = raw.strip()
-            
-            if not line or line.startswith("#"):
-                continue
+    shard = opts.shard
+    watcher = RepoEventWatcher(paths, debounce=debounce)
+    polled = list(watcher.unwatched)
+    if polled:
+        log(f"inotify unavailable for {len(polled)} repo(s), polling them every {interval}s")
 
-            norm = _normalize_path(line)
-            if norm not in seen:
-                items.append(Path(norm))
-                seen.add(norm)
+    renderer = make_renderer(fmt, color)
+    run_id = 0
+    pending = set(paths)
+    deferred: Dict[Path, float] = {}   # repo -> when to retry it
+    next_run = time.time() + interval
 
-    return items
+    try:
+        while True:
+            if reloader is not None:
+                reloader.poll(time.time())
+            if targets is not None:
+                added, removed = targets.poll(time.time())
+                if added or removed:
+                    _retarget(paths, added, removed, opts, stash_state, events=watcher, maint=maint,
+                              ctl=ctl)
+                    pending.update(added)
+                    pending.difference_update(removed)
+                    for p in removed:
+                        deferred.pop(p, None)
+                    polled = list(watcher.unwatched)
+                    if shard is not None:
+                        pending.update(_rebalance(shard, paths, opts, stash_state, maint))
+            if shard is not None and shard.beat(time.time()):
+                pending.update(_rebalance(shard, paths, opts, stash_state, maint))
+            if ctl is not None:
+                pending.update(p for p in ctl.take_triggers() if p in stash_state)
+            now = time.time()
+            for p in [p for p, t in deferred.items() if t <= now]:
+                del deferred[p]
+                pending.add(p)
+
+            batch = [p for p in paths if p in pending]
+            if shard is not None:
+                batch = [p for p in batch if shard.owns(p)]
+            if ctl is not None:
+                # Events of a paused repo are dropped; resuming triggers it once.
+                batch = [p for p in batch if not ctl.is_paused(p)]
+            pending.clear()
+            if batch:
+                run_id += 1
+                renderer.begin(run_id, time.time(), batch)
+                start, elapsed, results = _guarded_cycle(executor, batch, opts, stash_state,
+                                                         on_result=renderer.result)
+                renderer.end(elapsed, next_run if polled else None)
+                if maint is not None:
+                    maint.note(results)
+                if len(results) == len(batch):
+                    for p, r in zip(batch, results):
+                        if r.status == "DEFERRED":
+                            deferred[p] = time.time() + opts.defer_delay
+                if ctl is not None:
+                    ctl.record(results, start)
+                    for p in batch:
+                        ctl.set_due(p, deferred.get(p, next_run if p in polled else None))
+
+            wake = next_run if polled else None
+            if deferred:
+                wake = min(deferred.values()) if wake is None else min(wake, *deferred.values())
+            for t in (targets.next_check if targets is not None else None,
+                      time.time() + RELOAD_CHECK if reloader is not None else None,
+                      shard.next_beat if shard is not None else None):
+                if t is not None:
+                    wake = min(wake, t) if wake is not None else t
+            if maint is not None:
+                maint.run(until=wake if wake is not None else time.time() + maint.budget)
+
+            timeout = max(0.0, wake - time.time()) if wake is not None else None
+            if ctl is not None:
+                pending |= watcher.wait(timeout, wake_fds=[ctl.wake_fd])
+                ctl.drain()
+            else:
+                pending |= watcher.wait(timeout)
 
-def save_tracklist(trackfile: Path, items: List[Path]) -> None:
-    trackfile.parent.mkdir(parents=True, exist_ok=True)
+            if polled and time.time() >= next_run:
+                pending.update(polled)
+                while next_run <= time.time():
+                    next_run += interval
+    finally:
+        watcher.close()
 
-    tmp = trackfile.with_suffix(trackfile.suffix + ".tmp")
-    with open(tmp, "w", encoding="utf-8") as f:
-        f.write("# GitAutoStash tracking list\n")
-        f.write("# 一行一個資料夾；支援 ~ 與環境變數，註解以 # 開頭\n\n")
+def _start_metrics(cfg: dict, opts: JobOptions):
+    """
+    metrics:
+      port: 9477            # serve http://127.0.0.1:9477/metrics
+      address: 127.0.0.1
+      textfile: /var/lib/node_exporter/textfile/auto_stash.prom
+    """
+    if cfg.get("port"):
+        address = cfg.get("address", "127.0.0.1")
+        try:
+            start_http_server(int(cfg["port"]), address)
+            log(f"Metrics on http://{address}:{cfg['port']}/metrics")
+        except OSError as e:
+            log(f"Failed to start metrics endpoint: {e}")
+    if cfg.get("textfile"):
+        opts.metrics_textfile = Path(os.path.expanduser(cfg["textfile"]))
+
+def build_discovery(data: dict) -> RepoDiscovery:
+    """
+    discovery:
+      interval: 60               # seconds between two walks of the watch roots
+      max_depth: 8
+      skip: [node_modules, ...]  # extra directory names never descended into
+    """
+    cfg = data.get("discovery") or {}
+    return RepoDiscovery(
+        default_discovery_cache(),
+        skip=DEFAULT_SKIP | set(cfg.get("skip") or []),
+        max_depth=int(cfg.get("max_depth", DEFAULT_MAX_DEPTH)),
+    )
+
+def build_targets(data: dict, paths: List[Path], roots: Optional[List[Path]] = None,
+                  trackfile: Optional[Path] = None, rootsfile: Optional[Path] = None) -> WatchTargets:
+    cfg = data.get("discovery") or {}
+    return WatchTargets(paths, roots, build_discovery(data),
+                        rescan=float(cfg.get("interval", DEFAULT_RESCAN)),
+                        trackfile=trackfile, rootsfile=rootsfile)
+
+def run_watcher(paths: List[Path], interval, include_untracked, fmt, color: bool=True, jobs=None,
+                mode=None, roots: Optional[List[Path]] = None, trackfile: Optional[Path] = None,
+                rootsfile: Optional[Path] = None, shard: Optional[str] = None,
+                trace: Optional[Path] = None):
+    """
+    Watch `paths` plus every repo found under `roots`; roots are re-walked while
+    running, so checkouts that appear or vanish there are picked up or dropped.
+
+    With `trackfile` / `rootsfile` the repo set follows edits of those files, and
+    config.yaml is re-read when it changes or on SIGHUP, all without a restart.
+
+    With `shard` ("i/n") only the i-th of n workers' share of the repos is stashed.
+    With `trace`, spans of every cycle, job and git command are written there (see tracing).
+    """
+    global _json_stdout
+    cli = {"interval": interval, "include_untracked": include_untracked}
+    config_file = default_config()
+    data = load_config(config_file)
+    setup_logging_from_config(data)
+    interval, include_untracked, fmt, jobs = apply_config(data, interval, include_untracked, fmt, jobs)
+    _json_stdout = fmt == "jsonl"
+    log("=== Git Auto Stash Watcher Started ===")
+
+    g = data.get("global") or {}
+    state_file = configured_statefile(data)
+    opts = JobOptions.from_config(data, include_untracked, state_file)
+    configure_git_timeouts(data.get("timeouts"))
+    _start_metrics(data.get("metrics") or {}, opts)
+    history_file = default_history_file(data)
+    if history_file is not None:
+        opts.history = History(history_file)
+    mode = mode or g.get("mode", "poll")
+
+    if shard is not None:
+        opts.shard = Shard.from_config(shard, data.get("sharding"), default_statefile().with_name("shards"))
+        try:
+            opts.shard.start()
+        except (ShardBusy, OSError) as e:
+            log(f"Cannot start shard {opts.shard.name}: {e}")
+            return
 
-        for p in sorted({str(p.resolve()) for p in items}):
-            f.write(p + "\n")
-    tmp.replace(trackfile)
+    if trace is not None:
+        try:
+            tracing.start(trace)
+            log(f"Tracing to {trace}")
+        except OSError as e:
+            log(f"Tracing disabled: {e}")
+
+    targets = build_targets(data, paths, roots, trackfile, rootsfile)
+    paths = targets.initial()
+    stash_state = build_stash_state(paths, load_stash_state(state_file))
+    executor = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="auto-stash")
+
+    from .maintenance import Maintenance
+    maint = Maintenance.from_config(data.get("maintenance"))
+    if opts.shard is not None:
+        _rebalance(opts.shard, paths, opts, stash_state, maint)
+    else:
+        maint.watch(paths)
+
+    reloader = Reloader(config_file, data, cli, opts, targets, maint)
+    reloader.install()
+
+    # Only a served socket needs the in-memory view; without one the loops just sleep.
+    ctl: Optional[Control] = None
+    server = None
+    sock = default_control_socket(data, opts.shard.name if opts.shard is not None else None)
+    if sock is not None:
+        ctl = Control()
+        ctl.set_repos(paths, stash_state)
+        try:
+            server = serve(sock, ctl)
+        except (ControlUnavailable, OSError) as e:
+            log(f"Control socket disabled: {e}")
+            ctl.close()
+            ctl = None
+
+    try:
+        if mode == "events":
+            from .inotify import InotifyUnavailable
+            try:
+                _watch_events(executor, paths, interval, opts, stash_state, fmt, color,
+                              debounce=float(g.get("debounce", DEFAULT_DEBOUNCE)), maint=maint,
+                              targets=targets, reloader=reloader, ctl=ctl)
+            except InotifyUnavailable as e:
+                log(f"Event mode unavailable ({e}), falling back to polling")
+
+        _watch_poll(executor, paths, build_scheduler(data, interval), opts, stash_state, fmt, color,
+                    maint=maint, targets=targets, reloader=reloader, ctl=ctl)
+
+    except KeyboardInterrupt:
+        log("=== Git Auto Stash Watcher Stopped by user ===")
+    finally:
+        if server is not None and sock is not None:
+            shutdown(server, sock)
+        if ctl is not None:
+            ctl.close()
+        executor.shutdown(wait=True)
+        if opts.shard is not None:
+            opts.shard.close()
+        if opts.history is not None:
+            opts.history.close()
+        tracing.stop()
+
+# -------------- Tracking list Management -------
 
 def add_to_tracklist(trackfile: Path, path: str) -> Tuple[bool, str]:
     items = load_tracklist(trackfile)
@@ -329,33 +1892,90 @@ def add_to_tracklist(trackfile: Path, path: str) -> Tuple[bool, str]:
     save_tracklist(trackfile, items)
     return True, f"Added: {norm}"
 
-def remove_from_tracklist(trackfile: Path, path: str) -> Tuple[bool, str]:
-    items = load_tracklist(trackfile)
+def default_discovery_cache() -> Path:
+    return default_statefile().with_name("discovery.json")
+
+def add_root(rootsfile: Path, path: str) -> Tuple[bool, str, List[Path]]:
+    """
+    Register a watch root; returns (added, message, repos found under it).
+    """
+    roots = load_tracklist(rootsfile)
     norm = Path(_normalize_path(path))
-    
-    new_items = [p for p in items if p != norm]
-    
-    if len(new_items) == len(items):
-        return False, f"Not found: {norm}"
-    
-    save_tracklist(trackfile, new_items)
-    return True, f"Removed: {norm}"
+    if not norm.is_dir():
+        return False, f"Not a directory: {norm}", []
 
-# -------------- Config Management -------------
+    repos = build_discovery(load_config()).scan([norm])
+    if norm in roots:
+        return False, f"Existed root: {norm}", repos
 
-def default_config():
+    roots.append(norm)
+    save_tracklist(rootsfile, roots, title="watch roots")
+    return True, f"Added root: {norm} ({len(repos)} repos)", repos
+
+# -------------- Stash State Persistence -------
+# state.json is per host: every watcher (and --shard worker) on this machine merges into
+# the same file, under a lock. Workers on other machines keep their own, so a repo whose
+# lease moves here from another machine starts without dedup state: its first snapshot
+# may duplicate the last one taken there.
+
+@contextlib.contextmanager
+def _state_lock(statefile: Path):
     """
-    Default list location:
-      - Windows: %APPDATA%/GitAutoStash/tracklist.txt
-      - Others: ~/.config/git-auto-stash/tracklist.txt
+    Exclusive lock on `<statefile>.lock` for a load-merge-replace of the state file.
     """
-    if os.name == "nt":
-        base = Path(os.environ.get("APPDATA", Path.home() / "AppData" / "Roaming"))
-        return base / APP_NAME / "config.yaml"
-    
-    else:
-        return Path.home() / ".config" / "git-auto-stash" / "config.yaml"
-    
+    statefile.parent.mkdir(parents=True, exist_ok=True)
+    if os.name == "nt":   # no flock; one watcher per state file there
+        yield
+        return
+    import fcntl
+    with open(statefile.with_name(statefile.name + ".lock"), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def load_stash_state(statefile: Path) -> dict:
+    if not statefile.exists():
+        return {}
+
+    try:
+        with open(statefile, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    return data.get("repos", {}) if isinstance(data, dict) else {}
+
+def _write_stash_state(statefile: Path, repos: dict) -> None:
+    # call under _state_lock; the tmp name is per process all the same
+    tmp = statefile.with_name(f".{statefile.name}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "repos": repos}, f, indent=1, sort_keys=True)
+    tmp.replace(statefile)
+
+def save_stash_state(statefile: Path, stash_state: dict) -> None:
+    """
+    Merge the watcher's in-memory state into the state file (atomically), keeping
+    entries of repos this watcher does not track, e.g. those of other shards.
+    """
+    with _state_lock(statefile):
+        repos = load_stash_state(statefile)
+        for path, st in stash_state.items():
+            if st.tree:
+                repos[str(path)] = {"stash": st.stash_id, "tree": st.tree}
+                if st.ref:
+                    repos[str(path)]["ref"] = st.ref
+        _write_stash_state(statefile, repos)
+
+def forget_stash_state(statefile: Path, paths: List[Path]) -> None:
+    with _state_lock(statefile):
+        repos = load_stash_state(statefile)
+        if any(repos.pop(str(p), None) is not None for p in list(paths)):
+            _write_stash_state(statefile, repos)
+
+# -------------- Config Management -------------
+
 def init_config(config_file: Path):
     config_file.parent.mkdir(parents=True, exist_ok=True)
 
@@ -363,7 +1983,37 @@ def init_config(config_file: Path):
         "global":{
             "interval": 300,
             "include_untracked": False,
-            "format": "line"
+            "format": "line",
+            "jobs": DEFAULT_JOBS,
+            "mode": "poll",
+            "debounce": DEFAULT_DEBOUNCE,
+            "fast_path": True,
+            "log_max_bytes": DEFAULT_LOG_MAX_BYTES,
+            "log_backup_count": DEFAULT_LOG_BACKUPS,
+            "jitter": DEFAULT_JITTER,
+            "backend": "stash",
+            "defer_delay": DEFAULT_DEFER_DELAY,
+            "busy_quiet": DEFAULT_BUSY_QUIET
+        },
+        "maintenance": {
+            "loose_objects": 2000,
+            "budget": 30,
+            "prune": False
+        },
+        "untracked": {
+            "exclude": [],
+            "max_file_size": "50M",
+            "max_total_size": "200M"
+        },
+        "retention": {
+            "keep_last": DEFAULT_KEEP_LAST,
+            "hourly": DEFAULT_HOURLY,
+            "daily": DEFAULT_DAILY
+        },
+        "timeouts": {
+            "default": DEFAULT_GIT_TIMEOUT,
+            "status": 30,
+            "stash": 120
         }
     }
 
@@ -387,112 +2037,135 @@ def _parse_scaler(val: str):
         except ValueError:
             return val
 
-def load_config(path=None) -> dict:
-    if path is None:
-        path = default_config()
-
-    if not path.exists():
-        return {}
-    
-    with path.open( "r", encoding="utf-8") as f:
-        raw = f.read()
-    
-    data = yaml.safe_load(raw) or {}
-    
-    return data
-
 # --------- Render Function --------
-def _render_pretty(run_id: int, started_at: float, duration: float, next_run: float,
-                   results: List[dict], color: bool ):
-    timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started_at))
-    head = f"Run #{run_id}  (took {duration:.2f}s)  Next: {time.strftime('%H:%M:%S', time.localtime(next_run))}"
-    log(head)
-
-    repo_width = max([len(r["repo"]) for r in results] + [24])
-    status_width = 11
-
-    for i, r in enumerate(results):
-        icon = _icon_status(r["status"])
-        status_text = r["status"]
-
-        # Color
-        if r["status"] == "STASHED":
-            status_text = _colorize(status_text, Colors.GREEN, color)
-        elif r["status"] == "NO_CHANGES" or r["status"] == "SKIPPED":
-            status_text = _colorize(status_text, Colors.GRAY, color)
-        elif r["status"] == "ERROR":
-            status_text = _colorize(status_text, Colors.YELLOW, color)
-
-        prefix = "└─" if i == len(results) - 1 else "├─"
-        line = f"  {prefix} repo: {r['repo']:<{repo_width}}  status: {icon} {status_text:<{status_width}}"
-
-        if r.get("stash_id"):
-            line += f"  stash: {_short(r['stash_id'])}"
-        # if r.get("message"):
-        #     line += f"  msg: {r['message']}"
-        if r.get("detail"):
-            line += f"  detail: {r['detail']}"
-
+def _colored_status(status: str, color: bool) -> str:
+    if status == "STASHED":
+        return _colorize(status, Colors.GREEN, color)
+    if status in ("NO_CHANGES", "SKIPPED", "DEFERRED"):
+        return _colorize(status, Colors.GRAY, color)
+    if status == "ERROR":
+        return _colorize(status, Colors.YELLOW, color)
+    return status
+
+class Renderer:
+    """
+    Prints a cycle as its results arrive: `begin`, then `result` once per job in
+    completion order, then `end`. Statuses are counted as they go by, so nothing
+    is kept or re-read at the end of the cycle.
+    """
+    SUMMARY = (("STASHED", "stashed"), ("NO_CHANGES", "no_changes"), ("SKIPPED", "skipped"),
+               ("DEFERRED", "deferred"), ("ERROR", "errors"))
+
+    def __init__(self, color: bool):
+        self.color = color
+        self.run_id = 0
+        self.started = 0.0
+        self.total = 0
+        self.seen = 0
+        self.counts: Dict[str, int] = defaultdict(int)
+
+    def begin(self, run_id: int, started: float, paths: Sequence[Path]):
+        self.run_id = run_id
+        self.started = started
+        self.total = len(paths)
+        self.seen = 0
+        self.counts = defaultdict(int)
+
+    def result(self, r: JobResult):
+        self.seen += 1
+        self.counts[r.status] += 1
+        self.row(r)
+
+    def row(self, r: JobResult):
+        parts = [_colored_status(r.status, self.color), f"repo={r.repo}"]
+        if r.stash_id:
+            parts.append(f"stash={_short(r.stash_id)}")
+        if r.message:
+            parts.append(f'msg="{r.message}"')
+        if r.detail:
+            parts.append(f'detail="{r.detail}"')
+        log("  ".join(parts), with_timestamp=True)
+
+    def end(self, elapsed: float, next_run: Optional[float]):
+        parts = [f"Summary  repos={self.seen}"]
+        parts += [f"{label}={self.counts[s]}" for s, label in self.SUMMARY if self.counts.get(s)]
+        parts.append(f"took={elapsed:.2f}")
+        parts.append(f"next={_clock(next_run)}")
+        log(" ".join(parts))
+
+class PrettyRenderer(Renderer):
+    def begin(self, run_id: int, started: float, paths: Sequence[Path]):
+        super().begin(run_id, started, paths)
+        self.repo_width = max([len(str(p)) for p in paths] + [24])
+        log(f"Run #{run_id}  ({self.total} repos)")
+
+    def row(self, r: JobResult):
+        icon = _icon_status(r.status)
+        status_text = _colored_status(r.status, self.color)
+        prefix = "└─" if self.seen == self.total else "├─"
+        line = f"  {prefix} repo: {r.repo:<{self.repo_width}}  status: {icon} {status_text:<11}"
+        if r.stash_id:
+            line += f"  stash: {_short(r.stash_id)}"
+        if r.detail:
+            line += f"  detail: {r.detail}"
         log(line)
 
-    total = len(results)
-    stashed = sum(1 for r in results if r["status"] == "STASHED")
-    nochg = sum(1 for r in results if r["status"] == "NO_CHANGES")
-    skipped = sum(1 for r in results if r["status"] == "SKIPPED")
-    errors = sum(1 for r in results if r["status"] == "ERROR")
-
-    summary_parts = [f"Summary: {total} repos"]
-    if stashed != 0:
-        summary_parts.append(f"stashed: {stashed}")
-    if nochg != 0:
-        summary_parts.append(f"no changes: {nochg}")
-    if skipped != 0:
-        summary_parts.append(f"skipped: {skipped}")
-    if errors != 0:
-        summary_parts.append(f"errors: {errors}")
-    log(" | ".join(summary_parts))
-
-def _render_line(start: float, duration: float, next_run: float, results: List[dict], color: bool):
-    for r in results:
-        status = r['status']
-        if status == "STASHED":
-            status = _colorize(status, Colors.GREEN, color)
-        elif status in ("NO_CHANGES", "SKIPPED"):
-            status = _colorize(status, Colors.GRAY, color)
-        elif status == "ERROR":
-            status = _colorize(status, Colors.YELLOW, color)
-
-        parts = [f"{status}", f"repo={r['repo']}"]
-
-        if r.get("stash_id"):
-            parts.append(f"stash={_short(r['stash_id'])}")
-        if r.get("message"):
-            parts.append(f'msg="{r["message"]}"')
-        if r.get("detail"):
-            parts.append(f'detail="{r["detail"]}"')
-
-        log("  ".join(parts),with_timestamp=True)
-
-    total = len(results)
-    stashed = sum(1 for r in results if r["status"] == "STASHED")
-    nochg = sum(1 for r in results if r["status"] == "NO_CHANGES")
-    skipped = sum(1 for r in results if r["status"] == "SKIPPED")
-    errors = sum(1 for r in results if r["status"] == "ERROR")
-
-    summary_parts = [f"Summary  repos={total}"]
-    if stashed != 0:
-        summary_parts.append(f"stashed={stashed}")
-    if nochg != 0:
-        summary_parts.append(f"no_changes={nochg}")
-    if skipped != 0:
-        summary_parts.append(f"skipped={skipped}")
-    if errors != 0:
-        summary_parts.append(f"errors={errors}")
-
-    summary_parts.append(f"took={duration:.2f}")
-    summary_parts.append(f"next={time.strftime('%H:%M:%S', time.localtime(next_run))}")
-
-    log(" ".join(summary_parts))
-
-
+    def end(self, elapsed: float, next_run: Optional[float]):
+        parts = [f"Summary: {self.seen} repos"]
+        parts += [f"{label.replace('_', ' ')}: {self.counts[s]}"
+                  for s, label in self.SUMMARY if self.counts.get(s)]
+        parts.append(f"took {elapsed:.2f}s  Next: {_clock(next_run)}")
+        log(" | ".join(parts))
 
+class DeltaRenderer(Renderer):
+    """
+    `--fmt delta`: only repos whose status differs from their previous cycle (a repo
+    seen for the first time counts as NO_CHANGES), plus every new snapshot. The summary
+    line is printed only for cycles that printed something; `quiet` drops it altogether.
+    """
+    def __init__(self, color: bool, summary: bool = True):
+        super().__init__(color)
+        self.summary = summary
+        self.shown = 0
+        self.last: Dict[str, str] = {}   # repo -> status of its previous cycle
+
+    def begin(self, run_id: int, started: float, paths: Sequence[Path]):
+        super().begin(run_id, started, paths)
+        self.shown = 0
+
+    def row(self, r: JobResult):
+        status = r.status
+        previous = self.last.get(r.repo, "NO_CHANGES")
+        self.last[r.repo] = status
+        if status != previous or status == "STASHED":
+            self.shown += 1
+            super().row(r)
+
+    def end(self, elapsed: float, next_run: Optional[float]):
+        if self.summary and self.shown:
+            super().end(elapsed, next_run)
+
+class JsonlRenderer(Renderer):
+    """
+    `--fmt jsonl`: one compact JSON object per line, for log shippers. A record per
+    repo job (JobResult.record) and one per cycle:
+      {"type": "cycle", "ts": ..., "run": 3, "duration": 0.41, "repos": 120,
+       "counts": {"NO_CHANGES": 118, "STASHED": 2}, "next": ...}
+    Other messages of the watcher come out as {"type": "log", "ts": ..., "msg": ...}.
+    """
+    def row(self, r: JobResult):
+        _emit_json(r.record(self.run_id))
+
+    def end(self, elapsed: float, next_run: Optional[float]):
+        _emit_json({"type": "cycle", "ts": round(self.started, 3), "run": self.run_id,
+                    "duration": round(elapsed, 4), "repos": self.seen, "counts": dict(self.counts),
+                    "next": _round(next_run, 3)})
+
+def make_renderer(fmt: Optional[str], color: bool) -> Renderer:
+    if fmt == "pretty":
+        return PrettyRenderer(color)
+    if fmt == "jsonl":
+        return JsonlRenderer(color)
+    if fmt in ("delta", "quiet"):
+        return DeltaRenderer(color, summary=fmt == "delta")
+    return Renderer(color)
@@ -0,0 +1,140 @@
+"""
+Opt-in span tracing of the watcher (`auto-stash watch --trace FILE`).
+
+Every cycle, repo job and git subprocess becomes one complete ("X") event in the
+Chrome trace event format, so the file opens in chrome://tracing or Perfetto with
+one row per worker thread. Git spans carry the argv, exit code and bytes of output.
+
+Events are appended to the file as they finish, not kept in memory, in the JSON
+array form the viewers accept even without the closing bracket; a watcher that is
+killed still leaves a readable trace. When tracing is off `current` is None and
+`span()` hands back a shared no-op context, so the cost is one attribute lookup.
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+FLUSH_EVERY = 256  # events
+
+
+class _Discard(dict):
+    # what `span()` yields when tracing is off: writes to it go nowhere
+    def __setitem__(self, key, value):
+        pass
+
+    def update(self, *args, **kwargs):
+        pass
+
+_OFF = contextlib.nullcontext(_Discard())
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "cat", "args", "start")
+
+    def __init__(self, tracer: "Tracer", name: str, cat: str, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.start = 0
+
+    def __enter__(self) -> dict:
+        self.start = time.perf_counter_ns()
+        return self.args
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args["error"] = f"{exc_type.__name__}: {exc}"
+        self.tracer.complete(self.name, self.cat, self.start, time.perf_counter_ns(), self.args)
+        return False
+
+
+class Tracer:
+    def __init__(self, file: Path):
+        self.file = file
+        self.pid = os.getpid()
+        self._origin = time.perf_counter_ns()
+        self._lock = threading.Lock()
+        self._tids: Dict[int, int] = {}   # thread ident -> small tid shown in the viewer
+        self._pending = 0
+        file.parent.mkdir(parents=True, exist_ok=True)
+        self._out = open(file, "w", encoding="utf-8")
+        self._out.write("[\n")
+        self._write({"name": "process_name", "ph": "M", "pid": self.pid, "tid": 0,
+                     "args": {"name": "auto-stash watch"}})
+
+    def _write(self, event: dict):
+        self._out.write(json.dumps(event, default=str))
+        self._out.write(",\n")
+
+    def _tid(self) -> int:
+        ident = threading.get_ident()
+        tid = self._tids.get(ident)
+        if tid is None:
+            tid = self._tids[ident] = len(self._tids) + 1
+            self._write({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid,
+                         "args": {"name": threading.current_thread().name}})
+        return tid
+
+    def span(self, name: str, cat: str, **args) -> _Span:
+        return _Span(self, name, cat, args)
+
+    def complete(self, name: str, cat: str, start_ns: int, end_ns: int, args: Optional[dict] = None):
+        event = {"name": name, "cat": cat, "ph": "X", "pid": self.pid,
+                 "ts": (start_ns - self._origin) / 1000, "dur": (end_ns - start_ns) / 1000}
+        if args:
+            event["args"] = args
+        with self._lock:
+            if self._out.closed:
+                return
+            event["tid"] = self._tid()
+            self._write(event)
+            self._pending += 1
+            if self._pending >= FLUSH_EVERY:
+                self._out.flush()
+                self._pending = 0
+
+    def flush(self):
+        with self._lock:
+            if not self._out.closed:
+                self._out.flush()
+                self._pending = 0
+
+    def close(self):
+        with self._lock:
+            if self._out.closed:
+                return
+            # a last metadata event, so the array ends without a trailing comma
+            self._out.write(json.dumps({"name": "trace_end", "ph": "M", "pid": self.pid, "tid": 0,
+                                        "args": {"file": str(self.file)}}))
+            self._out.write("\n]\n")
+            self._out.close()
+
+
+current: Optional[Tracer] = None
+
+def start(file: Path) -> Tracer:
+    global current
+    stop()
+    current = Tracer(file)
+    return current
+
+def stop():
+    global current
+    tracer, current = current, None
+    if tracer is not None:
+        tracer.close()
+
+def span(name: str, cat: str, **args):
+    """
+    `with span("job", "job", repo=...) as args:` -- extra keys set on `args` inside
+    the block end up on the event.
+    """
+    tracer = current
+    if tracer is None:
+        return _OFF
+    return tracer.span(name, cat, **args)
@@ -0,0 +1,171 @@
+"""
+Where auto-stash keeps its files, config.yaml loading, and the tracking list /
+watch roots files.
+
+Kept free of git and of the watcher itself, and YAML is only imported once there
+is a config file to parse, so CLI commands that only read or edit these start fast.
+"""
+import os
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+APP_NAME = "GitAutoStash"
+
+# -------------- Locations -------------
+
+def default_statefile():
+    """
+    Last auto-stash (commit + tree) per repo, kept across watcher restarts:
+      - Windows: %APPDATA%/GitAutoStash/state.json
+      - Others: ~/.config/git-auto-stash/state.json
+    """
+    if os.name == "nt":
+        base = Path(os.environ.get("APPDATA", Path.home() / "AppData" / "Roaming"))
+        return base / APP_NAME / "state.json"
+
+    else:
+        return Path.home() / ".config" / "git-auto-stash" / "state.json"
+
+def configured_statefile(data: Optional[dict] = None) -> Path:
+    """
+    The state file in use: `global.state_file` if set, else default_statefile().
+    """
+    g = (data or {}).get("global") or {}
+    return Path(os.path.expanduser(g["state_file"])) if g.get("state_file") else default_statefile()
+
+def default_config():
+    """
+    Default list location:
+      - Windows: %APPDATA%/GitAutoStash/tracklist.txt
+      - Others: ~/.config/git-auto-stash/tracklist.txt
+    """
+    if os.name == "nt":
+        base = Path(os.environ.get("APPDATA", Path.home() / "AppData" / "Roaming"))
+        return base / APP_NAME / "config.yaml"
+    
+    else:
+        return Path.home() / ".config" / "git-auto-stash" / "config.yaml"
+
+def default_control_socket(data: Optional[dict] = None, shard: Optional[str] = None) -> Optional[Path]:
+    """
+    Socket of the running watcher, next to the state file unless `global.control_socket`
+    says otherwise; `control_socket: false` disables it. Each shard ("i/n") has its own.
+    """
+    import socket
+    g = (data or {}).get("global") or {}
+    value = g.get("control_socket", True)
+    if value is False or not hasattr(socket, "AF_UNIX"):
+        return None
+    path = Path(os.path.expanduser(value)) if isinstance(value, str) else \
+        default_statefile().with_name("control.sock")
+    if shard:
+        path = path.with_name(f"{path.stem}-{shard.replace('/', 'of')}{path.suffix}")
+    return path
+
+def default_history_file(data: Optional[dict] = None) -> Optional[Path]:
+    """
+    SQLite snapshot index, next to the state file unless `history.file` says otherwise;
+    `history.enabled: false` turns it off.
+    """
+    cfg = (data or {}).get("history") or {}
+    if not cfg.get("enabled", True):
+        return None
+    if cfg.get("file"):
+        return Path(os.path.expanduser(cfg["file"]))
+    return default_statefile().with_name("history.sqlite3")
+
+def load_config(path=None) -> dict:
+    if path is None:
+        path = default_config()
+
+    if not path.exists():
+        return {}
+    
+    with path.open( "r", encoding="utf-8") as f:
+        raw = f.read()
+    
+    import yaml   # only once there is a config to read
+    data = yaml.safe_load(raw) or {}
+    
+    return data
+
+# -------------- Tracking list Management -------
+
+def default_trackfile():
+    """
+    Default list location:
+      - Windows: %APPDATA%/GitAutoStash/tracklist.txt
+      - Others: ~/.config/git-auto-stash/tracklist.txt
+    """
+    if os.name == "nt":
+        base = Path(os.environ.get("APPDATA", Path.home() / "AppData" / "Roaming"))
+        return base / APP_NAME / "tracklist.txt"
+    
+    else:
+        return Path.home() / ".config" / "git-auto-stash" / "tracklist.txt"
+
+def _normalize_path(p: str) -> str:
+
+    return str(Path(os.path.expandvars(os.path.expanduser(p))).resolve())
+
+def load_tracklist(trackfile: Path) -> List[Path]:
+    if not trackfile.exists():
+        return []
+    
+    items = []
+    seen = set()
+
+    with open(trackfile, "r", encoding="utf-8") as f:
+        for raw in f:
+            line = raw.strip()
+            
+            if not line or line.startswith("#"):
+                continue
+
+            norm = _normalize_path(line)
+            if norm not in seen:
+                items.append(Path(norm))
+                seen.add(norm)
+
+    return items
+
+def save_tracklist(trackfile: Path, items: List[Path], title: str = "tracking list") -> None:
+    trackfile.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp = trackfile.with_suffix(trackfile.suffix + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(f"# GitAutoStash {title}\n")
+        f.write("# 一行一個資料夾；支援 ~ 與環境變數，註解以 # 開頭\n\n")
+
+        for p in sorted({str(p.resolve()) for p in items}):
+            f.write(p + "\n")
+    tmp.replace(trackfile)
+
+def remove_from_tracklist(trackfile: Path, path: str) -> Tuple[bool, str]:
+    items = load_tracklist(trackfile)
+    norm = Path(_normalize_path(path))
+    
+    new_items = [p for p in items if p != norm]
+    
+    if len(new_items) == len(items):
+        return False, f"Not found: {norm}"
+    
+    save_tracklist(trackfile, new_items)
+    return True, f"Removed: {norm}"
+
+def default_rootsfile(trackfile: Optional[Path] = None) -> Path:
+    """
+    Watch roots (directories searched for repos) live next to the tracking list.
+    """
+    return (trackfile or default_trackfile()).with_name("roots.txt")
+
+def remove_root(rootsfile: Path, path: str) -> Tuple[bool, str]:
+    roots = load_tracklist(rootsfile)
+    norm = Path(_normalize_path(path))
+
+    new_roots = [p for p in roots if p != norm]
+    if len(new_roots) == len(roots):
+        return False, f"Not found root: {norm}"
+
+    save_tracklist(rootsfile, new_roots, title="watch roots")
+    return True, f"Removed root: {norm}"
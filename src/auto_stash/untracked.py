@@ -0,0 +1,176 @@
+"""
+Pre-scan of the untracked files going into a snapshot (`include_untracked`).
+
+The list comes from the `git status` the job already runs; files matching an
+exclude glob, larger than `max_file_size`, or past the `max_total_size` budget of
+one snapshot are left out, so a stray build output or `node_modules` never gets
+hashed into the object store.
+
+untracked:
+  exclude: ["*.iso", "data/"]   # on top of DEFAULT_EXCLUDE
+  default_exclude: true
+  max_file_size: 50M            # bytes, or with a K/M/G suffix; 0 = no cap
+  max_total_size: 200M
+
+Globs follow .gitignore loosely: without a slash they match any path component
+(`node_modules/`, with a trailing slash, only directories), with one they match the
+path from the repo root.
+"""
+import fnmatch
+import os
+import re
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+DEFAULT_EXCLUDE = (
+    "node_modules/", ".venv/", "venv/", "__pycache__/", ".tox/", ".nox/", ".mypy_cache/",
+    ".pytest_cache/", ".gradle/", ".terraform/", "target/", "build/", "dist/",
+    "*.pyc", "*.o", "*.so", "*.class",
+)
+DEFAULT_MAX_FILE_SIZE = 50 * 1024 * 1024
+DEFAULT_MAX_TOTAL_SIZE = 200 * 1024 * 1024
+
+_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parse_size(value) -> Optional[int]:
+    """
+    50, "50M", "1.5G", "512KiB" -> bytes; 0, None or false -> None (no cap).
+    """
+    if value is None or value is False:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value) or None
+    m = re.fullmatch(r"\s*([0-9.]+)\s*([KMGT]?)(?:I?B)?\s*", str(value).upper())
+    if not m:
+        raise ValueError(f"bad size {value!r}")
+    return int(float(m.group(1)) * _UNITS[m.group(2)]) or None
+
+def _human(n: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n} B"
+
+
+class UntrackedSkip:
+    """
+    What one pre-scan left out, for the job's result detail.
+    """
+    __slots__ = ("excluded", "too_large", "over_budget", "skipped_bytes")
+
+    def __init__(self):
+        self.excluded = 0
+        self.too_large = 0
+        self.over_budget = 0
+        self.skipped_bytes = 0
+
+    def __bool__(self) -> bool:
+        return bool(self.excluded or self.too_large or self.over_budget)
+
+    def describe(self, flt: "UntrackedFilter") -> str:
+        parts = []
+        if self.excluded:
+            parts.append(f"{self.excluded} excluded")
+        if self.too_large:
+            parts.append(f"{self.too_large} over {_human(flt.max_file_size or 0)}")
+        if self.over_budget:
+            parts.append(f"{self.over_budget} past the {_human(flt.max_total_size or 0)} snapshot cap")
+        detail = "untracked files left out: " + ", ".join(parts)
+        if self.skipped_bytes:
+            detail += f" ({_human(self.skipped_bytes)})"
+        return detail
+
+
+class UntrackedFilter:
+    __slots__ = ("exclude", "max_file_size", "max_total_size", "_component", "_dir", "_path")
+
+    def __init__(self, exclude: Iterable[str] = DEFAULT_EXCLUDE,
+                 max_file_size: Optional[int] = DEFAULT_MAX_FILE_SIZE,
+                 max_total_size: Optional[int] = DEFAULT_MAX_TOTAL_SIZE):
+        self.exclude = tuple(exclude)
+        self.max_file_size = max_file_size
+        self.max_total_size = max_total_size
+
+        component, dirs, paths = [], [], []
+        for pat in self.exclude:
+            pat = pat.strip()
+            if not pat:
+                continue
+            if "/" in pat.rstrip("/"):
+                paths.append(fnmatch.translate(pat.strip("/")))
+            elif pat.endswith("/"):
+                dirs.append(fnmatch.translate(pat.rstrip("/")))
+            else:
+                component.append(fnmatch.translate(pat))
+        # one regex per kind, so a file costs a handful of matches whatever the list length
+        self._component = re.compile("|".join(component)) if component else None
+        self._dir = re.compile("|".join(dirs)) if dirs else None
+        self._path = re.compile("|".join(paths)) if paths else None
+
+    @classmethod
+    def from_config(cls, cfg: Optional[dict]) -> "UntrackedFilter":
+        cfg = cfg or {}
+        exclude = list(DEFAULT_EXCLUDE) if cfg.get("default_exclude", True) else []
+        exclude += [str(p) for p in cfg.get("exclude") or []]
+        return cls(
+            exclude,
+            max_file_size=parse_size(cfg.get("max_file_size", DEFAULT_MAX_FILE_SIZE)),
+            max_total_size=parse_size(cfg.get("max_total_size", DEFAULT_MAX_TOTAL_SIZE)),
+        )
+
+    def excluded(self, rel: str) -> bool:
+        """
+        `rel`: path from the repo root, "/"-separated as git prints it.
+        """
+        parts = rel.rstrip("/").split("/")
+        if self._component is not None and any(self._component.match(p) for p in parts):
+            return True
+        # a trailing "/" is how git lists an untracked nested repo
+        dirs = parts if rel.endswith("/") else parts[:-1]
+        if self._dir is not None and any(self._dir.match(p) for p in dirs):
+            return True
+        if self._path is not None:
+            for i in range(len(parts)):
+                if self._path.match("/".join(parts[:i + 1])):
+                    return True
+        return False
+
+    def select(self, root: Path, files: List[str]) -> Tuple[List[str], UntrackedSkip]:
+        """
+        Split the untracked `files` of the repo at `root` into the ones to snapshot and
+        a summary of the rest. Excluded files are not even stat'ed; under the total
+        cap, smaller files go first so one huge file doesn't crowd out the others.
+        """
+        skip = UntrackedSkip()
+        sized: List[Tuple[int, str]] = []
+        for rel in files:
+            if rel.endswith("/"):
+                continue   # nested repo: never part of our snapshot
+            if self.excluded(rel):
+                skip.excluded += 1
+                continue
+            try:
+                size = os.lstat(os.path.join(root, rel)).st_size
+            except OSError:
+                continue   # gone since git status
+            if self.max_file_size is not None and size > self.max_file_size:
+                skip.too_large += 1
+                skip.skipped_bytes += size
+                continue
+            sized.append((size, rel))
+
+        if self.max_total_size is None:
+            return [rel for _, rel in sized], skip
+
+        budget = self.max_total_size
+        keep = set()
+        for size, rel in sorted(sized):
+            if size > budget:
+                skip.over_budget += 1
+                skip.skipped_bytes += size
+            else:
+                budget -= size
+                keep.add(rel)
+        return [rel for _, rel in sized if rel in keep], skip
@@ -0,0 +1,195 @@
+"""
+The `.git/index` fast path against real git.
+
+For every index version and kind of change, a snapshot is taken of a work tree git
+has just verified, the change is made, and `unchanged_since` is compared with what
+git reports afterwards (status plus the diff against HEAD). The fast path may say
+"don't know" (False) when nothing changed, but must never say "unchanged" (True)
+when git sees a difference.
+"""
+import os
+import shutil
+import struct
+import subprocess
+import time
+from pathlib import Path
+
+import pytest
+
+from auto_stash.git_index import read_index, take_snapshot, unchanged_since
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None, reason="git not installed")
+
+FILES = {"a.txt": "alpha\n", "b.txt": "bravo\n", "sub/c.txt": "charlie\n", "run.sh": "#!/bin/sh\n"}
+AGE = 100  # seconds; keeps every stat well outside git_index.RACY_NS
+
+
+def git(repo: Path, *args: str) -> str:
+    env = dict(os.environ, GIT_CONFIG_NOSYSTEM="1", HOME=str(repo.parent),
+               GIT_AUTHOR_NAME="t", GIT_AUTHOR_EMAIL="t@example.com",
+               GIT_COMMITTER_NAME="t", GIT_COMMITTER_EMAIL="t@example.com")
+    return subprocess.run(["git", *args], cwd=repo, env=env, check=True,
+                          capture_output=True, text=True).stdout
+
+def observe(repo: Path) -> str:
+    # what a stash of the tracked files would capture
+    return git(repo, "status", "--porcelain", "-uno") + git(repo, "diff", "HEAD", "--binary")
+
+def settle(repo: Path):
+    """
+    Let git verify the work tree, then age the files and the index, as if the last
+    edit happened a while before the watcher's cycle.
+    """
+    past = time.time_ns() - AGE * 1_000_000_000
+    for dirpath, dirnames, filenames in os.walk(repo):
+        dirnames[:] = [d for d in dirnames if d != ".git"]
+        for name in filenames:
+            os.utime(os.path.join(dirpath, name), ns=(past, past))
+    git(repo, "update-index", "-q", "--refresh")
+    index = repo / ".git" / "index"
+    os.utime(index, ns=(past + 1_000_000_000,) * 2)
+
+def index_version(repo: Path) -> int:
+    with open(repo / ".git" / "index", "rb") as f:
+        return struct.unpack(">4sI", f.read(8))[1]
+
+def write(repo: Path, rel: str, text: str):
+    path = repo / rel
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text, encoding="utf-8")
+
+
+@pytest.fixture(params=[2, 3, 4])
+def repo(request, tmp_path: Path) -> Path:
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    git(repo, "init", "-q", "-b", "main")
+    git(repo, "config", "core.filemode", "true")
+    for rel, text in FILES.items():
+        write(repo, rel, text)
+    git(repo, "add", ".")
+    git(repo, "commit", "-q", "-m", "init")
+    write(repo, "a.txt", "alpha, other branch\n")
+    git(repo, "checkout", "-q", "-b", "other")
+    git(repo, "commit", "-q", "-am", "other")
+    git(repo, "checkout", "-q", "main")
+
+    git(repo, "update-index", "--index-version", str(request.param))
+    if request.param == 3:
+        # extended flags are what v3 adds: give one entry skip-worktree
+        git(repo, "update-index", "--skip-worktree", "sub/c.txt")
+    assert index_version(repo) == request.param
+    read_index(repo / ".git" / "index")   # parses without UnsupportedIndex
+    return repo
+
+
+def _modify(repo):
+    write(repo, "a.txt", "alpha, edited\n")
+
+def _modify_same_size(repo):
+    write(repo, "b.txt", "BRAVO\n")
+
+def _touch(repo):
+    os.utime(repo / "b.txt")
+
+def _chmod(repo):
+    os.chmod(repo / "a.txt", 0o755)
+
+def _delete(repo):
+    (repo / "b.txt").unlink()
+
+def _stage(repo):
+    write(repo, "b.txt", "bravo, staged\n")
+    git(repo, "add", "b.txt")
+
+def _stage_then_restore(repo):
+    # index changes, work tree ends up identical
+    git(repo, "update-index", "--chmod=+x", "a.txt")
+    git(repo, "update-index", "--chmod=-x", "a.txt")
+
+def _checkout(repo):
+    git(repo, "checkout", "-q", "other")
+
+def _new_branch(repo):
+    git(repo, "checkout", "-q", "-b", "topic")
+
+def _reset_soft(repo):
+    # HEAD moves, index and files do not: only the HEAD check can catch it
+    git(repo, "reset", "-q", "--soft", "main")
+
+def _nothing(repo):
+    pass
+
+CASES = {
+    "modify": _modify,
+    "modify same size": _modify_same_size,
+    "touch only": _touch,
+    "chmod": _chmod,
+    "delete": _delete,
+    "stage": _stage,
+    "index rewritten": _stage_then_restore,
+    "checkout": _checkout,
+    "new branch": _new_branch,
+    "reset --soft": _reset_soft,
+    "nothing": _nothing,
+}
+# cases whose snapshot is taken with `other` checked out
+ON_OTHER = {"reset --soft"}
+
+
+@pytest.mark.parametrize("dirty", [False, True], ids=["clean", "dirty"])
+@pytest.mark.parametrize("case", list(CASES))
+def test_unchanged_since_agrees_with_git(repo: Path, case: str, dirty: bool):
+    if case in ON_OTHER:
+        git(repo, "checkout", "-q", "other")
+    if dirty:
+        write(repo, "run.sh", "#!/bin/sh\necho dirty\n")
+    settle(repo)
+
+    before = observe(repo)
+    settle(repo)
+    snap = take_snapshot(repo)
+    assert snap is not None
+
+    CASES[case](repo)
+
+    verdict = unchanged_since(repo, snap)
+    after = observe(repo)
+    if verdict:
+        assert before == after, f"fast path missed: {case}"
+    if case == "nothing":
+        assert verdict, "fast path should hold when nothing moved"
+
+
+def test_dirty_file_edited_again(repo: Path):
+    # status stays " M a.txt" but the content to stash differs
+    write(repo, "a.txt", "first edit\n")
+    settle(repo)
+    before = observe(repo)
+    settle(repo)
+    snap = take_snapshot(repo)
+    assert snap is not None and "a.txt" in snap.dirty
+
+    write(repo, "a.txt", "other edit\n")
+    assert before != observe(repo)
+    assert not unchanged_since(repo, snap)
+
+
+def test_touch_then_verified_again(repo: Path):
+    # a touch costs one git run; once git refreshed the index the fast path holds again
+    settle(repo)
+    snap = take_snapshot(repo)
+    before = observe(repo)
+    os.utime(repo / "b.txt")
+    assert not unchanged_since(repo, snap)
+    assert observe(repo) == before
+
+    settle(repo)
+    snap = take_snapshot(repo)
+    assert snap is not None and unchanged_since(repo, snap)
+
+
+def test_recent_edit_is_racy(repo: Path):
+    settle(repo)
+    write(repo, "a.txt", "just now\n")
+    assert take_snapshot(repo) is None
@@ -0,0 +1,114 @@
+"""
+The SQLite snapshot index and the time parsing behind `history --at` / `restore --at`.
+"""
+import datetime
+import time
+from pathlib import Path
+
+import pytest
+
+from auto_stash.history import History, parse_when
+from auto_stash.stash_watcher import JobResult, _record_history
+
+NOW = time.mktime((2026, 6, 15, 12, 0, 0, 0, 0, -1))   # local noon
+TODAY = datetime.date(2026, 6, 15)
+
+
+def local(day: datetime.date, hour: int, minute: int = 0) -> float:
+    return datetime.datetime.combine(day, datetime.time(hour, minute)).timestamp()
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("now", NOW),
+    ("2h", NOW - 2 * 3600),
+    ("2 hours ago", NOW - 2 * 3600),
+    ("90 minutes ago", NOW - 90 * 60),
+    ("5 min", NOW - 5 * 60),
+    ("30s", NOW - 30),
+    ("1.5 d", NOW - 1.5 * 86400),
+    ("3 weeks ago", NOW - 21 * 86400),
+    ("14:30", local(TODAY, 14, 30)),
+    ("today", local(TODAY, 0)),
+    ("yesterday 14:30", local(TODAY - datetime.timedelta(days=1), 14, 30)),
+    ("Yesterday", local(TODAY - datetime.timedelta(days=1), 0)),
+    ("2024-05-02 14:30", local(datetime.date(2024, 5, 2), 14, 30)),
+    ("2024-05-02T14:30:00", local(datetime.date(2024, 5, 2), 14, 30)),
+    ("2024-05-02", local(datetime.date(2024, 5, 2), 0)),
+    ("1700000000", 1700000000.0),
+    ("1700000000.5", 1700000000.5),
+])
+def test_parse_when(text, expected):
+    assert parse_when(text, now=NOW) == pytest.approx(expected)
+
+@pytest.mark.parametrize("text", ["2 months", "2 months ago", "3 mo", "1 year", "5 fortnights",
+                                  "12", "tomorrow", ""])
+def test_parse_when_rejects(text):
+    # "12" is neither an epoch nor a time of day; "2 months" used to read as 2 minutes
+    with pytest.raises(ValueError):
+        parse_when(text, now=NOW)
+
+
+@pytest.fixture
+def history(tmp_path: Path):
+    h = History(tmp_path / "sub" / "history.sqlite3")
+    yield h
+    h.close()
+
+def row(repo: str, stash: str, ts: float, paths=(), message=None):
+    return (repo, stash, "t" + stash, None, ts, message or f"auto-stash {stash}", paths)
+
+
+def test_record_ignores_duplicates(history: History):
+    assert history.record([row("/r", "aaa", 1.0, ["a.txt"]), row("/r", "bbb", 2.0)]) == 2
+    # the same stash again (an --import or a restarted watcher): neither row nor paths double
+    assert history.record([row("/r", "aaa", 5.0, ["a.txt", "b.txt"])]) == 0
+    rows = history.query(repo="/r")
+    assert [(r["stash"], r["ts"]) for r in rows] == [("bbb", 2.0), ("aaa", 1.0)]
+    assert history.paths(rows[1]["id"]) == ["a.txt"]
+    # one object store, two worktrees: the same commit is a separate snapshot of each
+    assert history.record([row("/r-wt", "aaa", 3.0)]) == 1
+
+def test_query_filters(history: History):
+    history.record([
+        row("/r", "s1", 100.0, ["src/app.py", "README.md"]),
+        row("/r", "s2", 200.0, ["src/pkg/mod.py"]),
+        row("/r", "s3", 300.0, ["docs/index.md"]),
+        row("/other", "s4", 250.0, ["src/app.py"]),
+    ])
+
+    def stashes(**kw):
+        return [r["stash"] for r in history.query(**kw)]
+
+    assert stashes() == ["s3", "s4", "s2", "s1"]
+    assert stashes(repo="/r") == ["s3", "s2", "s1"]
+    assert stashes(repo="/r", path_glob="src/*.py") == ["s2", "s1"]   # GLOB's * crosses "/"
+    assert stashes(path_glob="src/app.py") == ["s4", "s1"]
+    assert stashes(path_glob="*.md", newest_first=False) == ["s1", "s3"]
+    assert stashes(since=200.0, until=260.0) == ["s4", "s2"]
+    assert stashes(limit=2) == ["s3", "s4"]
+    assert stashes(path_glob="nothing/*") == []
+
+def test_at_is_nearest_before(history: History):
+    history.record([row("/r", "s1", 100.0), row("/r", "s2", 200.0), row("/r", "s3", 300.0)])
+    assert [r["stash"] for r in history.at("/r", 250.0)] == ["s2", "s1"]
+    assert history.at("/r", 50.0) == []
+
+def test_repo_of_picks_innermost(history: History, tmp_path: Path):
+    outer, inner = tmp_path / "outer", tmp_path / "outer" / "vendor" / "inner"
+    history.record([row(str(outer), "s1", 1.0), row(str(inner), "s2", 2.0)])
+
+    assert history.repo_of(inner / "src" / "x.py") == str(inner)
+    assert history.repo_of(outer / "vendor") == str(outer)
+    assert history.repo_of(outer) == str(outer)
+    assert history.repo_of(tmp_path) is None
+
+
+def test_record_history_uses_each_job_start(history: History):
+    first = JobResult("/r1", "STASHED", stash_id="s1", message="m1", tree="t1", paths=["a"])
+    second = JobResult("/r2", "STASHED", stash_id="s2", message="m2", tree="t2")
+    untimed = JobResult("/r3", "STASHED", stash_id="s3", message="m3", tree="t3")
+    first.started, second.started = 1010.0, 1042.5
+
+    _record_history(history, [first, second, untimed, JobResult("/r4", "NO_CHANGES")], at=1000.0)
+
+    assert {r["repo"]: r["ts"] for r in history.query()} == {"/r1": 1010.0, "/r2": 1042.5, "/r3": 1000.0}
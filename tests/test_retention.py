@@ -0,0 +1,192 @@
+"""
+Retention on the stash backend against real git.
+
+compact_stashes rewrites the `refs/stash` reflog by hand, so these check what the
+user would notice if it got that wrong: their own stashes disappearing, a reflog git
+can no longer walk, or `git stash` commands failing afterwards.
+"""
+import os
+import shutil
+import subprocess
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional
+
+import pytest
+
+from auto_stash import stash_watcher
+from auto_stash.retention import AUTO_FORMAT, RetentionPolicy, compact_stashes, read_reflog, stash_reflog
+from auto_stash.stash_watcher import JobResult, RepoState, store_lock
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None, reason="git not installed")
+
+NOW = time.mktime((2026, 6, 15, 12, 0, 0, 0, 0, -1))   # local noon, away from bucket edges
+HOUR = 3600
+DAY = 86400
+ZERO = "0" * 40
+
+
+def git(repo: Path, *args: str, when: Optional[float] = None) -> str:
+    env = dict(os.environ, GIT_CONFIG_NOSYSTEM="1", HOME=str(repo.parent),
+               GIT_AUTHOR_NAME="t", GIT_AUTHOR_EMAIL="t@example.com",
+               GIT_COMMITTER_NAME="t", GIT_COMMITTER_EMAIL="t@example.com")
+    if when is not None:
+        # also the time git records in the reflog entry
+        env["GIT_COMMITTER_DATE"] = env["GIT_AUTHOR_DATE"] = f"@{int(when)} +0000"
+    return subprocess.run(["git", *args], cwd=repo, env=env, check=True,
+                          capture_output=True, text=True).stdout
+
+def auto_stash(repo: Path, content: str, when: float, message: Optional[str] = None):
+    # `git stash store` is also how a user gets a message without the "On <branch>: "
+    (repo / "f.txt").write_text(content, encoding="utf-8")
+    sha = git(repo, "stash", "create", when=when).strip()
+    message = message or time.strftime(AUTO_FORMAT, time.localtime(when))
+    git(repo, "stash", "store", "-m", message, sha, when=when)
+    git(repo, "checkout", "--", "f.txt")
+
+def user_stash(repo: Path, content: str, when: float, message: Optional[str] = None):
+    (repo / "f.txt").write_text(content, encoding="utf-8")
+    git(repo, "stash", "push", *(["-m", message] if message else []), when=when)
+
+def stash_list(repo: Path) -> List[str]:
+    return git(repo, "stash", "list", "--format=%gs").splitlines()
+
+def assert_chained(repo: Path):
+    """
+    Each entry's old-oid is the new-oid of the entry before it, and the newest one is
+    what refs/stash points at: the invariant `git reflog delete --rewrite` keeps.
+    """
+    entries = read_reflog(stash_reflog(repo))
+    assert entries[0].old == ZERO
+    for prev, e in zip(entries, entries[1:]):
+        assert e.old == prev.new
+    assert entries[-1].new == git(repo, "rev-parse", "refs/stash").strip()
+
+
+@pytest.fixture
+def repo(tmp_path: Path) -> Path:
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    git(repo, "init", "-q", "-b", "main")
+    (repo / "f.txt").write_text("base\n", encoding="utf-8")
+    git(repo, "add", ".")
+    git(repo, "commit", "-q", "-m", "init")
+    return repo
+
+@pytest.fixture
+def mixed(repo: Path) -> Path:
+    """
+    Auto-stashes 10 days, 3 days and 2 hours old, with the user's own stashes
+    (including two whose messages merely start like ours) in between.
+    """
+    auto_stash(repo, "auto 10d\n", NOW - 10 * DAY)
+    user_stash(repo, "wip\n", NOW - 9 * DAY)
+    auto_stash(repo, "auto 10d later\n", NOW - 10 * DAY + HOUR)
+    user_stash(repo, "mine\n", NOW - 5 * DAY, "my work")
+    auto_stash(repo, "stored\n", NOW - 4 * DAY, "auto-stash before rebase")
+    auto_stash(repo, "auto 3d\n", NOW - 3 * DAY)
+    user_stash(repo, "notes\n", NOW - 2 * DAY, "auto-stash notes")
+    auto_stash(repo, "auto 2h\n", NOW - 2 * HOUR)
+    return repo
+
+
+def test_reflog_times_are_the_stash_times(mixed: Path):
+    entries = read_reflog(stash_reflog(mixed))
+    assert [e.ts for e in entries][0] == int(NOW - 10 * DAY)
+    assert [e.is_auto for e in entries] == [True, False, True, False, False, True, False, True]
+
+
+def test_user_stashes_survive(mixed: Path):
+    before = stash_list(mixed)
+    ours = [m for m in before if m.startswith("auto-stash 2")]
+
+    dropped = compact_stashes(mixed, RetentionPolicy(keep_last=1, hourly=0, daily=0), now=NOW)
+
+    assert dropped == 3
+    after = stash_list(mixed)
+    assert after == [m for m in before if m not in ours[1:]]
+    assert "On main: my work" in after
+    assert "On main: auto-stash notes" in after
+    assert "auto-stash before rebase" in after
+    assert any(m.startswith("WIP on main") for m in after)
+
+
+def test_daily_keeps_newest_of_each_day(mixed: Path):
+    dropped = compact_stashes(mixed, RetentionPolicy(keep_last=1, hourly=0, daily=30), now=NOW)
+
+    # of the two auto-stashes 10 days ago only the later one stays
+    assert dropped == 1
+    contents = [git(mixed, "show", f"stash@{{{i}}}:f.txt") for i in range(len(stash_list(mixed)))]
+    assert "auto 10d later\n" in contents
+    assert "auto 10d\n" not in contents
+
+
+def test_chain_stays_consistent(mixed: Path):
+    head = git(mixed, "rev-parse", "refs/stash")
+    compact_stashes(mixed, RetentionPolicy(keep_last=1, hourly=0, daily=0), now=NOW)
+
+    assert_chained(mixed)
+    assert git(mixed, "rev-parse", "refs/stash") == head   # the ref itself never moves
+    # the oldest entry was dropped: its successor now starts the chain
+    assert read_reflog(stash_reflog(mixed))[0].message.startswith("WIP on main")
+
+
+def test_git_stash_commands_work_afterwards(mixed: Path):
+    compact_stashes(mixed, RetentionPolicy(keep_last=1, hourly=0, daily=0), now=NOW)
+    listed = stash_list(mixed)
+    assert listed[:4] == [time.strftime(AUTO_FORMAT, time.localtime(NOW - 2 * HOUR)),
+                          "On main: auto-stash notes", "auto-stash before rebase", "On main: my work"]
+    assert listed[4].startswith("WIP on main")
+
+    assert "+mine" in git(mixed, "stash", "show", "-p", "stash@{3}")
+    assert "+wip" in git(mixed, "stash", "show", "-p", "stash@{4}")
+
+    git(mixed, "stash", "drop", "stash@{1}")
+    assert stash_list(mixed) == [listed[0]] + listed[2:]
+    assert_chained(mixed)
+
+    git(mixed, "stash", "pop")
+    assert (mixed / "f.txt").read_text(encoding="utf-8") == "auto 2h\n"
+    assert stash_list(mixed) == listed[2:]
+
+
+def test_nothing_to_drop_leaves_reflog_alone(mixed: Path):
+    reflog = stash_reflog(mixed)
+    before = reflog.read_bytes()
+    assert compact_stashes(mixed, RetentionPolicy(keep_last=50), now=NOW) == 0
+    assert reflog.read_bytes() == before
+
+
+def test_held_git_lock_skips(mixed: Path):
+    # a `git stash` in progress holds refs/stash.lock
+    reflog = stash_reflog(mixed)
+    before = reflog.read_bytes()
+    lock = mixed / ".git" / "refs" / "stash.lock"
+    lock.touch()
+
+    with pytest.raises(OSError):
+        compact_stashes(mixed, RetentionPolicy(keep_last=1, hourly=0, daily=0), now=NOW)
+    assert reflog.read_bytes() == before
+    assert lock.exists()   # not ours to remove
+
+
+def test_retention_waits_for_store_lock(mixed: Path, monkeypatch):
+    monkeypatch.setattr(stash_watcher, "log", lambda msg, with_timestamp=True: None)
+    reflog = stash_reflog(mixed)
+    before = reflog.read_bytes()
+    policy = RetentionPolicy(keep_last=1, hourly=0, daily=0)
+    res = JobResult(str(mixed), "STASHED")
+
+    with store_lock(mixed):
+        t = threading.Thread(target=stash_watcher._apply_retention,
+                             args=(mixed, RepoState(), res, policy, "stash"))
+        t.start()
+        t.join(0.3)
+        assert t.is_alive()   # another job is writing to this object store
+        assert reflog.read_bytes() == before
+    t.join(10)
+
+    assert not t.is_alive()
+    assert len(stash_list(mixed)) == 5
+    assert_chained(mixed)
@@ -0,0 +1,170 @@
+"""
+The per-repo adaptive scheduler: due order, backoff, jitter and overrides.
+"""
+import random
+from pathlib import Path
+
+import pytest
+
+from auto_stash.scheduler import Scheduler
+
+A, B, C = Path("/r/a"), Path("/r/b"), Path("/r/c")
+
+
+def steady(**kw) -> Scheduler:
+    # no jitter: due times are exact
+    kw.setdefault("jitter", 0)
+    return Scheduler(60, rng=random.Random(0), **kw)
+
+def interval(s: Scheduler, path: Path) -> float:
+    return s._repos[path].interval
+
+
+def test_pop_due_in_due_order():
+    s = steady()
+    for p in (A, B, C):
+        s.add(p, 0)
+    assert s.pop_due(0) == [A, B, C]   # same due time: in the order they were added
+
+    s.reschedule(A, "ERROR", 0, delay=30)
+    s.reschedule(B, "ERROR", 0, delay=10)
+    s.reschedule(C, "ERROR", 0, delay=20)
+    assert s.next_due() == 10
+    assert s.pop_due(5) == []
+    assert s.pop_due(20) == [B, C]
+    assert s.pop_due(25, window=5) == [A]
+    assert s.next_due() is None
+
+def test_popped_repos_wait_for_reschedule():
+    s = steady()
+    s.add(A, 0)
+    assert s.pop_due(0) == [A]
+    assert s.pop_due(1000) == []   # still registered, but not due until put back
+    assert A in s and len(s) == 1
+    s.reschedule(A, "NO_CHANGES", 1000)
+    assert s.pop_due(1120) == [A]
+
+def test_reschedule_replaces_the_old_entry():
+    s = steady()
+    s.add(A, 0)
+    s.add(B, 0)
+    s.trigger(B, 0)
+    s.reschedule(A, "ERROR", 0, delay=50)   # A was never popped: the 0 entry goes stale
+    assert s.pop_due(40) == [B]
+    assert s.due(A) == 50
+    assert s.pop_due(50) == [A]
+
+def test_remove_and_trigger():
+    s = steady()
+    s.add(A, 0)
+    s.add(B, 0)
+    s.pop_due(0)
+    s.reschedule(A, "NO_CHANGES", 0)
+    s.reschedule(B, "NO_CHANGES", 0)
+    s.remove(A)
+    assert A not in s and s.due(A) is None
+    s.trigger(A, 5)   # no longer scheduled: ignored
+    s.trigger(B, 5)
+    assert s.pop_due(5) == [B]
+    assert interval(s, B) == 120   # a trigger doesn't touch the interval
+
+
+def test_idle_backoff_is_capped():
+    s = steady(max_interval=500)
+    s.add(A, 0)
+    seen = []
+    now = 0.0
+    for _ in range(8):
+        s.pop_due(now)
+        s.reschedule(A, "NO_CHANGES", now)
+        seen.append(interval(s, A))
+        now = s.due(A)
+    assert seen == [120, 240, 480, 500, 500, 500, 500, 500]
+    assert now == 120 + 240 + 480 + 500 * 5
+
+def test_stash_ends_the_backoff():
+    s = steady(min_interval=10, max_interval=960)
+    s.add(A, 0)
+    for _ in range(6):
+        s.reschedule(A, "NO_CHANGES", 0)
+    assert interval(s, A) == 960
+
+    # the repo is being edited again: the interval comes straight back down
+    steps = []
+    for _ in range(8):
+        s.reschedule(A, "STASHED", 0)
+        steps.append(interval(s, A))
+    assert steps == [480, 240, 120, 60, 30, 15, 10, 10]
+
+def test_errors_reset_to_base_and_deferrals_keep_interval():
+    s = steady()
+    s.add(A, 0)
+    s.reschedule(A, "NO_CHANGES", 0)
+    s.reschedule(A, "NO_CHANGES", 0)
+    s.reschedule(A, "DEFERRED", 0, delay=3)
+    assert interval(s, A) == 240 and s.due(A) == 3
+    s.reschedule(A, "PAUSED", 0)
+    assert interval(s, A) == 240
+    s.reschedule(A, "ERROR", 0)
+    assert interval(s, A) == 60
+
+def test_default_limits():
+    s = steady()
+    s.add(A, 0)
+    for _ in range(20):
+        s.reschedule(A, "NO_CHANGES", 0)
+    assert interval(s, A) == 60 * 8
+    for _ in range(20):
+        s.reschedule(A, "STASHED", 0)
+    assert interval(s, A) == 60 / 4
+
+
+def test_jitter_stays_in_bounds_and_spreads():
+    s = Scheduler(100, jitter=0.1, rng=random.Random(42))
+    paths = [Path(f"/r/{i}") for i in range(200)]
+    for p in paths:
+        s.add(p, 1000)
+    first = [s.due(p) for p in paths]
+    # first runs spread over [now, now + jitter * interval]
+    assert all(1000 <= d <= 1010 for d in first)
+    assert len(set(first)) == len(paths)
+
+    s.pop_due(2000)
+    for p in paths:
+        s.reschedule(p, "ERROR", 2000)
+    later = [s.due(p) - 2000 for p in paths]
+    assert all(90 <= d <= 110 for d in later)
+    assert max(later) - min(later) > 10
+
+def test_jitter_is_reproducible_with_a_seed():
+    def dues(seed):
+        s = Scheduler(100, rng=random.Random(seed))
+        for i in range(10):
+            s.add(Path(f"/r/{i}"), 0)
+        return [s.due(Path(f"/r/{i}")) for i in range(10)]
+    assert dues(7) == dues(7)
+    assert dues(7) != dues(8)
+
+
+def test_overrides():
+    s = steady(overrides={str(A): {"interval": 10, "max_interval": 15}})
+    s.add(A, 0)
+    s.add(B, 0)
+    for _ in range(3):
+        s.reschedule(A, "NO_CHANGES", 0)
+        s.reschedule(B, "NO_CHANGES", 0)
+    assert interval(s, A) == 15
+    assert interval(s, B) == 480
+
+@pytest.mark.parametrize("changed, expected_due", [(True, 30), (False, 480)])
+def test_retune(changed: bool, expected_due: float):
+    s = steady()
+    s.add(A, 0)
+    for _ in range(3):
+        s.reschedule(A, "NO_CHANGES", 0)
+    assert s.due(A) == 480
+
+    s.retune(30 if changed else 60, jitter=0, now=0)
+    # new limits: restart from the new base, pulled in; same limits: left alone
+    assert s.due(A) == expected_due
+    assert interval(s, A) == (30 if changed else 480)
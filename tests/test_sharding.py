@@ -0,0 +1,194 @@
+"""
+Rendezvous assignment of repos to `watch --shard i/n` workers, heartbeats and leases.
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from auto_stash.sharding import LEASE_NAME, Shard, ShardBusy, owner_of, parse_shard
+
+PATHS = [Path(f"/src/team{i % 7}/repo{i}") for i in range(300)]
+
+
+def workers(directory: Path, count: int, **kw):
+    return [Shard(i, count, directory, **kw) for i in range(count)]
+
+def repo(tmp_path: Path, name: str) -> Path:
+    path = tmp_path / name
+    (path / ".git").mkdir(parents=True)   # all a lease needs
+    return path
+
+def lease_of(path: Path) -> dict:
+    return json.loads((path / ".git" / LEASE_NAME).read_text(encoding="utf-8"))
+
+def age_heartbeat(shard: Shard, seconds: float):
+    beat = shard._beat_file(shard.index)
+    data = json.loads(beat.read_text(encoding="utf-8"))
+    data["time"] -= seconds
+    beat.write_text(json.dumps(data), encoding="utf-8")
+
+
+@pytest.mark.parametrize("value, expected", [("1/1", (0, 1)), ("2/4", (1, 4)), ("4/4", (3, 4))])
+def test_parse_shard(value, expected):
+    assert parse_shard(value) == expected
+
+@pytest.mark.parametrize("value", ["0/4", "5/4", "1", "a/b", "1/2/3", ""])
+def test_parse_shard_rejects(value):
+    with pytest.raises(ValueError):
+        parse_shard(value)
+
+
+@pytest.mark.parametrize("count", [1, 2, 3, 8])
+def test_every_repo_has_exactly_one_owner(tmp_path: Path, count: int):
+    shards = workers(tmp_path, count)
+    for s in shards:
+        s.assign(PATHS)
+
+    for p in PATHS:
+        assert sum(s.owns(p) for s in shards) == 1
+    if count > 1:
+        # and the split is not lopsided
+        assert all(len(s.owned) > len(PATHS) / count / 2 for s in shards)
+
+def test_assignment_is_stable():
+    # blake2b, not hash(): every process and machine computes the same owner
+    assert [owner_of(str(p), range(4)) for p in PATHS] == [owner_of(str(p), [3, 2, 1, 0]) for p in PATHS]
+    assert owner_of("/src/team0/repo0", range(4)) == owner_of("/src/team0/repo0", {0, 1, 2, 3})
+
+def test_only_a_gone_workers_repos_move(tmp_path: Path):
+    before = {str(p): owner_of(str(p), range(4)) for p in PATHS}
+    after = {str(p): owner_of(str(p), {0, 1, 3}) for p in PATHS}
+
+    moved = [p for p in before if before[p] != after[p]]
+    assert moved and all(before[p] == 2 for p in moved)
+    assert all(after[p] == before[p] for p in before if before[p] != 2)
+
+    s = Shard(0, 4, tmp_path)
+    s.assign(PATHS)
+    s.live = {0, 1, 3}
+    gained, lost = s.assign(PATHS)
+    assert not lost
+    assert gained and all(before[str(p)] == 2 for p in gained)
+
+
+def test_heartbeats_mark_silent_workers_gone(tmp_path: Path):
+    a, b = workers(tmp_path, 2, heartbeat=1, timeout=5)
+    now = time.time()
+    a.start()
+    b.start()
+    assert b.live == {0, 1}
+
+    age_heartbeat(a, 100)
+    assert b.beat(now + 10)   # live set changed
+    assert b.live == {1}
+    b.assign(PATHS)
+    assert len(b.owned) == len(PATHS)
+
+def test_second_worker_for_a_shard_is_refused(tmp_path: Path):
+    Shard(0, 2, tmp_path).start()
+    with pytest.raises(ShardBusy):
+        Shard(0, 2, tmp_path).start()
+
+def test_stale_heartbeat_frees_the_shard(tmp_path: Path):
+    first = Shard(0, 2, tmp_path, heartbeat=1, timeout=5)
+    first.start()
+    age_heartbeat(first, 100)
+    Shard(0, 2, tmp_path, heartbeat=1, timeout=5).start()
+
+
+def test_live_lease_is_respected(tmp_path: Path):
+    path = repo(tmp_path, "r")
+    a, b = workers(tmp_path / "shards", 2)
+    a.start()
+    b.start()
+
+    assert a.acquire(path) is None
+    assert a.acquire(path) is None   # renewing our own lease
+    holder = b.acquire(path)
+    assert holder is not None and a.token in holder
+    assert lease_of(path)["token"] == a.token
+
+def test_stale_lease_is_taken_over(tmp_path: Path):
+    path = repo(tmp_path, "r")
+    a, b = workers(tmp_path / "shards", 2, heartbeat=1, timeout=5)
+    a.start()
+    b.start()
+    assert a.acquire(path) is None
+
+    age_heartbeat(a, 100)   # a stopped beating without releasing
+    b.beat(time.time() + 10)
+    assert b.acquire(path) is None
+    assert lease_of(path) == {"shard": "2/2", "token": b.token}
+
+def test_lease_of_a_dead_local_process_is_taken_over(tmp_path: Path):
+    path = repo(tmp_path, "r")
+    a, b = workers(tmp_path / "shards", 2)
+    a.start()
+    b.start()
+    assert a.acquire(path) is None
+
+    # same host, fresh heartbeat, but the pid no longer exists
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    host, _, rest = a.token.partition(":")
+    dead = f"{host}:{proc.pid}:{rest.split(':')[1]}"
+    (path / ".git" / LEASE_NAME).write_text(json.dumps({"shard": "1/2", "token": dead}), encoding="utf-8")
+    beat = a._beat_file(0)
+    beat.write_text(json.dumps({"shard": "1/2", "token": dead, "time": time.time()}), encoding="utf-8")
+    b._last_beat = 0.0
+    b.beat(time.time())
+
+    assert b.acquire(path) is None
+    assert lease_of(path)["token"] == b.token
+
+def test_garbage_lease_is_replaced(tmp_path: Path):
+    path = repo(tmp_path, "r")
+    (path / ".git" / LEASE_NAME).write_text("{not json", encoding="utf-8")
+    s = Shard(0, 1, tmp_path / "shards")
+    s.start()
+    assert s.acquire(path) is None
+    assert lease_of(path)["token"] == s.token
+
+def test_not_a_repo_needs_no_lease(tmp_path: Path):
+    s = Shard(0, 1, tmp_path / "shards")
+    assert s.acquire(tmp_path / "plain") is None
+
+
+def test_lost_repos_and_close_give_everything_up(tmp_path: Path):
+    paths = [repo(tmp_path, f"r{i}") for i in range(20)]
+    a, b = workers(tmp_path / "shards", 2)
+    a.start()
+    b.start()
+    a.live = {0}
+    a.assign(paths)
+    for p in paths:
+        assert a.acquire(p) is None
+
+    # b shows up: a releases what b now owns, keeps the rest
+    a.live = {0, 1}
+    _, lost = a.assign(paths)
+    assert lost
+    assert all(not (p / ".git" / LEASE_NAME).exists() for p in lost)
+    kept = [p for p in paths if p not in lost]
+    assert all(lease_of(p)["token"] == a.token for p in kept)
+
+    a.close()
+    assert all(not (p / ".git" / LEASE_NAME).exists() for p in paths)
+    assert not a._beat_file(0).exists()
+    assert b._beat_file(1).exists()
+
+def test_release_leaves_someone_elses_lease(tmp_path: Path):
+    path = repo(tmp_path, "r")
+    a, b = workers(tmp_path / "shards", 2)
+    a.start()
+    assert a.acquire(path) is None
+    (path / ".git" / LEASE_NAME).write_text(json.dumps({"shard": "2/2", "token": b.token}),
+                                            encoding="utf-8")
+    a.release(path)
+    assert lease_of(path)["token"] == b.token
+    assert os.path.exists(path / ".git" / LEASE_NAME)
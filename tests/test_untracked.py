@@ -0,0 +1,135 @@
+"""
+The untracked-file pre-scan: exclude globs, size parsing and the size caps.
+"""
+from pathlib import Path
+
+import pytest
+
+from auto_stash.untracked import DEFAULT_EXCLUDE, UntrackedFilter, parse_size
+
+
+def only(*exclude: str) -> UntrackedFilter:
+    return UntrackedFilter(exclude, max_file_size=None, max_total_size=None)
+
+def make(root: Path, sizes: dict):
+    for rel, size in sizes.items():
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"x" * size)
+
+
+@pytest.mark.parametrize("value, expected", [
+    (50, 50),
+    (1.5, 1),
+    ("50", 50),
+    ("4K", 4096),
+    ("50M", 50 * 1024 ** 2),
+    ("1.5G", 3 * 1024 ** 3 // 2),
+    ("512KiB", 512 * 1024),
+    ("2mb", 2 * 1024 ** 2),
+    (" 1 T ", 1024 ** 4),
+    (0, None),
+    ("0", None),
+    ("0M", None),
+    (None, None),
+    (False, None),
+])
+def test_parse_size(value, expected):
+    assert parse_size(value) == expected
+
+@pytest.mark.parametrize("value", ["", "M", "ten", "5X", "-1", "1.5.2K"])
+def test_parse_size_rejects(value):
+    with pytest.raises(ValueError):
+        parse_size(value)
+
+
+@pytest.mark.parametrize("rel, hit", [
+    ("app.log", True),
+    ("deep/in/tree/app.log", True),
+    ("logs.txt", False),
+    ("old.log/readme", True),         # a component glob matches directory names too
+])
+def test_component_glob(rel, hit):
+    assert only("*.log").excluded(rel) is hit
+
+@pytest.mark.parametrize("rel, hit", [
+    ("node_modules/pkg/index.js", True),
+    ("web/node_modules/pkg/index.js", True),
+    ("node_modules", False),          # a file of that name is not the directory
+    ("src/node_modules.txt", False),
+])
+def test_directory_glob(rel, hit):
+    assert only("node_modules/").excluded(rel) is hit
+
+@pytest.mark.parametrize("rel, hit", [
+    ("out/a.bin", True),
+    ("out/sub/a.bin", True),
+    ("src/out/a.bin", False),         # rooted: only `out` at the top
+    ("docs/manual.pdf", True),
+    ("docs/manual.txt", False),
+    ("guide/docs/manual.pdf", False),
+])
+def test_rooted_glob(rel, hit):
+    assert only("/out", "docs/*.pdf").excluded(rel) is hit
+
+def test_nested_repo_entry(tmp_path: Path):
+    # git lists an untracked nested repo as "x/"; directory globs apply to it
+    assert only("vendor/").excluded("vendor/")
+    assert only("vendor/").excluded("third_party/vendor/")
+    assert not only("vendor/").excluded("x/")
+
+    make(tmp_path, {"a.txt": 1})
+    (tmp_path / "x" / ".git").mkdir(parents=True)
+    files, skip = only().select(tmp_path, ["a.txt", "x/"])
+    assert files == ["a.txt"]
+    assert not skip   # not counted as left out: it is never ours to snapshot
+
+def test_default_excludes(tmp_path: Path):
+    flt = UntrackedFilter.from_config(None)
+    assert flt.exclude == DEFAULT_EXCLUDE
+    assert flt.excluded("web/node_modules/x.js")
+    assert flt.excluded("pkg/__pycache__/m.cpython-38.pyc")
+    assert not flt.excluded("src/build.py")
+    assert not UntrackedFilter.from_config({"default_exclude": False}).excluded("build/x")
+
+
+def test_file_size_cap(tmp_path: Path):
+    make(tmp_path, {"small.txt": 100, "edge.txt": 1000, "big.bin": 1001})
+    flt = UntrackedFilter((), max_file_size=1000, max_total_size=None)
+
+    files, skip = flt.select(tmp_path, ["small.txt", "edge.txt", "big.bin"])
+
+    assert files == ["small.txt", "edge.txt"]
+    assert (skip.too_large, skip.skipped_bytes, skip.over_budget) == (1, 1001, 0)
+    assert skip.describe(flt) == "untracked files left out: 1 over 1000 B (1001 B)"
+
+def test_total_budget_packs_smallest_first(tmp_path: Path):
+    make(tmp_path, {"d.bin": 50, "a.txt": 10, "c.txt": 30, "b.txt": 20})
+    flt = UntrackedFilter((), max_file_size=None, max_total_size=60)
+
+    files, skip = flt.select(tmp_path, ["d.bin", "a.txt", "c.txt", "b.txt"])
+
+    # 10 + 20 + 30 fill the budget; the 50-byte file, listed first, is the one left out
+    assert files == ["a.txt", "c.txt", "b.txt"]
+    assert (skip.over_budget, skip.skipped_bytes) == (1, 50)
+
+def test_caps_and_excludes_together(tmp_path: Path):
+    make(tmp_path, {"keep.txt": 10, "huge.iso": 10 ** 6, "big.bin": 500, "mid.bin": 200,
+                    "build/out.o": 5})
+    flt = UntrackedFilter.from_config({"exclude": ["*.iso"], "max_file_size": 400,
+                                       "max_total_size": 100})
+    rels = ["keep.txt", "huge.iso", "big.bin", "mid.bin", "build/out.o", "gone.txt"]
+
+    files, skip = flt.select(tmp_path, rels)
+
+    assert files == ["keep.txt"]
+    # excluded files are never stat'ed, so their size doesn't count; gone.txt is just dropped
+    assert (skip.excluded, skip.too_large, skip.over_budget) == (2, 1, 1)
+    assert skip.skipped_bytes == 700
+    assert skip.describe(flt) == ("untracked files left out: 2 excluded, 1 over 400 B, "
+                                  "1 past the 100 B snapshot cap (700 B)")
+
+def test_no_caps_keeps_order(tmp_path: Path):
+    make(tmp_path, {"b": 2, "a": 1})
+    files, skip = only().select(tmp_path, ["b", "a"])
+    assert files == ["b", "a"] and not skip